@@ -1 +1,8 @@
-from .pmgen import main as gen
\ No newline at end of file
+from .importhook import install_import_hook, uninstall_import_hook
+
+
+def gen():
+    # Imported here rather than at the top, so that "pmgen.py" (& the modules
+    # that it imports) can also be run using `python -m nim_pm.<module>`.
+    from .pmgen import main
+    main()
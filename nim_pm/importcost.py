@@ -0,0 +1,100 @@
+# Copyright (c) 2015 SnapDisco Pty Ltd, Australia.
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# [ MIT license: https://opensource.org/licenses/MIT ]
+
+"""Measure the cost of importing Python modules (such as Pymod Python modules).
+
+Usage:
+
+    python -m nim_pm.importcost [--repeat N] [--call FUNC] MODULE...
+
+Each module is imported in a fresh Python process (so nothing is already
+loaded), N times, and the minimum & median wall-clock time of the import is
+reported.  If `--call FUNC` is supplied, the time of the first call of the
+function `MODULE.FUNC()` (which includes any deferred initialisation, if the
+Python module was built using "pmgen --lazyInit") is also reported.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+# Run in the fresh Python process.  Prints a JSON object of timings.
+MEASURE_SCRIPT = """
+import importlib, sys, time
+start = time.time()
+mod = importlib.import_module(sys.argv[1])
+timings = dict(import_time=time.time() - start)
+if len(sys.argv) > 2:
+    func = getattr(mod, sys.argv[2])
+    start = time.time()
+    func()
+    timings["first_call_time"] = time.time() - start
+import json  # Not before the import being measured (which might import it).
+print(json.dumps(timings))
+"""
+
+
+def measure_import(mod_name, call_func_name=None):
+    """Import `mod_name` in a fresh Python process; return a dict of timings."""
+    command = [sys.executable, "-c", MEASURE_SCRIPT, mod_name]
+    if call_func_name:
+        command.append(call_func_name)
+    output = subprocess.check_output(command, universal_newlines=True)
+    # Only the last line is ours; the module might print things.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def get_median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m nim_pm.importcost",
+            description="Measure the cost of importing Python modules.")
+    parser.add_argument('modules', nargs="+", metavar="MODULE")
+    parser.add_argument('--repeat', dest="repeat", default=5, type=int, metavar="N")
+    parser.add_argument('--call', dest="call", default=None, metavar="FUNC",
+            help="also measure the first call of this (argument-less) function")
+    args = parser.parse_args()
+
+    for mod_name in args.modules:
+        measurements = [measure_import(mod_name, args.call) for i in range(args.repeat)]
+        parts = []
+        for key, label in [("import_time", "import"), ("first_call_time", "first call")]:
+            values = [m[key] for m in measurements if key in m]
+            if values:
+                parts.append("%s: min %.2fms, median %.2fms" %
+                        (label, min(values) * 1000.0, get_median(values) * 1000.0))
+        print("%s: %s" % (mod_name, "; ".join(parts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# Copyright (c) 2015 SnapDisco Pty Ltd, Australia.
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# [ MIT license: https://opensource.org/licenses/MIT ]
+
+"""Compile Pymod Nim modules automatically, the first time they are imported.
+
+Usage:
+
+    import nim_pm
+    nim_pm.install_import_hook()
+
+    import foo  # Compiles "foo.nim" (unless a cached build already exists).
+
+The compiled Python module is stored in a per-user cache directory, in a
+subdirectory named by a hash of the Nim source code, the "pymod.cfg" file
+(if any), the Pymod sources, the version of the Nim compiler & the Python ABI.
+So the Nim module is only re-compiled when one of these changes, or when it is
+imported by a different version of Python.  Other (local) Nim modules that the
+Nim module imports or includes are NOT found automatically:  List them in
+`depends`, so that they are also part of the hash.
+
+The build of each cache entry is protected by a file lock, so if many worker
+processes import the same Nim module concurrently, exactly one of them will
+compile it; the others wait for the build to finish, then load the result.
+
+Note:  The import hook requires Python 3.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import sysconfig
+
+
+NIM_MOD_FNAME_SUFFIX = ".nim"
+COMPILED_MOD_FNAME_SUFFIX = ".so"
+PYMOD_CFG_FNAME = "pymod.cfg"
+
+CACHE_DIR_ENV_VAR = "NIM_PM_CACHE_DIR"
+CACHE_DIR_DEFAULT_RELPATH = os.path.join(".cache", "nim_pm")
+CACHE_LOCK_FNAME = "build.lock"
+CACHE_BUILD_DIRNAME = "build"
+CACHE_OUTPUT_DIRNAME = "output"
+
+
+def get_cache_dir(*subdirs):
+    """Return (and create, if necessary) a directory in the per-user cache.
+
+    The location of the cache can be overridden using the environment variable
+    `NIM_PM_CACHE_DIR`.  Otherwise, it follows the XDG Base Directory spec.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+    if not cache_dir:
+        xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+        if xdg_cache_home:
+            cache_dir = os.path.join(xdg_cache_home, "nim_pm")
+        else:
+            cache_dir = os.path.join(os.path.expanduser("~"), CACHE_DIR_DEFAULT_RELPATH)
+
+    cache_dir = os.path.join(cache_dir, *subdirs)
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        # Another process might have created it in the meantime.
+        if not os.path.isdir(cache_dir):
+            raise
+    return cache_dir
+
+
+def get_python_abi_tag():
+    """Return a string that identifies the ABI of the running Python."""
+    soabi = sysconfig.get_config_var("SOABI")
+    if soabi:
+        return soabi
+    python_ver = sys.version_info
+    return "python%d.%d-%s" % (python_ver.major, python_ver.minor, sys.platform)
+
+
+# The hash of the Nim compiler version & the Pymod sources (which don't change
+# while this process is running).
+_toolchain_key = None
+
+
+def find_pymod_path():
+    """Return the directory of the Pymod Nim package (or None, if not found)."""
+    try:
+        output = subprocess.check_output(["nimble", "path", "pymod"],
+                stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    lines = output.decode("UTF-8", "replace").strip().splitlines()
+    if not lines or not os.path.isdir(lines[-1].strip()):
+        return None
+    return lines[-1].strip()
+
+
+def get_toolchain_key():
+    """Return a hash of the Nim compiler version & the Pymod sources.
+
+    (If either can't be found, then "pmgen" will fail anyway.)
+    """
+    global _toolchain_key
+    if _toolchain_key is not None:
+        return _toolchain_key
+
+    h = hashlib.sha256()
+    try:
+        h.update(subprocess.check_output(["nim", "--version"], stderr=subprocess.STDOUT))
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    h.update(b"\0")
+
+    pymod_path = find_pymod_path()
+    if pymod_path is not None:
+        for dirpath, dirnames, fnames in os.walk(pymod_path):
+            # Sorted, so that the hash doesn't depend upon the order of the walk.
+            dirnames.sort()
+            for fname in sorted(fnames):
+                if not fname.endswith((".nim", ".c", ".h", ".cfg")):
+                    continue
+                full_fname = os.path.join(dirpath, fname)
+                h.update(os.path.relpath(full_fname, pymod_path).encode("UTF-8"))
+                h.update(b"\0")
+                with open(full_fname, "rb") as f:
+                    h.update(f.read())
+                h.update(b"\0")
+
+    _toolchain_key = h.hexdigest()
+    return _toolchain_key
+
+
+def get_cache_key(nim_fname, mod_name, pmgen_args=(), depends=()):
+    """Return a hash of everything that determines the compiled module.
+
+    Any `depends` (eg, other Nim modules imported by `nim_fname`) are hashed
+    along with `nim_fname` itself.  Nim modules imported by `nim_fname` are
+    not found automatically, so they must be listed in `depends`.
+    """
+    h = hashlib.sha256()
+    for s in [mod_name, get_python_abi_tag(), get_toolchain_key()] + list(pmgen_args):
+        h.update(s.encode("UTF-8"))
+        h.update(b"\0")
+
+    for fname in [nim_fname, os.path.join(os.path.dirname(nim_fname), PYMOD_CFG_FNAME)] + \
+            list(depends):
+        if os.path.exists(fname):
+            with open(fname, "rb") as f:
+                h.update(f.read())
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+class FileLock(object):
+    """An exclusive, inter-process lock on a file, for use as a context manager."""
+
+    def __init__(self, lock_fname):
+        self._lock_fname = lock_fname
+        self._f = None
+
+    def __enter__(self):
+        # Deferred, so that merely importing `nim_pm` works on Windows (which
+        # has no `fcntl`).
+        import fcntl
+        self._f = open(self._lock_fname, "a")
+        # This blocks until any other process has released the lock.
+        fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import fcntl
+        fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        self._f.close()
+        self._f = None
+
+
+def run_pmgen(nim_fname, mod_name, build_dir, output_dir, pmgen_args=(), verbose=False):
+    """Run "pmgen" to compile `nim_fname`, in build directory `build_dir`.
+
+    The compiled Python module `mod_name` is moved into `output_dir`.
+    ("pmgen" is run in the directory that contains `nim_fname`, so that it
+    reads the "pymod.cfg" in that directory, if any.)
+    """
+    nim_dirname = os.path.dirname(nim_fname)
+    pmgen_command = [sys.executable, "-m", "nim_pm.pmgen",
+            "--pymodName", mod_name, "--buildDir", build_dir, "--outputDir", output_dir] + \
+            list(pmgen_args) + [os.path.basename(nim_fname)]
+    if verbose:
+        print(" ".join(pmgen_command))
+        subprocess.check_call(pmgen_command, cwd=nim_dirname)
+        return
+
+    proc = subprocess.Popen(pmgen_command, cwd=nim_dirname,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise ImportError("unable to compile Nim module %s (pmgen exit status %d):\n%s" %
+                (nim_fname, proc.returncode, output.decode("UTF-8", "replace")))
+
+
+def build_nim_module(nim_fname, mod_name, pmgen_args=(), verbose=False, depends=()):
+    """Compile the Nim module `nim_fname` into the cache, unless it's already
+    there.  Return the filename of the compiled Python module in the cache.
+    """
+    nim_fname = os.path.abspath(nim_fname)
+    cache_dir = get_cache_dir(get_cache_key(nim_fname, mod_name, pmgen_args, depends))
+    compiled_fname = os.path.join(cache_dir, mod_name + COMPILED_MOD_FNAME_SUFFIX)
+
+    # The compiled module is only ever moved into place once it's complete,
+    # so if it exists, it can be used without waiting for the lock.
+    if os.path.exists(compiled_fname):
+        return compiled_fname
+
+    with FileLock(os.path.join(cache_dir, CACHE_LOCK_FNAME)):
+        # Another process might have built it while we waited for the lock.
+        if os.path.exists(compiled_fname):
+            return compiled_fname
+
+        # Build in the cache (rather than alongside the Nim module), so that
+        # builds for different Pythons can't collide.
+        build_dir = os.path.join(cache_dir, CACHE_BUILD_DIRNAME)
+        output_dir = os.path.join(cache_dir, CACHE_OUTPUT_DIRNAME)
+        try:
+            run_pmgen(nim_fname, mod_name, build_dir, output_dir, pmgen_args, verbose)
+            os.rename(os.path.join(output_dir, mod_name + COMPILED_MOD_FNAME_SUFFIX),
+                    compiled_fname)
+        finally:
+            # Even if the build failed, so failed imports don't accumulate.
+            shutil.rmtree(build_dir, ignore_errors=True)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    return compiled_fname
+
+
+class NimImportFinder(object):
+    """A meta-path finder that compiles "foo.nim" when `foo` is imported."""
+
+    def __init__(self, pmgen_args=(), verbose=False, depends=()):
+        self.pmgen_args = list(pmgen_args)
+        self.verbose = verbose
+        self.depends = [os.path.abspath(fname) for fname in depends]
+
+    def find_spec(self, fullname, path, target=None):
+        # Deferred, so that merely importing `nim_pm` works in Python 2.
+        import importlib.machinery
+        import importlib.util
+
+        mod_name = fullname.rpartition(".")[2]
+        for dirname in (path if path is not None else sys.path):
+            if not isinstance(dirname, str):
+                continue
+            nim_fname = os.path.join(dirname or os.getcwd(), mod_name + NIM_MOD_FNAME_SUFFIX)
+            if not os.path.isfile(nim_fname):
+                continue
+
+            compiled_fname = build_nim_module(nim_fname, mod_name,
+                    self.pmgen_args, self.verbose, self.depends)
+            loader = importlib.machinery.ExtensionFileLoader(fullname, compiled_fname)
+            return importlib.util.spec_from_file_location(fullname, compiled_fname,
+                    loader=loader)
+
+        return None
+
+
+def install_import_hook(pmgen_args=(), verbose=False, depends=()):
+    """Install (and return) a `NimImportFinder` at the end of `sys.meta_path`.
+
+    Any `pmgen_args` (eg, `["--release", "--pyarrayEnabled"]`) will be passed
+    to "pmgen" when compiling a Nim module; they are also part of the cache key.
+    Any `depends` (eg, local Nim modules imported by the Nim modules) are
+    hashed into the cache key of every Nim module that is compiled.
+    """
+    finder = NimImportFinder(pmgen_args, verbose, depends)
+    sys.meta_path.append(finder)
+    return finder
+
+
+def uninstall_import_hook(finder):
+    """Remove a `NimImportFinder` that was returned by `install_import_hook`."""
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
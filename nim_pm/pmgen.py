@@ -42,23 +42,53 @@ from __future__ import print_function
 
 import datetime
 import glob
+import hashlib
 import os
+import platform
 import re
-#import shutil
+import shutil
 import subprocess
 import sys
 import argparse
 import textwrap
-
+import time
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
+
+from .importhook import get_cache_dir, get_python_abi_tag
+from .timing import BuildTimer
 from .usefulconfigparser import UsefulConfigParser
 
 
 NIM_COMPILER_EXE_PATH = "nim"
 NIM_COMPILER_FLAGS = []
-NIM_COMPILER_FLAG_OPTIONS = dict(
-        nimSetIsRelease=["-d:release"],
+# The named build profiles, which may be selected using "--profile" on the
+# command-line, or using "nimSetBuildProfile" in "pymod.cfg".
+# Since the "passC" & "passL" flags apply to every C file in the build, the
+# "lto" profile also applies to the auto-generated "pmgen*_capi.c" files, so
+# the C-API wrapper functions can be inlined into the Nim procs they call.
+BUILD_PROFILES = dict(
+        debug=[],
+        release=["-d:release"],
+        danger=["-d:release", "-d:danger", "--checks:off", "--assertions:off"],
+        lto=["-d:release", "--passC:-flto", "--passL:-flto"],
 )
+BUILD_PROFILE_DEFAULT = "debug"
 NIM_COMPILER_COMMAND = "%s %%s %s" % (NIM_COMPILER_EXE_PATH, " ".join(NIM_COMPILER_FLAGS))
+# If "--timingReport" is specified, each Nim compiler invocation appends a
+# record of its timing to this file (in the build directory).
+TIMING_RECORD_FNAME = None
+TIMING_RECORD_BASENAME = "timing-records.jsonl"
+
+# The Pymod config (from the "pymod.cfg" & "pymod-extensions.cfg" files),
+# which is read by `main`.
+CONFIG = None
+
+# Extra flags for the compilation of the generated Nim wrappers (but not for
+# the pmgen phase), such as the profile-guided optimisation flags.
+NIM_WRAPPER_EXTRA_FLAGS = []
 
 # For the Makefiles.
 NIM_DEFINED_SYMBOLS_MAKE = "pmgen".split()
@@ -66,6 +96,9 @@ NIM_SYMBOL_DEFS_MAKE = " ".join("--define:%s" % s for s in NIM_DEFINED_SYMBOLS_M
 
 
 MAKE_EXE_PATH = "make"
+NINJA_EXE_PATH = "ninja"
+LLVM_PROFDATA_EXE_PATH = "llvm-profdata"
+C_COMPILER_EXE_PATH = os.environ.get("CC", "cc")
 
 NUMPY_C_INCLUDE_RELPATH = "core/include"
 
@@ -75,22 +108,347 @@ NIM_CFG_CONTENT = """# Auto-generated by "pmgen.py" on %(datestamp)s.
 # Any changes will be overwritten by the next run of "pmgen.py".
 %(python_cincludes)s
 %(nim_symbol_defs)s
-listCmd
-nimcache:"nimcache"
-parallelBuild:"1"
-passC:"-Wall -O3 -fPIC"
-passL:"-O3 %(python_ldflags)s -fPIC"
+nimcache:"%(nimcache_dir)s"
+cincludes:"%(nimcache_dir)s"
 %(any_other_module_paths)s
-verbosity:"2"
+%(c_compiler_launchers)s
+
+# Options from the [all] section of "pymod-extensions.cfg" & "pymod.cfg".
+%(nim_cfg_options)s
 """
 
+# The options in the [Python] section of "pymod-extensions.cfg" & "pymod.cfg"
+# are written to this file, which is read by the Pymod macros (through the
+# Nim symbol "pymodWrapperCfg") when they create each "pmgen*_wrap.nim.cfg".
+# (There's no datestamp, since this content is copied into those files.)
+WRAPPER_CFG_FNAME = "pymod_wrapper.cfg"
+WRAPPER_CFG_CONTENT = """# Options from the [Python] section of "pymod-extensions.cfg" & "pymod.cfg".
+%(nim_cfg_options)s
+"""
+
+# The "nimcache" directory is kept in the per-user cache (rather than in the
+# "pmgen" directory, which is often deleted), so that the C compiler outputs
+# can be re-used by subsequent builds of the same Nim modules.
+NIMCACHE_CACHE_SUBDIR = "nimcache"
 
+# The nimcache directory of this build, which is set by `main`.
+NIMCACHE_DIR = None
+
+# If "cCompilerLauncher" (eg, "ccache" or "sccache") is specified in "pymod.cfg",
+# each C compiler is invoked through a launcher script that runs it.
+C_COMPILER_LAUNCHER_COMPILERS = ["gcc", "clang"]
+C_COMPILER_LAUNCHER_FNAME_TEMPLATE = "launch-%s"
+C_COMPILER_LAUNCHER_CONTENT = """#!/bin/sh
+# Auto-generated by "pmgen.py" on %(datestamp)s.
+# Any changes will be overwritten by the next run of "pmgen.py".
+exec %(launcher)s %(compiler)s "$@"
+"""
+
+PYMOD_CFG_FNAME = "pymod.cfg"
+PYMOD_EXTENSIONS_CFG_FNAME = "pymod-extensions.cfg"
+
+# Each "-Add-" directive in the cfg files appends a value, unless that value
+# is also specified by the corresponding "-Remove-" directive.
+CFG_ADD_REMOVE_DIRECTIVES = dict(
+        passC=("cCompilerAddFlag", "cCompilerRemoveFlag"),
+        passL=("cLinkerAddFlag", "cLinkerRemoveFlag"),
+        nimOptions=("nimCompilerAddOption", "nimCompilerRemoveOption"),
+)
+
+
+# The default build directory (relative to the current directory), which may
+# be overridden using "--buildDir".  The Python modules are moved into the
+# current directory, which may be overridden using "--outputDir".
 PMGEN_DIRNAME = "pmgen"
 PMGEN_PREFIX = "pmgen"
 PMGEN_RULE_TARGET = "pmgen"
 
+# For profile-guided optimisation:  The directory (in the "pmgen" directory)
+# into which the instrumented Python modules write their profile data.
+PGO_PROFILE_DIRNAME = "pgo-profile"
+PGO_CLANG_PROFDATA_FNAME = "default.profdata"
+
+# For runtime CPU-feature dispatch:  The variants of each Python module that
+# are compiled, in order of preference, as tuples of:
+#  (variant tag, CPU features required by `__builtin_cpu_supports`, C flags)
+# The last variant is the baseline, which is used if no other variant is.
+CPU_DISPATCH_VARIANTS = [
+        ("avx512",
+                ["avx512f", "avx512bw", "avx512dq", "avx512vl", "avx2", "fma", "bmi", "bmi2"],
+                ["-mavx512f", "-mavx512bw", "-mavx512dq", "-mavx512vl",
+                        "-mavx2", "-mfma", "-mbmi", "-mbmi2", "-mpopcnt"]),
+        ("avx2",
+                ["avx2", "fma", "bmi", "bmi2"],
+                ["-mavx2", "-mfma", "-mbmi", "-mbmi2", "-mpopcnt"]),
+        ("sse2", [], []),
+]
+CPU_DISPATCH_MACHINES = ["x86_64", "amd64", "i386", "i686"]
+CPU_DISPATCH_ENV_VAR = "PYMOD_CPU_VARIANT"
+CPU_DISPATCH_VARIANT_FNAME_TEMPLATE = "%(pymodname)s.%(variant_tag)s.so"
+CPU_DISPATCH_C_FNAME_TEMPLATE = "%(pmgen_prefix)s%(pymodname)s_dispatch.c"
+CPU_DISPATCH_C_CONTENT = """/* Auto-generated by "pmgen.py" on %(datestamp)s.
+ * Any changes will be overwritten by the next run of "pmgen.py".
+ *
+ * The Python module "%(pymodname)s", which selects the best variant of itself
+ * for the CPU (or the variant named in the environment variable
+ * "%(env_var)s"), then loads & initialises that variant.
+ */
+
+#define _GNU_SOURCE
+#include <Python.h>
+#include <dlfcn.h>
+#include <stdlib.h>
+#include <string.h>
+
+#if PY_MAJOR_VERSION >= 3
+#define PYMOD_INIT_FUNC_NAME "PyInit_%(pymodname)s"
+#define PYMOD_INIT_FAIL return NULL
+#define PYMOD_CALL_INIT(init_func) return ((PyObject *(*)(void)) (init_func))()
+#else
+#define PYMOD_INIT_FUNC_NAME "init%(pymodname)s"
+#define PYMOD_INIT_FAIL return
+#define PYMOD_CALL_INIT(init_func) ((void (*)(void)) (init_func))(); return
+#endif
+
+
+static const char *
+selectCpuVariant(void)
+{
+	const char *variant_tag = getenv("%(env_var)s");
+	if (variant_tag != NULL && variant_tag[0] != '\\0')
+		return variant_tag;
+
+#if defined(__x86_64__) || defined(__i386__)
+	__builtin_cpu_init();
+%(variant_checks)s
+#endif
+	return "%(baseline_tag)s";
+}
+
+
+#if PY_MAJOR_VERSION >= 3
+PyMODINIT_FUNC
+PyInit_%(pymodname)s(void)
+#else
+PyMODINIT_FUNC
+init%(pymodname)s(void)
+#endif
+{
+	Dl_info this_info;
+	const char *variant_tag = selectCpuVariant();
+	const char *last_slash = NULL;
+	int dirname_len = 0;
+	char *variant_fname = NULL;
+	size_t variant_fname_size = 0;
+	void *variant_handle = NULL;
+	void *init_func = NULL;
+
+	/* The variants are in the same directory as this Python module. */
+	if (dladdr((void *) &selectCpuVariant, &this_info) == 0 || this_info.dli_fname == NULL) {
+		PyErr_SetString(PyExc_ImportError, "unable to locate Python module %(pymodname)s");
+		PYMOD_INIT_FAIL;
+	}
+	last_slash = strrchr(this_info.dli_fname, '/');
+	if (last_slash != NULL)
+		dirname_len = (int) (last_slash - this_info.dli_fname + 1);
+
+	variant_fname_size = dirname_len + strlen("%(pymodname)s") + strlen(variant_tag) + sizeof("..so");
+	variant_fname = (char *) malloc(variant_fname_size);
+	if (variant_fname == NULL) {
+		PyErr_NoMemory();
+		PYMOD_INIT_FAIL;
+	}
+	snprintf(variant_fname, variant_fname_size, "%%.*s%(pymodname)s.%%s.so",
+			dirname_len, this_info.dli_fname, variant_tag);
+
+	/* RTLD_LOCAL, so the symbols of the variant can't clash with anything. */
+	variant_handle = dlopen(variant_fname, RTLD_NOW | RTLD_LOCAL);
+	free(variant_fname);
+	if (variant_handle == NULL) {
+		PyErr_Format(PyExc_ImportError, "unable to load CPU variant \\"%%s\\" of Python module %(pymodname)s: %%s",
+				variant_tag, dlerror());
+		PYMOD_INIT_FAIL;
+	}
+	init_func = dlsym(variant_handle, PYMOD_INIT_FUNC_NAME);
+	if (init_func == NULL) {
+		PyErr_Format(PyExc_ImportError, "unable to initialise CPU variant \\"%%s\\" of Python module %(pymodname)s: %%s",
+				variant_tag, dlerror());
+		PYMOD_INIT_FAIL;
+	}
+	PYMOD_CALL_INIT(init_func);
+}
+"""
+
+# A bundle is a single Python extension module (sharing a single Nim runtime),
+# whose submodules are the Python modules defined by `initPyModule`.  Each
+# submodule registers itself when the shared library is loaded (see
+# `pymodBundle` in "impls.nim"), but it's only initialised (by the module-level
+# `__getattr__`, PEP 562) when it's first accessed.
+BUNDLE_C_FNAME_TEMPLATE = "%(pmgen_prefix)s%(bundle_name)s_bundle.c"
+BUNDLE_C_CONTENT = """/* Auto-generated by "pmgen.py" on %(datestamp)s.
+ * Any changes will be overwritten by the next run of "pmgen.py".
+ *
+ * The Python module "%(bundle_name)s", whose submodules are initialised lazily
+ * when they are first accessed (eg, `%(bundle_name)s.foo`, or
+ * `from %(bundle_name)s import foo`).
+ */
+
+#include <Python.h>
+#include <string.h>
+
+/* This struct is also declared in each auto-generated "pmgen*_capi.c". */
+struct pymod_bundle_submodule {
+	const char *name;
+	PyObject *(*init_func)(void);
+	struct pymod_bundle_submodule *next;
+};
+
+extern void NimMain(void);
+
+static struct pymod_bundle_submodule *submodules = NULL;
+
+
+void
+pymodBundleRegisterSubmodule(struct pymod_bundle_submodule *submodule)
+{
+	submodule->next = submodules;
+	submodules = submodule;
+}
+
+
+/* The Nim runtime is shared by all the submodules, so it's initialised once. */
+void
+pymodNimMainOnce(void)
+{
+	static int nim_main_called = 0;
+	if (!nim_main_called) {
+		nim_main_called = 1;
+		NimMain();
+	}
+}
+
+
+/* Create (& execute) the submodule, which uses multi-phase initialisation. */
+static PyObject *
+create_submodule(struct pymod_bundle_submodule *submodule, PyObject *full_name)
+{
+	PyModuleDef *def = NULL;
+	PyObject *machinery = NULL;
+	PyObject *spec = NULL;
+	PyObject *m = submodule->init_func();
+	if (m == NULL || !PyObject_TypeCheck(m, &PyModuleDef_Type))
+		/* It used single-phase initialisation after all. */
+		return m;
+	def = (PyModuleDef *) m;
+
+	machinery = PyImport_ImportModule("importlib.machinery");
+	if (machinery == NULL)
+		return NULL;
+	spec = PyObject_CallMethod(machinery, "ModuleSpec", "OO", full_name, Py_None);
+	Py_DECREF(machinery);
+	if (spec == NULL)
+		return NULL;
+	m = PyModule_FromDefAndSpec(def, spec);
+	Py_DECREF(spec);
+	if (m != NULL && PyModule_ExecDef(m, def) < 0)
+		Py_CLEAR(m);
+	return m;
+}
+
+
+static PyObject *
+bundle_getattr(PyObject *self, PyObject *name_obj)
+{
+	struct pymod_bundle_submodule *submodule = NULL;
+	PyObject *m = NULL;
+	PyObject *full_name = NULL;
+	const char *name = PyUnicode_AsUTF8(name_obj);
+	if (name == NULL)
+		return NULL;
+
+	for (submodule = submodules; submodule != NULL; submodule = submodule->next) {
+		if (strcmp(submodule->name, name) == 0)
+			break;
+	}
+	if (submodule == NULL) {
+		PyErr_Format(PyExc_AttributeError, "module '%(bundle_name)s' has no attribute '%%U'",
+				name_obj);
+		return NULL;
+	}
+
+	full_name = PyUnicode_FromFormat("%(bundle_name)s.%%s", name);
+	if (full_name == NULL)
+		return NULL;
+	m = create_submodule(submodule, full_name);
+	/* Cache the submodule as an attribute (so this function won't be called
+	 * for it again), & in `sys.modules` (so it can then also be imported). */
+	if (m == NULL ||
+			PyDict_SetItem(PyImport_GetModuleDict(), full_name, m) < 0 ||
+			PyObject_SetAttr(self, name_obj, m) < 0) {
+		Py_DECREF(full_name);
+		Py_XDECREF(m);
+		return NULL;
+	}
+	Py_DECREF(full_name);
+	return m;
+}
+
+
+static PyObject *
+bundle_dir(PyObject *self, PyObject *unused)
+{
+	struct pymod_bundle_submodule *submodule = NULL;
+	PyObject *names = PyDict_Keys(PyModule_GetDict(self));
+	if (names == NULL)
+		return NULL;
+
+	for (submodule = submodules; submodule != NULL; submodule = submodule->next) {
+		PyObject *name_obj = PyUnicode_FromString(submodule->name);
+		int found = 0;
+		if (name_obj == NULL || (found = PySequence_Contains(names, name_obj)) < 0 ||
+				(!found && PyList_Append(names, name_obj) < 0)) {
+			Py_XDECREF(name_obj);
+			Py_DECREF(names);
+			return NULL;
+		}
+		Py_DECREF(name_obj);
+	}
+	return names;
+}
+
+
+static PyMethodDef bundle_methods[] = {
+	{ "__getattr__", (PyCFunction) bundle_getattr, METH_O, NULL },
+	{ "__dir__", (PyCFunction) bundle_dir, METH_NOARGS, NULL },
+	{ NULL, NULL, 0, NULL },
+};
+
+static struct PyModuleDef bundle_def = {
+	PyModuleDef_HEAD_INIT,
+	"%(bundle_name)s",     /* m_name */
+	"",                    /* m_doc */
+	-1,                    /* m_size */
+	bundle_methods,        /* m_methods */
+	NULL,                  /* m_reload */
+	NULL,                  /* m_traverse */
+	NULL,                  /* m_clear */
+	NULL,                  /* m_free */
+};
+
+
+PyMODINIT_FUNC
+PyInit_%(bundle_name)s(void)
+{
+	return PyModule_Create(&bundle_def);
+}
+"""
+
 MAKEFILE_FNAME_TEMPLATE = "Makefile.pmgen-%s"
 MAKEFILE_PMGEN_VARIABLE = """PMGEN = %s %%s --noLinking --noMain""" % NIM_SYMBOL_DEFS_MAKE
+# In a single-pass build, the pmgen phase also compiles & links the Python
+# modules (as configured by `SINGLE_PASS_CFG_CONTENT`).
+MAKEFILE_SINGLE_PASS_VARIABLE = """PMGEN = %s %%s""" % NIM_SYMBOL_DEFS_MAKE
+SINGLE_PASS_RULE_TARGET = "singlepass"
 MAKEFILE2_FNAME_TEMPLATE = "Makefile"
 
 MAKEFILE_CLEAN_RULES = """allclean: clean soclean
@@ -103,8 +461,17 @@ clean:
 \trm -f nim.cfg
 \trm -f %(pmgen_prefix)s*_capi.c
 \trm -f %(pmgen_prefix)s*_incl.nim
+\trm -f %(pmgen_prefix)s*_incl.nim.cfg
 \trm -f %(pmgen_prefix)s*_wrap.nim
 \trm -f %(pmgen_prefix)s*_wrap.nim.cfg
+\trm -f %(pmgen_prefix)s*_dispatch.c
+\trm -f %(pmgen_prefix)s*_bundle.c
+\trm -f %(c_compiler_launchers)s
+\trm -f %(pmgen_prefix)s*.stamp
+\trm -f build.ninja .ninja_deps .ninja_log
+\trm -f %(wrapper_cfg_fname)s
+\trm -rf %(pgo_profile_dirname)s
+\trm -f %(timing_record_basename)s
 """
 MAKEFILE_CONTENT = """# Auto-generated by "pmgen.py" on %(datestamp)s.
 # Any changes will be overwritten by the next run of "pmgen.py".
@@ -117,6 +484,34 @@ MAKEFILE_CONTENT = """# Auto-generated by "pmgen.py" on %(datestamp)s.
 """
 
 
+NINJA_FNAME = "build.ninja"
+NINJA_STAMP_FNAME_TEMPLATE = "%(pmgen_prefix)s%(modname_basename)s.stamp"
+NINJA_CONTENT = """# Auto-generated by "pmgen.py" on %(datestamp)s.
+# Any changes will be overwritten by the next run of "pmgen.py".
+ninja_required_version = 1.3
+
+pmgen = %(pmgen_command)s
+nimcompile = %(nim_compile_command)s
+
+# The Pymod macros only re-write the generated wrapper files if their content
+# has changed, so "restat" prunes the wrapper builds when nothing has changed.
+rule pmgen
+  command = %(pmgen_timing)s$pmgen $in && touch $out
+  description = PMGEN $in
+  restat = 1
+
+rule nimlib
+  command = %(nimlib_timing)s$nimcompile $in
+  description = NIM $out
+
+rule install
+  command = cp -f $in $out
+  description = INSTALL $out
+
+%(build_statements)s
+"""
+
+
 PMINC_FNAME_TEMPLATE = "%(pmgen_prefix)s%(modname_basename)s_incl.nim"
 PMINC_CONTENT = """# Auto-generated by "pmgen.py" on %(datestamp)s.
 # Any changes will be overwritten by the next run of "pmgen.py".
@@ -133,6 +528,25 @@ include pymodpkg/private/includes/pyobjecttypedefs
 # Modules to be included into this Nim code, so their procs can be exportpy'd.
 %(includes)s
 """
+
+# The Nim cfg file for the pminc file (which Nim reads because the pminc file
+# is the project file), in a single-pass build.
+SINGLE_PASS_CFG_FNAME_TEMPLATE = "%(pminc_fname)s.cfg"
+SINGLE_PASS_CFG_CONTENT = """# Auto-generated by "pmgen.py" on %(datestamp)s.
+# Any changes will be overwritten by the next run of "pmgen.py".
+
+app:lib
+noMain
+out:"%(shared_library_fname)s"
+define:"pymodSinglePass"
+define:"pymodBuildDir=%(build_dir)s"
+%(bundle_options)s
+
+# Options from the [Python] section of "pymod-extensions.cfg" & "pymod.cfg".
+%(nim_cfg_options)s
+"""
+
+
 def parse_args():
     parser = argparse.ArgumentParser( prog = 'pmgen',
                                       formatter_class = argparse.RawDescriptionHelpFormatter,
@@ -147,13 +561,68 @@ def parse_args():
     parser.add_argument('--pyarrayEnabled', dest="pyarrayEnabled", default=False,
                         action='store_true')
 
+    parser.add_argument('--lazyInit', '--lazy-init', dest="lazyInit", default=False,
+                        action='store_true',
+                        help="defer the initialisation of each Python module (including the "
+                                "Nim runtime) until the first call of any exported proc")
+    parser.add_argument('--lazyTraceback', '--lazy-traceback', dest="lazyTraceback",
+                        default=False, action='store_true',
+                        help="raise Python exceptions with just the Nim exception message, "
+                                "and format the Nim traceback only when it's read")
+
     parser.add_argument('--release', dest="release", default=False,
                         action='store_true')
+    parser.add_argument('--profile', dest="profile", default=None,
+                        choices=sorted(BUILD_PROFILES.keys()),
+                        help="the build profile (overrides \"--release\" & \"pymod.cfg\")")
+
+    parser.add_argument('--buildDir', '--build-dir', dest="buildDir", default=PMGEN_DIRNAME,
+                        metavar="DIRPATH", action='store', type=str,
+                        help="the directory in which to build (default: \"%s\")" % PMGEN_DIRNAME)
+    parser.add_argument('--outputDir', '--output-dir', dest="outputDir", default=".",
+                        metavar="DIRPATH", action='store', type=str,
+                        help="the directory into which to move the Python modules "
+                                "(default: the current directory)")
+
+    parser.add_argument('--timingReport', '--timing-report', dest="timingReport", default=None,
+                        metavar="report.json", action='store', type=str,
+                        help="write a JSON report of the time taken by each build phase")
+
+    parser.add_argument('--ninja', dest="ninja", default=False,
+                        action='store_true',
+                        help="build using a generated \"%s\" rather than Makefiles" % NINJA_FNAME)
+
+    parser.add_argument('--singlePass', '--single-pass', dest="singlePass", default=False,
+                        action='store_true',
+                        help="generate the wrappers & compile the Python modules in a single "
+                                "invocation of the Nim compiler")
+
+    parser.add_argument('--bundle', dest="bundle", default=None,
+                        metavar="NAME", action='store', type=str,
+                        help="build a single Python module NAME (implies \"--singlePass\"), "
+                                "whose submodules are the Python modules, sharing one Nim runtime")
+
+    parser.add_argument('--pgo', dest="pgo", default=None,
+                        metavar="train.py", action='store', type=str,
+                        help="build with profile-guided optimisation, using this Python "
+                                "script (which imports the Python modules) for training")
+
+    parser.add_argument('--cpuDispatch', dest="cpuDispatch", default=False,
+                        action='store_true',
+                        help="build a variant of each Python module for each level of x86-64 "
+                                "SIMD support (%s), and select the best variant at import time" %
+                                        ", ".join(v[0] for v in CPU_DISPATCH_VARIANTS))
+
+    parser.add_argument('--cleanCache', '--clean-cache', dest="cleanCache", default=False,
+                        action='store_true',
+                        help="delete the nimcache directories of all previous builds (in the "
+                                "per-user cache) before building")
 
     args, unknown = parser.parse_known_args()
     return args, unknown
 
 def main():
+    timer = BuildTimer()
     # For the "nim.cfg".
     nim_defined_symbols_cfg = ["pymodEnabled"]
     args, unknown = parse_args()
@@ -167,64 +636,322 @@ def main():
     if args.pyarrayEnabled:
         nim_defined_symbols_cfg.append("pyarrayEnabled") 
 
+    if args.lazyInit:
+        if sys.version_info.major < 3:
+            die("option --lazyInit requires Python 3")
+        nim_defined_symbols_cfg.append("pymodLazyInit")
+
+    if args.lazyTraceback:
+        nim_defined_symbols_cfg.append("pymodLazyTraceback")
+
     nim_symbol_defs_cfg = "\n".join("define:\"%s\"" % s for s in nim_defined_symbols_cfg)
 
     (nim_modfiles, nim_modnames) = get_nim_modnames_as_relpaths(args.infiles)
     if len(nim_modnames) < 1:
         die("no Nim module names specified")
+    if args.pgo:
+        if not os.path.exists(args.pgo):
+            die("file not found: %s" % args.pgo)
+        args.pgo = os.path.abspath(args.pgo)
+    if args.bundle:
+        if sys.version_info < (3, 7):
+            # The lazy submodules need a module-level `__getattr__` (PEP 562).
+            die("option --bundle requires Python 3.7 or later")
+        if args.pymodName:
+            die("options --bundle & --pymodName cannot be combined")
+        args.singlePass = True
+    if args.singlePass and args.ninja:
+        die("options --singlePass (or --bundle) & --ninja cannot be combined")
+    if args.cpuDispatch:
+        if args.pgo:
+            die("options --cpuDispatch & --pgo cannot be combined")
+        if platform.machine().lower() not in CPU_DISPATCH_MACHINES:
+            die("option --cpuDispatch is only supported on x86 (not %s)" % platform.machine())
+
+    # The build directory is not necessarily a subdirectory of the current
+    # directory, so use absolute paths for everything outside of it.
+    global ORIG_DIR, OUTPUT_DIR
+    ORIG_DIR = os.getcwd()
+    OUTPUT_DIR = os.path.abspath(args.outputDir)
+    build_dir = os.path.abspath(args.buildDir)
+    nim_modfiles = [abspath_in_orig_dir(modfname) for modfname in nim_modfiles]
+    nim_modnames = [abspath_in_orig_dir(modname) for modname in nim_modnames]
+    if args.timingReport:
+        args.timingReport = os.path.abspath(args.timingReport)
+
+    with timer.phase("probe"):
+        pymod_path = find_pymod_path()
+        global CONFIG
+        CONFIG = readPymodConfig(pymod_path)
+        global NIM_COMPILER_COMMAND
+        NIM_COMPILER_COMMAND = getCompilerCommand(args)
+        if args.cleanCache:
+            clean_nimcache_dirs()
+        global NIMCACHE_DIR
+        NIMCACHE_DIR = nimcache_dir = get_nimcache_dir(args, nim_modfiles, build_dir)
+
+        for dirpath in [build_dir, OUTPUT_DIR]:
+            if not os.path.isdir(dirpath):
+                os.makedirs(dirpath)
+        os.chdir(build_dir)
+
+        (python_includes, python_ldflags) = determine_python_includes_ldflags()
+        numpy_paths = test_that_numpy_is_installed()
+
+    with timer.phase("configure"):
+        nim_symbol_defs_cfg += "\n" + generate_wrapper_cfg_file()
+        generate_nim_cfg_file( args,nim_symbol_defs_cfg,python_includes, python_ldflags, numpy_paths,
+                pymod_path, nimcache_dir)
+        pminc_basename = generate_pminc_file(args,nim_modnames, nim_modfiles)
+        generate_single_pass_cfg_file(args, pminc_basename)
+
+    if args.timingReport:
+        global TIMING_RECORD_FNAME
+        TIMING_RECORD_FNAME = os.path.abspath(TIMING_RECORD_BASENAME)
+        if os.path.exists(TIMING_RECORD_FNAME):
+            os.remove(TIMING_RECORD_FNAME)
+
+    with timer.phase("build"):
+        if args.pgo:
+            build_with_pgo(args, nim_modfiles, pminc_basename)
+        elif args.cpuDispatch:
+            build_with_cpu_dispatch(args, nim_modfiles, pminc_basename, python_includes)
+        else:
+            build_pymodules(args, nim_modfiles, pminc_basename)
+    #for pymodule_fname in pymodule_fnames:
+    #    shutil.copyfile(pymodule_fname, os.path.join("..", pymodule_fname))
 
-    global CONFIG
-    CONFIG = readPymodConfig()
-    global NIM_COMPILER_COMMAND
-    NIM_COMPILER_COMMAND = getCompilerCommand(args)
+    if args.timingReport:
+        timer.load_records(TIMING_RECORD_FNAME)
+        timer.write_report(args.timingReport)
+        print(timer.get_summary())
+        print("Wrote timing report: %s" % args.timingReport)
 
-    orig_dir = os.getcwd()
-    if not (os.path.exists(PMGEN_DIRNAME) and os.path.isdir(PMGEN_DIRNAME)):
-        os.mkdir(PMGEN_DIRNAME)
-    os.chdir(PMGEN_DIRNAME)
+    os.chdir(ORIG_DIR)
 
-    (python_includes, python_ldflags) = determine_python_includes_ldflags()
-    numpy_paths = test_that_numpy_is_installed()
-    generate_nim_cfg_file( args,nim_symbol_defs_cfg,python_includes, python_ldflags, numpy_paths)
-    pminc_basename = generate_pminc_file(args,nim_modnames)
 
-    generate_pmgen_files(args,nim_modfiles, pminc_basename)
+def build_pymodules(args, nim_modfiles, pminc_basename):
+    if args.ninja:
+        build_with_ninja(nim_modfiles, pminc_basename)
+    elif args.singlePass:
+        generate_pmgen_files(args,nim_modfiles, pminc_basename)
+        install_single_pass_pymodules(args, pminc_basename)
+    else:
+        generate_pmgen_files(args,nim_modfiles, pminc_basename)
+
+        (nim_wrapper_fnames, pymodule_fnames) = find_generated_nim_wrappers()
+
+        python_exe_name = sys.executable
+        compile_generated_nim_wrappers(nim_wrapper_fnames, pymodule_fnames,
+                nim_modfiles, pminc_basename, python_exe_name)
+
+
+def build_with_pgo(args, nim_modfiles, pminc_basename):
+    # Remove any profile data from a previous training run, which would
+    # otherwise be merged with (or conflict with) the new profile data.
+    profile_dir = os.path.abspath(PGO_PROFILE_DIRNAME)
+    if os.path.isdir(profile_dir):
+        shutil.rmtree(profile_dir)
+    os.mkdir(profile_dir)
+
+    # 1. Build instrumented Python modules.
+    # Nim only re-compiles a C file if the C code has changed (not if the C
+    # compiler flags or the profile data have changed), so we must force Nim
+    # to re-build.  Each phase also gets its own nimcache directory, so that
+    # a later plain build can't re-use the instrumented C objects.
+    global NIM_WRAPPER_EXTRA_FLAGS
+    profile_generate_flag = shell_quote("-fprofile-generate=%s" % profile_dir)
+    NIM_WRAPPER_EXTRA_FLAGS = get_nimcache_variant_flags("pgo-generate") + ["--forceBuild",
+            "--passC:%s" % profile_generate_flag, "--passL:%s" % profile_generate_flag]
+    build_pymodules(args, nim_modfiles, pminc_basename)
+
+    # 2. Run the training script, which imports the instrumented Python modules
+    # (which were moved into the output directory) & writes profile data.
+    pythonpath = [OUTPUT_DIR] + [p for p in [os.environ.get("PYTHONPATH")] if p]
+    training_env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+    training_command = [sys.executable, args.pgo]
+    print(" ".join(training_command))
+    subprocess.check_call(training_command, cwd=ORIG_DIR, env=training_env)
+
+    # 3. Re-build the Python modules using the profile data.
+    # GCC writes ".gcda" files, which it can use directly.  Clang writes raw
+    # profiles, which must first be merged into a single ".profdata" file.
+    clang_profraw_fnames = glob.glob(os.path.join(profile_dir, "*.profraw"))
+    if clang_profraw_fnames:
+        profdata_fname = os.path.join(profile_dir, PGO_CLANG_PROFDATA_FNAME)
+        profdata_command = [LLVM_PROFDATA_EXE_PATH, "merge",
+                "-output=%s" % profdata_fname] + clang_profraw_fnames
+        print(" ".join(profdata_command))
+        subprocess.check_call(profdata_command)
+        profile_use_flags = ["-fprofile-use=%s" % profdata_fname]
+    else:
+        gcc_gcda_fnames = [os.path.join(dirpath, fname)
+                for dirpath, dirnames, fnames in os.walk(profile_dir)
+                for fname in fnames if fname.endswith(".gcda")]
+        if not gcc_gcda_fnames:
+            die("no profile data was written by training script: %s" % args.pgo)
+        # "-fprofile-correction" handles the inconsistent counters that can
+        # result from training with multiple threads.
+        profile_use_flags = ["-fprofile-use=%s" % profile_dir, "-fprofile-correction"]
+
+    profile_use_flags = shell_quote(" ".join(profile_use_flags))
+    NIM_WRAPPER_EXTRA_FLAGS = get_nimcache_variant_flags("pgo-use") + ["--forceBuild",
+            "--passC:%s" % profile_use_flags, "--passL:%s" % profile_use_flags]
+    build_pymodules(args, nim_modfiles, pminc_basename)
+    NIM_WRAPPER_EXTRA_FLAGS = []
+
+
+def build_with_cpu_dispatch(args, nim_modfiles, pminc_basename, python_includes):
+    global NIM_WRAPPER_EXTRA_FLAGS
+    for (variant_tag, cpu_features, c_compiler_flags) in CPU_DISPATCH_VARIANTS:
+        print("Building CPU variant: %s" % variant_tag)
+        # Nim only re-compiles a C file if the C code has changed (not if the
+        # C compiler flags have changed), so each variant gets its own nimcache
+        # directory, rather than re-using (eg) the AVX-512 C objects.
+        NIM_WRAPPER_EXTRA_FLAGS = get_nimcache_variant_flags("cpu-" + variant_tag)
+        if c_compiler_flags:
+            NIM_WRAPPER_EXTRA_FLAGS.append("--passC:%s" % shell_quote(" ".join(c_compiler_flags)))
+        build_pymodules(args, nim_modfiles, pminc_basename)
+
+        pymodule_fnames = find_generated_pymodule_fnames(args)
+        for pymodule_fname in pymodule_fnames:
+            variant_fname = CPU_DISPATCH_VARIANT_FNAME_TEMPLATE % dict(
+                    pymodname=pymodule_fname[:-3],
+                    variant_tag=variant_tag)
+            os.rename(os.path.join(OUTPUT_DIR, pymodule_fname),
+                    os.path.join(OUTPUT_DIR, variant_fname))
+    NIM_WRAPPER_EXTRA_FLAGS = []
+
+    for pymodule_fname in pymodule_fnames:
+        compile_cpu_dispatch_pymodule(pymodule_fname[:-3], python_includes)
+
+
+def compile_cpu_dispatch_pymodule(pymodname, python_includes):
+    datestamp = get_datestamp()
 
-    # FIXME:  This approach (of simply globbing by filenames) is highly dodgy.
-    # Work out a better way of doing this.
-    nim_wrapper_glob = "%(pmgen_prefix)s*_wrap.nim" % dict(
-            pmgen_prefix=PMGEN_PREFIX)
-    nim_wrapper_fnames = glob.glob(nim_wrapper_glob)
+    variant_checks = []
+    for (variant_tag, cpu_features, c_compiler_flags) in CPU_DISPATCH_VARIANTS[:-1]:
+        variant_checks.append("\tif (%s)\n\t\treturn \"%s\";" % (
+                " && ".join("__builtin_cpu_supports(\"%s\")" % f for f in cpu_features),
+                variant_tag))
+
+    c_fname = CPU_DISPATCH_C_FNAME_TEMPLATE % dict(
+            pmgen_prefix=PMGEN_PREFIX,
+            pymodname=pymodname)
+    with open(c_fname, "w") as f:
+        f.write(CPU_DISPATCH_C_CONTENT % dict(
+                datestamp=datestamp,
+                pymodname=pymodname,
+                env_var=CPU_DISPATCH_ENV_VAR,
+                variant_checks="\n".join(variant_checks),
+                baseline_tag=CPU_DISPATCH_VARIANTS[-1][0]))
 
-    pymodule_fnames = extract_pymodule_fnames_from_glob(nim_wrapper_fnames,
-            nim_wrapper_glob)
+    # The Python C-API symbols are resolved when the Python module is loaded,
+    # so only the Python C-API includes are needed (not the ldflags).
+    includes = [ipath if ipath.startswith("-I") else "-I" + ipath
+            for ipath in python_includes]
+    compile_command = [C_COMPILER_EXE_PATH, "-shared", "-fPIC", "-O2"] + includes + \
+            [c_fname, "-o", os.path.join(OUTPUT_DIR, pymodname + ".so"), "-ldl"]
+    print(" ".join(compile_command))
+    subprocess.check_call(compile_command)
 
-    python_exe_name = sys.executable
-    compile_generated_nim_wrappers(nim_wrapper_fnames, pymodule_fnames,
-            nim_modfiles, pminc_basename, python_exe_name)
-    #for pymodule_fname in pymodule_fnames:
-    #    shutil.copyfile(pymodule_fname, os.path.join("..", pymodule_fname))
 
-    os.chdir(orig_dir)
+def get_nim_wrapper_compile_command():
+    return " ".join([NIM_COMPILER_COMMAND % "compile"] + NIM_WRAPPER_EXTRA_FLAGS)
+
+
+def get_timing_command_prefix(phase_name, module_name):
+    # Returns the prefix for a Nim compiler command in a Makefile or Ninja
+    # file, that will record the timing of the command (if requested).
+    if not TIMING_RECORD_FNAME:
+        return ""
+    return "%s -m nim_pm.timing --record %s --phase %s --module %s -- " % (
+            shell_quote(sys.executable), shell_quote(TIMING_RECORD_FNAME),
+            phase_name, module_name)
+
+
+def getBuildProfile(args):
+    if args.profile:
+        return args.profile
+    if args.release:
+        return "release"
+
+    cfg_profiles = CONFIG.get("all", "nimSetBuildProfile")
+    if cfg_profiles:
+        # If there are multiple values, the last one wins.
+        profile = stripAnyQuotes(cfg_profiles[-1])
+        if profile not in BUILD_PROFILES:
+            die("unknown build profile \"%s\" in %s (expected one of: %s)" %
+                    (profile, PYMOD_CFG_FNAME, ", ".join(sorted(BUILD_PROFILES.keys()))))
+        return profile
+
+    if any(CONFIG.getboolean("all", "nimSetIsRelease")):
+        return "release"
+    return BUILD_PROFILE_DEFAULT
 
 
 def getCompilerCommand(args):
     nim_compiler_flags = NIM_COMPILER_FLAGS[:]
-    if  args.release or any(CONFIG.getboolean("all", "nimSetIsRelease")):
-        nim_compiler_flags.extend(NIM_COMPILER_FLAG_OPTIONS["nimSetIsRelease"])
-        #print("nimSetIsRelease: True")
+    profile = getBuildProfile(args)
+    nim_compiler_flags.extend(BUILD_PROFILES[profile])
+    print("Build profile: %s" % profile)
 
     cmd = "%s %%s %s" % (NIM_COMPILER_EXE_PATH, " ".join(nim_compiler_flags))
     #print("Nim compiler command:", cmd)
     return cmd
 
 
-def readPymodConfig():
+def find_pymod_path():
+    pymod_path = subprocess.check_output("nimble path pymod| tail -n 1",shell=True).decode("UTF-8").strip()
+    if not os.path.isdir(pymod_path):
+        die("Can not find pymodpkg through nimble")
+    return pymod_path
+
+
+def readPymodConfig(pymod_path):
+    # The defaults in "pymod-extensions.cfg" are read first, so that the
+    # directives in the project's "pymod.cfg" can add to or remove them.
+    extensions_cfg_fname = os.path.join(pymod_path, PYMOD_EXTENSIONS_CFG_FNAME)
+    if not os.path.exists(extensions_cfg_fname):
+        die("file not found: %s" % extensions_cfg_fname)
+
     c = UsefulConfigParser()
-    cfg_files_read = c.read("pymod.cfg")
+    cfg_files_read = c.read([extensions_cfg_fname, PYMOD_CFG_FNAME])
     return c
 
 
+def getAddRemoveOptvals(section_name, add_directive, remove_directive):
+    removed_optvals = set(stripAnyQuotes(optval)
+            for optval in CONFIG.get(section_name, remove_directive))
+
+    optvals = []
+    for optval in CONFIG.get(section_name, add_directive):
+        optval = stripAnyQuotes(optval)
+        if optval not in removed_optvals and optval not in optvals:
+            optvals.append(optval)
+    return optvals
+
+
+def getNimCfgOptions(section_name, extra_ldflags=[]):
+    nim_cfg_options = []
+
+    (add_directive, remove_directive) = CFG_ADD_REMOVE_DIRECTIVES["passC"]
+    c_compiler_flags = getAddRemoveOptvals(section_name, add_directive, remove_directive)
+    if c_compiler_flags:
+        nim_cfg_options.append('passC:"%s"' % " ".join(c_compiler_flags))
+
+    (add_directive, remove_directive) = CFG_ADD_REMOVE_DIRECTIVES["passL"]
+    c_linker_flags = getAddRemoveOptvals(section_name, add_directive, remove_directive)
+    c_linker_flags.extend(extra_ldflags)
+    if c_linker_flags:
+        nim_cfg_options.append('passL:"%s"' % " ".join(c_linker_flags))
+
+    (add_directive, remove_directive) = CFG_ADD_REMOVE_DIRECTIVES["nimOptions"]
+    nim_cfg_options.extend(getAddRemoveOptvals(section_name, add_directive, remove_directive))
+    #print("Nim cfg options [%s]:" % section_name, nim_cfg_options)
+    return nim_cfg_options
+
+
 def get_nim_modnames_as_relpaths(cmdline_args):
     nim_modfiles = []
     nim_modnames = []
@@ -245,6 +972,38 @@ def get_nim_modnames_as_relpaths(cmdline_args):
     return (nim_modfiles, nim_modnames)
 
 
+def find_generated_nim_wrappers():
+    # FIXME:  This approach (of simply globbing by filenames) is highly dodgy.
+    # Work out a better way of doing this.
+    nim_wrapper_glob = "%(pmgen_prefix)s*_wrap.nim" % dict(
+            pmgen_prefix=PMGEN_PREFIX)
+    nim_wrapper_fnames = sorted(glob.glob(nim_wrapper_glob))
+
+    pymodule_fnames = extract_pymodule_fnames_from_glob(nim_wrapper_fnames,
+            nim_wrapper_glob)
+    return (nim_wrapper_fnames, pymodule_fnames)
+
+
+def find_generated_c_capis():
+    # FIXME:  This is just as dodgy as `find_generated_nim_wrappers`.
+    c_capi_glob = "%(pmgen_prefix)s*_capi.c" % dict(
+            pmgen_prefix=PMGEN_PREFIX)
+    c_capi_fnames = sorted(glob.glob(c_capi_glob))
+
+    pymodule_fnames = extract_pymodule_fnames_from_glob(c_capi_fnames,
+            c_capi_glob)
+    return (c_capi_fnames, pymodule_fnames)
+
+
+def find_generated_pymodule_fnames(args):
+    if args.bundle:
+        return [args.bundle + ".so"]
+    # In a single-pass build, no Nim wrappers are generated.
+    if args.singlePass:
+        return find_generated_c_capis()[1]
+    return find_generated_nim_wrappers()[1]
+
+
 def extract_pymodule_fnames_from_glob(nim_wrapper_fnames, nim_wrapper_glob):
     nim_wrapper_pattern = nim_wrapper_glob.replace("*", "(.+)")
     regex = re.compile(nim_wrapper_pattern)
@@ -258,18 +1017,107 @@ def get_datestamp():
     return datetime.datetime.now().strftime("%Y-%m-%d at %H:%M:%S")
 
 
-def generate_nim_cfg_file(args,nim_symbol_defs_cfg,python_includes, python_ldflags, numpy_paths):
+def write_file_if_changed(fname, content):
+    # Compare everything except the auto-generated datestamp on the first line.
+    # Leaving an unchanged file untouched preserves its timestamp, so neither
+    # Make nor Ninja will consider anything that depends upon it out-of-date.
+    if os.path.exists(fname):
+        with open(fname) as f:
+            prev_content = f.read()
+        if prev_content.split("\n", 1)[1:] == content.split("\n", 1)[1:]:
+            return False
+
+    with open(fname, "w") as f:
+        f.write(content)
+    return True
+
+
+def generate_wrapper_cfg_file():
+    # Returns the Nim symbol definition that tells the Pymod macros where to
+    # find the file.  It must be an absolute path, since the Pymod macros will
+    # `staticRead` it relative to their own source file.
+    write_file_if_changed(WRAPPER_CFG_FNAME, WRAPPER_CFG_CONTENT % dict(
+            nim_cfg_options="\n".join(getNimCfgOptions("Python"))))
+    return 'define:"pymodWrapperCfg=%s"' % os.path.abspath(WRAPPER_CFG_FNAME)
+
+
+def get_nimcache_dir(args, nim_modfiles, build_dir):
+    # Each distinct build (of the same Nim modules, for the same Python, with
+    # the same Nim compiler flags & C compiler flags) gets its own nimcache
+    # directory, because Nim doesn't re-compile a C file if only the C compiler
+    # flags change.  (The C compiler flags are those that will be written to
+    # "nim.cfg" & "pymod_wrapper.cfg", from the [all] & [Python] sections of
+    # the config files.)  Builds in different build directories (which might
+    # run concurrently) also get different nimcache directories, so they can't
+    # collide.
+    h = hashlib.sha256()
+    key_components = nim_modfiles + [build_dir,
+            args.pymodName or "",
+            "pyarrayEnabled" if args.pyarrayEnabled else "",
+            get_python_abi_tag(),
+            getBuildProfile(args),
+            NIM_COMPILER_COMMAND] + \
+            getNimCfgOptions("all") + \
+            getNimCfgOptions("Python") + \
+            CONFIG.get("all", "cCompilerLauncher")
+    for s in key_components:
+        h.update(s.encode("UTF-8"))
+        h.update(b"\0")
+
+    nimcache_dir = get_cache_dir(NIMCACHE_CACHE_SUBDIR, h.hexdigest())
+    print("Using nimcache directory: %s" % nimcache_dir)
+    return nimcache_dir
+
+
+def get_nimcache_variant_flags(variant_name):
+    # The Nim compiler flags to compile the generated Nim wrappers with their
+    # own subdirectory of the nimcache directory, for a build (such as a PGO
+    # phase or a CPU dispatch variant) that passes extra C compiler flags.
+    variant_dir = os.path.join(NIMCACHE_DIR, variant_name)
+    return ["--nimcache:%s" % shell_quote(variant_dir),
+            "--cincludes:%s" % shell_quote(variant_dir)]
+
+
+def clean_nimcache_dirs():
+    # Nothing else evicts the nimcache directories of previous builds from the
+    # per-user cache, so this is how to reclaim the disk space.
+    nimcache_root = get_cache_dir(NIMCACHE_CACHE_SUBDIR)
+    print("rm -rf %s" % nimcache_root)
+    shutil.rmtree(nimcache_root)
+
+
+def generate_c_compiler_launchers():
+    # Returns the Nim cfg options that tell Nim to use the launcher scripts.
+    launchers = CONFIG.get("all", "cCompilerLauncher")
+    if not launchers:
+        return []
+    # If there are multiple values, the last one wins.
+    launcher = stripAnyQuotes(launchers[-1])
+
+    datestamp = get_datestamp()
+    nim_cfg_options = []
+    for compiler in C_COMPILER_LAUNCHER_COMPILERS:
+        launcher_fname = C_COMPILER_LAUNCHER_FNAME_TEMPLATE % compiler
+        with open(launcher_fname, "w") as f:
+            f.write(C_COMPILER_LAUNCHER_CONTENT % dict(
+                    datestamp=datestamp,
+                    launcher=launcher,
+                    compiler=compiler))
+        os.chmod(launcher_fname, 0o755)
+        nim_cfg_options.append('%s.exe:"%s"' % (compiler, os.path.abspath(launcher_fname)))
+    return nim_cfg_options
+
+
+def generate_nim_cfg_file(args,nim_symbol_defs_cfg,python_includes, python_ldflags, numpy_paths,
+        pymod_path, nimcache_dir):
     datestamp = get_datestamp()
 
     any_other_module_paths = []
     for optval in CONFIG.get("all", "nimAddModulePath"):
         path = stripAnyQuotes(optval)
-        if not path.startswith("/"):
-            # It's a relative path rather than an absolute path.
-            # Since it's relative to the parent directory, it needs to
-            # be updated because we are now in the "pmgen" directory.
-            path = dotdot(path)
-        path = os.path.realpath(path)
+        # If it's a relative path, it's relative to the original directory
+        # (which is not the build directory that we are now in).
+        path = os.path.realpath(abspath_in_orig_dir(path))
         any_other_module_paths.append('path:"%s"' % path)
     #print("nimAddModulePath:", any_other_module_paths)
     if args.pyarrayEnabled:
@@ -287,22 +1135,20 @@ def generate_nim_cfg_file(args,nim_symbol_defs_cfg,python_includes, python_ldfla
             'cincludes:"%s"' % path
             for path in python_includes_uniq])
 
-    pymod_path = subprocess.check_output("nimble path pymod| tail -n 1",shell=True).decode("UTF-8").strip()
-    if not os.path.isdir(pymod_path):
-        die("Can not find pymodpkg through nimble")
-
     python_cincludes += '\ncincludes: "' + pymod_path + '"'
 
-    python_ldflags = " ".join(python_ldflags)
+    nim_cfg_options = "\n".join(getNimCfgOptions("all", python_ldflags))
     any_other_module_paths = "\n".join(any_other_module_paths)
 
-    with open(NIM_CFG_FNAME, "w") as f:
-        f.write(NIM_CFG_CONTENT % dict(
-                datestamp=datestamp,
-                python_cincludes=python_cincludes,
-                nim_symbol_defs=nim_symbol_defs_cfg,
-                python_ldflags=python_ldflags,
-                any_other_module_paths=any_other_module_paths))
+    # (Ninja rebuilds everything that depends upon "nim.cfg" if it's touched.)
+    write_file_if_changed(NIM_CFG_FNAME, NIM_CFG_CONTENT % dict(
+            datestamp=datestamp,
+            python_cincludes=python_cincludes,
+            nim_symbol_defs=nim_symbol_defs_cfg,
+            nim_cfg_options=nim_cfg_options,
+            nimcache_dir=nimcache_dir,
+            c_compiler_launchers="\n".join(generate_c_compiler_launchers()),
+            any_other_module_paths=any_other_module_paths))
 
 
 def stripAnyQuotes(s):
@@ -313,58 +1159,131 @@ def stripAnyQuotes(s):
     return s
 
 
-def dotdot(relpath):
-    # Assumes that `relpath` is a relative path that was obtained from the
-    # command-line arguments by the function `get_nim_modnames_as_relpaths`.
-    return os.path.join("..", relpath)
+def abspath_in_orig_dir(relpath):
+    # Assumes that `relpath` is a path relative to the directory in which
+    # "pmgen.py" was invoked (such as the paths that were obtained from the
+    # command-line arguments by the function `get_nim_modnames_as_relpaths`).
+    return os.path.normpath(os.path.join(ORIG_DIR, relpath))
 
 
-def generate_pminc_file(args,nim_modnames):
+def generate_pminc_file(args,nim_modnames, nim_modfiles):
     datestamp = get_datestamp()
 
-    # We need to "dot-dot" one level, because we are in the "pmgen" subdir.
-    nim_modnames = [dotdot(modname) for modname in nim_modnames]
+    # The module names are absolute paths (since we are in the build dir),
+    # so they must be quoted as string literals.
     register_to_import = ["registerNimModuleToImport(\"%s\")" % modname
             for modname in nim_modnames]
-    includes = ["include %s" % modname for modname in nim_modnames]
+    includes = ["include \"%s\"" % modname for modname in nim_modnames]
 
-    last_nim_modname_basename = args.pymodName if args.pymodName else os.path.basename(nim_modnames[-1])
+    last_nim_modname_basename = args.bundle or args.pymodName or os.path.basename(nim_modnames[-1])
 
     pminc_fname = PMINC_FNAME_TEMPLATE % dict(
             modname_basename=last_nim_modname_basename,
             pmgen_prefix=PMGEN_PREFIX)
-    with open(pminc_fname, "w") as f:
-        f.write(PMINC_CONTENT % dict(
-                datestamp=datestamp,
-                imports="\n".join(register_to_import),
-                # Leave an empty line between each include.
-                includes="\n\n".join(includes)))
+    changed = write_file_if_changed(pminc_fname, PMINC_CONTENT % dict(
+            datestamp=datestamp,
+            imports="\n".join(register_to_import),
+            # Leave an empty line between each include.
+            includes="\n\n".join(includes)))
+    newest_modfile_mtime = max(os.path.getmtime(modfile) for modfile in nim_modfiles)
+    if not changed and newest_modfile_mtime > os.path.getmtime(pminc_fname):
+        # The Makefile would otherwise consider the unchanged pminc file to be
+        # older than the Nim modules that it includes, and re-run "pmgen.py"
+        # (which would leave it untouched again) forever.
+        mtime = max(time.time(), newest_modfile_mtime)
+        os.utime(pminc_fname, (mtime, mtime))
 
     return last_nim_modname_basename
 
 
+def generate_single_pass_cfg_file(args, pminc_basename):
+    pminc_fname = PMINC_FNAME_TEMPLATE % dict(
+            modname_basename=pminc_basename,
+            pmgen_prefix=PMGEN_PREFIX)
+    cfg_fname = SINGLE_PASS_CFG_FNAME_TEMPLATE % dict(pminc_fname=pminc_fname)
+    if not args.singlePass:
+        # Nim would read a cfg file left over from a previous single-pass build.
+        if os.path.exists(cfg_fname):
+            os.remove(cfg_fname)
+        return
+
+    bundle_options = []
+    if args.bundle:
+        bundle_options = [
+                'define:"pymodBundle=%s"' % args.bundle,
+                'compile:"%s"' % os.path.abspath(generate_bundle_c_file(args.bundle))]
+
+    write_file_if_changed(cfg_fname, SINGLE_PASS_CFG_CONTENT % dict(
+            datestamp=get_datestamp(),
+            shared_library_fname=pminc_basename + ".so",
+            build_dir=os.getcwd(),
+            bundle_options="\n".join(bundle_options),
+            nim_cfg_options="\n".join(getNimCfgOptions("Python"))))
+
+
+def generate_bundle_c_file(bundle_name):
+    c_fname = BUNDLE_C_FNAME_TEMPLATE % dict(
+            pmgen_prefix=PMGEN_PREFIX,
+            bundle_name=bundle_name)
+    write_file_if_changed(c_fname, BUNDLE_C_CONTENT % dict(
+            datestamp=get_datestamp(),
+            bundle_name=bundle_name))
+    return c_fname
+
+
+def install_single_pass_pymodules(args, pminc_basename):
+    # All the Python modules (one for each invocation of `initPyModule`) have
+    # been compiled into the same shared library, which exports the module
+    # init function of each of them.  So install a copy for each of them
+    # (or, if it's a bundle, install it once, as the bundle).
+    shared_library_fname = pminc_basename + ".so"
+    if args.bundle:
+        pymodule_fnames = [args.bundle + ".so"]
+    else:
+        (c_capi_fnames, pymodule_fnames) = find_generated_c_capis()
+    for pymodule_fname in pymodule_fnames:
+        print("cp -f %s %s/%s" % (shared_library_fname, OUTPUT_DIR, pymodule_fname))
+        shutil.copy(shared_library_fname, os.path.join(OUTPUT_DIR, pymodule_fname))
+    os.remove(shared_library_fname)
+
+
 def generate_pmgen_files(args,nim_modfiles, pminc_basename):
     datestamp = get_datestamp()
 
     # Create the Makefile.
-    rule_target = PMGEN_RULE_TARGET
     pminc_fname = PMINC_FNAME_TEMPLATE % dict(
             modname_basename=pminc_basename,
             pmgen_prefix=PMGEN_PREFIX)
-    # We need to "dot-dot" one level, because we are in the "pmgen" subdir.
-    nim_modfiles = [dotdot(modfname) for modfname in nim_modfiles]
     prereqs = [pminc_fname] + nim_modfiles
 
-    compile_rule = "%s: %s\n\t%s $(PMGEN) %s" % \
-            (rule_target, " ".join(prereqs), NIM_COMPILER_COMMAND % "compile", pminc_fname)
+    if args.singlePass:
+        # This is the final compilation of the Python modules, so it gets any
+        # extra flags (eg, for PGO or CPU dispatch) for the wrappers.
+        rule_target = SINGLE_PASS_RULE_TARGET
+        makefile_variables = MAKEFILE_SINGLE_PASS_VARIABLE % define_python3_maybe()
+        nim_compile_command = get_nim_wrapper_compile_command()
+    else:
+        rule_target = PMGEN_RULE_TARGET
+        makefile_variables = MAKEFILE_PMGEN_VARIABLE % define_python3_maybe()
+        nim_compile_command = NIM_COMPILER_COMMAND % "compile"
+
+    compile_rule = "%s: %s\n\t%s%s $(PMGEN) %s" % \
+            (rule_target, " ".join(prereqs),
+                    get_timing_command_prefix(rule_target, pminc_basename),
+                    nim_compile_command, pminc_fname)
 
     makefile_fname = MAKEFILE_FNAME_TEMPLATE % pminc_basename
     makefile_clean_rules = MAKEFILE_CLEAN_RULES % dict(
-            pmgen_prefix=PMGEN_PREFIX)
+            pmgen_prefix=PMGEN_PREFIX,
+            wrapper_cfg_fname=WRAPPER_CFG_FNAME,
+            pgo_profile_dirname=PGO_PROFILE_DIRNAME,
+            timing_record_basename=TIMING_RECORD_BASENAME,
+            c_compiler_launchers=" ".join(C_COMPILER_LAUNCHER_FNAME_TEMPLATE % cc
+                    for cc in C_COMPILER_LAUNCHER_COMPILERS))
     with open(makefile_fname, "w") as f:
         f.write(MAKEFILE_CONTENT % dict(
                 datestamp=datestamp,
-                variables=MAKEFILE_PMGEN_VARIABLE % define_python3_maybe(),
+                variables=makefile_variables,
                 build_rules=compile_rule,
                 clean_rules=makefile_clean_rules))
 
@@ -378,14 +1297,13 @@ def compile_generated_nim_wrappers(nim_wrapper_fnames, pymodule_fnames,
     datestamp = get_datestamp()
 
     # Create the Makefile.
-    # We need to "dot-dot" one level, because we are in the "pmgen" subdir.
-    nim_modfiles_rel_pmgen_dir = [dotdot(modfname) for modfname in nim_modfiles]
-
     script_cmd = sys.argv[0]
     if os.path.isabs(script_cmd):
         abspath_to_pmgen_py = script_cmd
     else:
-        abspath_to_pmgen_py = os.path.abspath(dotdot(script_cmd))
+        abspath_to_pmgen_py = abspath_in_orig_dir(script_cmd)
+    # Re-run "pmgen.py" with the same command-line options (eg, "--buildDir").
+    pmgen_py_args = " ".join(shell_quote(arg) for arg in sys.argv[1:])
 
     pminc_fname = PMINC_FNAME_TEMPLATE % dict(
             modname_basename=pminc_basename,
@@ -393,9 +1311,11 @@ def compile_generated_nim_wrappers(nim_wrapper_fnames, pymodule_fnames,
     build_rules = [
             "all: %s" % " ".join(pymodule_fnames)
             ] + [
-            "%s: %s\n\t%s %s\n\tmv -f %s ../" %
-                    (pymodule_fname, nim_fname, NIM_COMPILER_COMMAND % "compile", nim_fname,
-                            pymodule_fname)
+            "%s: %s\n\t%s%s %s\n\tmv -f %s %s/" %
+                    (pymodule_fname, nim_fname,
+                            get_timing_command_prefix("wrapper", pymodule_fname[:-3]),
+                            get_nim_wrapper_compile_command(), nim_fname,
+                            pymodule_fname, shell_quote(OUTPUT_DIR))
             for nim_fname, pymodule_fname in zip(nim_wrapper_fnames, pymodule_fnames)
             ] + [
             "%s: %s\n\t%s $(PMGEN) %s" %
@@ -404,18 +1324,25 @@ def compile_generated_nim_wrappers(nim_wrapper_fnames, pymodule_fnames,
                     # the `pminc_fname` that was used to generate this
                     # "pmgen*_wrap.nim" file in a previous invocation of
                     # "pmgen.py".
-                    (nim_fname, pminc_fname, NIM_COMPILER_COMMAND % "compile", pminc_fname)
+                    (nim_fname, pminc_fname,
+                            get_timing_command_prefix(PMGEN_RULE_TARGET, pminc_basename) +
+                                    NIM_COMPILER_COMMAND % "compile", pminc_fname)
                     for nim_fname in nim_wrapper_fnames
             ] + [
-            "%s: %s\n\tcd .. ; %s %s %s" %
-                    (pminc_fname, " ".join(nim_modfiles_rel_pmgen_dir),
-                            python_exe_name,
-                            abspath_to_pmgen_py, " ".join(nim_modfiles))
+            "%s: %s\n\tcd %s ; %s %s %s" %
+                    (pminc_fname, " ".join(nim_modfiles),
+                            shell_quote(ORIG_DIR), python_exe_name,
+                            abspath_to_pmgen_py, pmgen_py_args)
             ]
 
     makefile_fname = MAKEFILE2_FNAME_TEMPLATE
     makefile_clean_rules = MAKEFILE_CLEAN_RULES % dict(
-            pmgen_prefix=PMGEN_PREFIX)
+            pmgen_prefix=PMGEN_PREFIX,
+            wrapper_cfg_fname=WRAPPER_CFG_FNAME,
+            pgo_profile_dirname=PGO_PROFILE_DIRNAME,
+            timing_record_basename=TIMING_RECORD_BASENAME,
+            c_compiler_launchers=" ".join(C_COMPILER_LAUNCHER_FNAME_TEMPLATE % cc
+                    for cc in C_COMPILER_LAUNCHER_COMPILERS))
     with open(makefile_fname, "w") as f:
         f.write(MAKEFILE_CONTENT % dict(
                 datestamp=datestamp,
@@ -428,6 +1355,89 @@ def compile_generated_nim_wrappers(nim_wrapper_fnames, pymodule_fnames,
     subprocess.check_call(make_command)
 
 
+def ninja_escape(path):
+    # https://ninja-build.org/manual.html#ref_lexer
+    return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def generate_ninja_file(nim_modfiles, pminc_basename, nim_wrapper_fnames,
+        pymodule_fnames):
+    datestamp = get_datestamp()
+
+    pminc_fname = PMINC_FNAME_TEMPLATE % dict(
+            modname_basename=pminc_basename,
+            pmgen_prefix=PMGEN_PREFIX)
+    stamp_fname = NINJA_STAMP_FNAME_TEMPLATE % dict(
+            modname_basename=pminc_basename,
+            pmgen_prefix=PMGEN_PREFIX)
+    nim_modfiles = [ninja_escape(modfname) for modfname in nim_modfiles]
+    # A change of only the compiler flags (in "pymod.cfg", which "pmgen.py"
+    # writes into these files) must also rebuild everything.
+    cfg_fnames = [NIM_CFG_FNAME, WRAPPER_CFG_FNAME]
+
+    # The files that the pmgen phase will generate for each Python module.
+    # These are only known after the pmgen phase has been run at least once.
+    generated_fnames = []
+    for nim_fname in nim_wrapper_fnames:
+        c_fname = nim_fname.replace("_wrap.nim", "_capi.c")
+        generated_fnames.extend([nim_fname, nim_fname + ".cfg", c_fname])
+
+    build_statements = [
+            "build %s | %s: pmgen %s | %s" %
+                    (stamp_fname, " ".join(map(ninja_escape, generated_fnames)),
+                            pminc_fname, " ".join(nim_modfiles + cfg_fnames)),
+            "build %s: phony %s" % (PMGEN_RULE_TARGET, stamp_fname),
+    ]
+    installed_fnames = []
+    for nim_fname, pymodule_fname in zip(nim_wrapper_fnames, pymodule_fnames):
+        c_fname = nim_fname.replace("_wrap.nim", "_capi.c")
+        installed_fname = ninja_escape(os.path.join(OUTPUT_DIR, pymodule_fname))
+        build_statements.append("build %s: nimlib %s | %s %s %s" %
+                (ninja_escape(pymodule_fname), ninja_escape(nim_fname),
+                        ninja_escape(nim_fname + ".cfg"), ninja_escape(c_fname),
+                        " ".join(nim_modfiles + cfg_fnames)))
+        build_statements.append("build %s: install %s" %
+                (installed_fname, ninja_escape(pymodule_fname)))
+        installed_fnames.append(installed_fname)
+    build_statements.append("default %s" %
+            (" ".join(installed_fnames) if installed_fnames else PMGEN_RULE_TARGET))
+
+    pmgen_command = "%s %s %s" % (NIM_COMPILER_COMMAND % "compile",
+            NIM_SYMBOL_DEFS_MAKE, "--noLinking --noMain %s" % define_python3_maybe())
+    write_file_if_changed(NINJA_FNAME, NINJA_CONTENT % dict(
+            datestamp=datestamp,
+            pmgen_command=pmgen_command,
+            nim_compile_command=get_nim_wrapper_compile_command(),
+            pmgen_timing=get_timing_command_prefix(PMGEN_RULE_TARGET, pminc_basename),
+            # Ninja substitutes the module filename for `$out` in the rule.
+            nimlib_timing=get_timing_command_prefix("wrapper", "$out"),
+            build_statements="\n".join(build_statements)))
+
+
+def run_ninja(targets=[]):
+    ninja_command = [NINJA_EXE_PATH, "-f", NINJA_FNAME] + targets
+    print(" ".join(ninja_command))
+    subprocess.check_call(ninja_command)
+
+
+def build_with_ninja(nim_modfiles, pminc_basename):
+    # Ninja needs to know every output in advance, but the names of the
+    # generated Nim wrappers are only known after the pmgen phase has run.
+    # So first describe the pipeline using the wrappers from any previous run,
+    # bring the pmgen phase up-to-date, and then (if the set of wrappers has
+    # changed) describe the pipeline again before building everything.
+    (nim_wrapper_fnames, pymodule_fnames) = find_generated_nim_wrappers()
+    generate_ninja_file(nim_modfiles, pminc_basename, nim_wrapper_fnames,
+            pymodule_fnames)
+    run_ninja([PMGEN_RULE_TARGET])
+
+    (new_nim_wrapper_fnames, new_pymodule_fnames) = find_generated_nim_wrappers()
+    if new_nim_wrapper_fnames != nim_wrapper_fnames:
+        generate_ninja_file(nim_modfiles, pminc_basename, new_nim_wrapper_fnames,
+                new_pymodule_fnames)
+    run_ninja()
+
+
 def define_python3_maybe():
     python_ver = sys.version_info
     if python_ver.major >= 3:
@@ -0,0 +1,106 @@
+# Copyright (c) 2015 SnapDisco Pty Ltd, Australia.
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# [ MIT license: https://opensource.org/licenses/MIT ]
+
+"""Build Pymod Nim modules as setuptools extensions.
+
+Usage (in "setup.py"):
+
+    from setuptools import setup
+    from nim_pm.setuptools import NimExtension, build_ext
+
+    setup(
+        ...
+        ext_modules=[NimExtension("mypkg._foo", "mypkg/foo.nim")],
+        cmdclass={"build_ext": build_ext},
+    )
+
+Each `NimExtension` is compiled by "pmgen", into the same per-user cache that
+is used by the import hook (keyed by a hash of the Nim source code, any other
+files listed in `depends`, the "pymod.cfg" file (if any), the "pmgen" options
+& the Python ABI), and then copied into the setuptools build directory.  So an
+unchanged Nim module is only compiled once, however many times the wheel is
+built.  The extensions are built concurrently by `build_ext --parallel N`.
+
+The "pmgen" build profile is "release", unless `build_ext --debug` is used
+(or a build profile is specified in `pmgen_args`, using "--profile" or
+"--release").
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+from setuptools import Extension
+from setuptools.command.build_ext import build_ext as _build_ext
+
+try:
+    from setuptools.errors import CompileError
+except ImportError:
+    from distutils.errors import CompileError
+
+from .importhook import build_nim_module
+
+
+def has_build_profile_arg(pmgen_args):
+    """Return whether `pmgen_args` selects a "pmgen" build profile."""
+    return any(arg in ("--profile", "--release") or arg.startswith("--profile=")
+            for arg in pmgen_args)
+
+
+class NimExtension(Extension):
+    """A Python module to be compiled from the Nim module `nim_fname`.
+
+    `name` is the full (dotted) name of the Python module; the last component
+    of it is supplied to "pmgen" as the Python module name.  Any `pmgen_args`
+    (eg, `["--pyarrayEnabled"]`) are passed to "pmgen".
+    """
+
+    def __init__(self, name, nim_fname, pmgen_args=(), depends=(), **kwargs):
+        Extension.__init__(self, name, sources=[nim_fname], depends=list(depends),
+                **kwargs)
+        self.pmgen_args = list(pmgen_args)
+
+
+class build_ext(_build_ext):
+    """A `build_ext` command that also builds `NimExtension`s."""
+
+    def build_extension(self, ext):
+        if not isinstance(ext, NimExtension):
+            return _build_ext.build_extension(self, ext)
+
+        nim_fname = ext.sources[0]
+        mod_name = ext.name.rpartition(".")[2]
+        pmgen_args = ext.pmgen_args
+        if not has_build_profile_arg(pmgen_args):
+            profile = "debug" if self.debug else "release"
+            pmgen_args = ["--profile", profile] + pmgen_args
+
+        try:
+            compiled_fname = build_nim_module(nim_fname, mod_name, pmgen_args,
+                    verbose=self.verbose > 1, depends=ext.depends)
+        except ImportError as e:
+            raise CompileError(str(e))
+
+        ext_fullpath = self.get_ext_fullpath(ext.name)
+        self.mkpath(os.path.dirname(ext_fullpath))
+        self.copy_file(compiled_fname, ext_fullpath)
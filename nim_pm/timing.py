@@ -0,0 +1,206 @@
+# Copyright (c) 2015 SnapDisco Pty Ltd, Australia.
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# [ MIT license: https://opensource.org/licenses/MIT ]
+
+"""Record where the time goes in a "pmgen" build.
+
+"pmgen" times its own phases (such as probing the Python environment) using a
+`BuildTimer`.  The Nim compiler invocations are run by Make or Ninja, so each
+of these is wrapped in a command:
+
+    python -m nim_pm.timing --record FILE --phase PHASE --module MODULE -- COMMAND...
+
+which runs the command (passing its output through), and appends a record of
+its wall-clock & CPU time to FILE.  The output of the Nim compiler is used to
+split the wall-clock time into the steps "nim2c" (the Nim compiler, including
+the Pymod macros that run in the Nim VM), "cc" (the C compiler) & "link".
+(The C compiler commands are recognised by the Nim option "listCmd", which is
+enabled by default in "pymod-extensions.cfg".)
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+STEP_NAMES = ["nim2c", "cc", "link"]
+STEP_DESCRIPTIONS = dict(nim2c="Nim->C", cc="cc", link="link")
+
+C_COMPILER_EXE_NAMES = ["cc", "gcc", "clang", "c++", "g++", "clang++", "icc", "tcc",
+        "launch-gcc", "launch-clang"]
+# Newer versions of Nim print these, rather than the command, if not "listCmd".
+NIM_CC_LINE_PREFIX = "CC: "
+NIM_LINK_LINE_REGEX = re.compile(r"\[Link\]")
+
+
+def get_cpu_time():
+    """Return the CPU time of this process & its waited-for child processes."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+class BuildTimer(object):
+    """Records the wall-clock & CPU time of each phase of a build."""
+
+    def __init__(self):
+        self.records = []
+        self._start_wall = time.time()
+        self._start_cpu = get_cpu_time()
+
+    @contextlib.contextmanager
+    def phase(self, phase_name, module_name=None):
+        start_wall = time.time()
+        start_cpu = get_cpu_time()
+        try:
+            yield
+        finally:
+            self.records.append(dict(
+                    phase=phase_name,
+                    module=module_name,
+                    wall=time.time() - start_wall,
+                    cpu=get_cpu_time() - start_cpu))
+
+    def load_records(self, record_fname):
+        """Append the records written by the timed commands to `record_fname`."""
+        if not os.path.exists(record_fname):
+            return
+        with open(record_fname) as f:
+            for line in f:
+                if line.strip():
+                    self.records.append(json.loads(line))
+
+    def get_report(self):
+        return dict(
+                total=dict(
+                        wall=time.time() - self._start_wall,
+                        cpu=get_cpu_time() - self._start_cpu),
+                phases=self.records)
+
+    def write_report(self, report_fname):
+        with open(report_fname, "w") as f:
+            json.dump(self.get_report(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    def get_summary(self):
+        """Return a one-line summary of the report."""
+        report = self.get_report()
+        parts = ["total %.1fs (%.1fs CPU)" % (report["total"]["wall"], report["total"]["cpu"])]
+        for record in report["phases"]:
+            label = record["phase"]
+            if record.get("module"):
+                label = "%s[%s]" % (label, record["module"])
+            part = "%s %.1fs" % (label, record["wall"])
+            steps = record.get("steps")
+            if steps:
+                part += " (%s)" % ", ".join("%s %.1fs" % (STEP_DESCRIPTIONS[s], steps[s])
+                        for s in STEP_NAMES if s in steps)
+            parts.append(part)
+        return "pmgen timing: " + " | ".join(parts)
+
+
+def classify_nim_output_line(line):
+    """Return the step that this line of Nim compiler output begins, if any."""
+    if line.startswith(NIM_CC_LINE_PREFIX):
+        return "cc"
+    if NIM_LINK_LINE_REGEX.search(line):
+        return "link"
+
+    words = line.split()
+    if words and os.path.basename(words[0]) in C_COMPILER_EXE_NAMES:
+        return "cc" if "-c" in words else "link"
+    return None
+
+
+def run_timed_command(command, phase_name, module_name, record_fname):
+    """Run `command`, then append a timing record for it to `record_fname`.
+
+    Return the exit status of the command.
+    """
+    start_wall = time.time()
+    start_cpu = get_cpu_time()
+
+    # The steps only ever advance (from "nim2c" to "cc" to "link").
+    step_idx = 0
+    step_start_wall = start_wall
+    steps = {}
+
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+    for line in iter(proc.stdout.readline, ""):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        step = classify_nim_output_line(line)
+        if step is not None and STEP_NAMES.index(step) > step_idx:
+            now = time.time()
+            steps[STEP_NAMES[step_idx]] = now - step_start_wall
+            step_idx = STEP_NAMES.index(step)
+            step_start_wall = now
+    returncode = proc.wait()
+
+    end_wall = time.time()
+    steps[STEP_NAMES[step_idx]] = end_wall - step_start_wall
+    record = dict(
+            phase=phase_name,
+            module=module_name,
+            wall=end_wall - start_wall,
+            cpu=get_cpu_time() - start_cpu,
+            steps=steps,
+            returncode=returncode)
+    # Each record is a single line, appended in a single write, so records
+    # from concurrent commands (eg, run by Ninja) won't be interleaved.
+    with open(record_fname, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+    return returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m nim_pm.timing",
+            description="Run a command & append a record of its timing to a file.")
+    parser.add_argument('--record', dest="record", required=True, metavar="FILE")
+    parser.add_argument('--phase', dest="phase", required=True)
+    parser.add_argument('--module', dest="module", default=None)
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    command = args.command
+    if command and command[0] == "--":
+        command = command[1:]
+    if not command:
+        parser.error("no command specified")
+
+    module_name = args.module
+    if module_name and module_name.endswith(".so"):
+        # Ninja passes the output filename (`$out`).
+        module_name = os.path.basename(module_name)[:-3]
+
+    sys.exit(run_timed_command(command, args.phase, module_name, args.record))
+
+
+if __name__ == "__main__":
+    main()
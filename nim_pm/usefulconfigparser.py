@@ -10,7 +10,32 @@ if sys.version_info.major >= 3:
 else:
     from ConfigParser import RawConfigParser
 
-from .orderedmultidict import OrderedMultiDict
+
+
+class _RepeatableOptionsConfigParser(RawConfigParser):
+    """A RawConfigParser that keeps every value of a repeated option name.
+
+    RawConfigParser stores the options of each section in a dict, so it keeps
+    only one value of each option name (& in Python 3, by default, it raises
+    DuplicateOptionError instead).  So each option name that is read is made
+    unique, by appending a separator & the number of options read so far.
+    `get_option_name` recovers the original (lower-cased) option name.
+    """
+
+    _OPTION_NAME_SEPARATOR = "\0"
+
+    def __init__(self, *args, **kwargs):
+        RawConfigParser.__init__(self, *args, **kwargs)
+        self._num_options_read = 0
+
+    def optionxform(self, optionstr):
+        self._num_options_read += 1
+        return "%s%s%d" % (RawConfigParser.optionxform(self, optionstr),
+                self._OPTION_NAME_SEPARATOR, self._num_options_read)
+
+    @classmethod
+    def get_option_name(cls, unique_optionstr):
+        return unique_optionstr.split(cls._OPTION_NAME_SEPARATOR, 1)[0]
 
 
 class UsefulConfigParser(object):
@@ -43,9 +68,9 @@ class UsefulConfigParser(object):
         #
         # Grrr...
         if sys.version_info.major >= 3:
-            self._cp = RawConfigParser(dict_type=OrderedMultiDict, inline_comment_prefixes=(';',))
+            self._cp = _RepeatableOptionsConfigParser(inline_comment_prefixes=(';',))
         else:
-            self._cp = RawConfigParser(dict_type=OrderedMultiDict)
+            self._cp = _RepeatableOptionsConfigParser()
 
         if isinstance(filenames_to_try, str):
             filenames_to_try = [filenames_to_try]
@@ -69,12 +94,18 @@ class UsefulConfigParser(object):
         ## Otherwise, RawConfigParser will raise ConfigParser.NoSectionError.
         if not self._cp.has_section(section_name):
             return []
-        return self._cp.options(section_name)
+        option_names = []
+        for unique_optname in self._cp.options(section_name):
+            option_name = self._cp.get_option_name(unique_optname)
+            if option_name not in option_names:
+                option_names.append(option_name)
+        return option_names
 
     def get(self, section_name, option_name, do_optionxform=True):
         if do_optionxform:
             # https://docs.python.org/2/library/configparser.html#ConfigParser.RawConfigParser.optionxform
-            option_name = self._cp.optionxform(option_name)
+            # (Not `self._cp.optionxform`, which makes each option name unique.)
+            option_name = RawConfigParser.optionxform(self._cp, option_name)
 
         if section_name is None:
             return self._get_optval_in_sections(self.sections(), option_name)
@@ -96,7 +127,7 @@ class UsefulConfigParser(object):
 
             optvals.extend([optval
                     for optname, optval in self._cp.items(section_name)
-                    if optname == option_name])
+                    if self._cp.get_option_name(optname) == option_name])
         return optvals
 
     def getboolean(self, section_name, option_name, do_optionxform=True):
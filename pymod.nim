@@ -40,6 +40,18 @@ when not defined(pmgen):
     # Return no statements, so nothing will happen.
     result = newStmtList()
 
+  macro definePyException*(nimExcType, pyExcName, pyBaseExcName: expr): stmt =
+    # Return no statements, so nothing will happen.
+    result = newStmtList()
+
+  macro exportpyKernel*(nimType: expr): stmt =
+    # Return no statements, so nothing will happen.
+    result = newStmtList()
+
+  macro exportpytype*(typeDef: stmt): stmt =
+    # The identity transformation: Return the type section unchanged.
+    result = typeDef
+
 
   #
   #=== User-invoked macros part 2: exporting Nim procs to Python
@@ -78,3 +90,18 @@ when not defined(pmgen):
   # Will be IGNORED if included BEFORE the exportpy pragma for a given proc.
   macro return_dict*(procDef: expr): stmt =
     result = procDef
+
+  #=== User-invoked macro: export the proc as the constructor of its class ===
+  # Nothing actually happens in this macro (as for `return_dict`).
+  macro pyConstructor*(procDef: expr): stmt =
+    result = procDef
+
+  #=== User-invoked macro: also export a batch variant `<name>_batch` ===
+  # Nothing actually happens in this macro (as for `return_dict`).
+  macro batched*(procDef: expr): stmt =
+    result = procDef
+
+  #=== User-invoked macro: cache the results of `size` calls in an LRU cache ===
+  # Nothing actually happens in this macro (as for `return_dict`).
+  macro memoize*(size: expr, procDef: expr): stmt =
+    result = procDef
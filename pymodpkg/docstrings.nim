@@ -142,7 +142,9 @@ template rstrip(s: string): string =
 
 
 proc expectProcDef(proc_def_node: NimNode): string {. compileTime .} =
-  expectKind(proc_def_node, nnkProcDef)
+  # An (exported) iterator definition has docstrings just like a proc.
+  if proc_def_node.kind != nnkIteratorDef:
+    expectKind(proc_def_node, nnkProcDef)
   let proc_name_node = name(proc_def_node)
   if kind(proc_name_node) == nnkEmpty:
     result = "<unnamed>"
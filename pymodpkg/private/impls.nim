@@ -8,7 +8,10 @@
 #=== Internal constants
 #
 
-const exportpy_nim_wrapper_template = "exportpy_$1"
+# The Nim wrapper procs are qualified by the Python module name, so that the
+# wrappers of several Python modules can be compiled into the same Nim module
+# (which is what happens in a single-pass build; see `pymodSinglePass` below).
+const exportpy_nim_wrapper_template = "exportpy_$1_$2"
 const exportpy_c_func_name_template = "py_$1"
 
 # We start the template with a non-empty prefix ("pmgen", in this case) to
@@ -106,6 +109,28 @@ proc `<<`(ss: var seq[string], s: string) {. compileTime .} =
   ss.add(s)
 
 
+proc withoutDatestampLines(content: string): seq[string] {. compileTime .} =
+  result = @[]
+  for line in content.splitLines():
+    if "Auto-generated by Pymod on" notin line:
+      result.add(line)
+
+
+proc writeFileIfChanged(fname, content: string) {. compileTime .} =
+  # Leave an unchanged file untouched (ignoring the auto-generated datestamp),
+  # to preserve its timestamp.  This enables build tools that compare
+  # timestamps (such as Ninja's "restat") to prune everything downstream.
+  var prev_content = ""
+  try:
+    prev_content = readFile(fname)
+  except IOError:
+    discard
+  if prev_content.len > 0 and
+      withoutDatestampLines(prev_content) == withoutDatestampLines(content):
+    return
+  writeFile(fname, content)
+
+
 proc getTargetTypeNodeOfPtr(ptr_node: NimNode, descr: string): NimNode
     {. compileTime .} =
   ## `descr` might be, for example, "proc param" or "return".
@@ -216,6 +241,87 @@ proc verifyBuiltinNimType(nim_type_node: NimNode): TypeFmtTuple
     error(msg & treeRepr(nim_type_node))
 
 
+proc getNumpyCompatibleElemType(type_node, elem_type_node: NimNode, descr: string):
+    string {. compileTime .} =
+  # `descr` might be, for example, "proc param" or "return".
+  result = if elem_type_node.kind == nnkIdent: $elem_type_node else: ""
+  case result
+  of "bool", "int8", "int16", "int32", "int64", "uint8", "uint16", "uint32", "uint64",
+      "float32", "float64":
+    discard
+  of "float":
+    # `float` is an alias of `float64`, which is a `NumpyCompatibleNimType`.
+    result = "float64"
+  else:
+    let msg = "unhandled $1 type `$2` [$3]: element type must be a `NumpyCompatibleNimType`" %
+        [descr, repr(type_node), lineinfo(type_node)]
+    error(msg)
+
+
+proc verifyArrayReturnType(return_type_node: NimNode): TypeFmtTuple
+    {. compileTime .} =
+  # A Nim `seq[T]` or `array[N, T]` (of a Numpy-compatible element type `T`) is
+  # returned as a new 1-D Numpy array, by a single bulk copy of its elements.
+  #hint("verifyArrayReturnType: " & treeRepr(return_type_node))
+  expectKind(return_type_node, nnkBracketExpr)
+  let container_node = return_type_node[0]
+  let container = if container_node.kind == nnkIdent: $container_node else: ""
+  let expected_len = if container == "array": 3 else: 2
+  if (container != "seq" and container != "array") or
+      return_type_node.len != expected_len:
+    let msg = "unhandled return type `$1` [$2]: " %
+        [repr(return_type_node), lineinfo(return_type_node)]
+    error(msg & treeRepr(return_type_node))
+
+  let elem_type = getNumpyCompatibleElemType(return_type_node,
+      return_type_node[expected_len-1], "return")
+
+  when not defined(pyarrayEnabled):
+    let msg = "can't return `$1` [$2] as a Numpy array unless \"pmgen.py\" is invoked with \"--pyarrayEnabled\"" %
+        [repr(return_type_node), lineinfo(return_type_node)]
+    error(msg)
+
+  # "O&" (a PyObject created by a converter function) is not used to build a
+  # Python format string; it only identifies the conversion.
+  let nim_type = repr(return_type_node)
+  let py_type = "numpy.ndarray[$1]" % elem_type
+  result = (nim_type, "ptr PyArrayObject", py_type, "O&", nil, nil)
+
+
+proc verifySeqParamType(param_type_node: NimNode): TypeFmtTuple
+    {. compileTime .} =
+  # A Nim `seq[T]` or `openarray[T]` parameter (of a Numpy-compatible element
+  # type `T`) accepts any Python sequence of numbers, or any object with a 1-D
+  # C-contiguous buffer of `T` (such as a Numpy array), which isn't copied.
+  # The Python object is received by `PyArg_Parse...` as an "O".
+  #hint("verifySeqParamType: " & treeRepr(param_type_node))
+  expectKind(param_type_node, nnkBracketExpr)
+  let container_node = param_type_node[0]
+  var container = if container_node.kind == nnkIdent: $container_node else: ""
+  if cmpIgnoreStyle(container, "openarray") == 0:
+    container = "openarray"
+  if (container != "seq" and container != "openarray") or param_type_node.len != 2:
+    let msg = "unhandled Nim type `$1` [$2]: " %
+        [repr(param_type_node), lineinfo(param_type_node)]
+    error(msg & treeRepr(param_type_node))
+
+  let elem_type = getNumpyCompatibleElemType(param_type_node, param_type_node[1],
+      "proc param")
+  let nim_type = "$1[$2]" % [container, elem_type]
+  let py_type = "sequence of $1" % elem_type
+  result = (nim_type, "pointer", py_type, "O", nil, nil)
+
+
+proc isSeqParam(type_fmt_tuple: TypeFmtTuple): bool {. compileTime .} =
+  result = type_fmt_tuple.nim_type.startsWith("seq[") or
+      type_fmt_tuple.nim_type.startsWith("openarray[")
+
+
+proc getSeqParamElemType(type_fmt_tuple: TypeFmtTuple): string {. compileTime .} =
+  let nim_type = type_fmt_tuple.nim_type
+  result = nim_type[nim_type.find('[')+1 .. nim_type.len-2]
+
+
 proc verifyProcParamType(py_object_type_defs: PyObjectTypeDefTable,
     param_type_node: NimNode): TypeFmtTuple {. compileTime .} =
   #hint("param_type_node = " & treeRepr(param_type_node))
@@ -223,12 +329,16 @@ proc verifyProcParamType(py_object_type_defs: PyObjectTypeDefTable,
   of nnkPtrTy:
     let ptr_target_type_node = getTargetTypeNodeOfPtr(param_type_node, "proc param")
     result = verifyDefinedPyObjectType(py_object_type_defs, ptr_target_type_node)
+  of nnkBracketExpr:
+    result = verifySeqParamType(param_type_node)
   else:
     result = verifyBuiltinNimType(param_type_node)
 
 
 proc verifyProcDef(proc_def_node: NimNode, error_msg: string): string {. compileTime .} =
-  expectKind(proc_def_node, nnkProcDef)
+  # An iterator is exported as a Python function that returns a Python iterator.
+  if proc_def_node.kind != nnkIteratorDef:
+    expectKind(proc_def_node, nnkProcDef)
   let proc_name_node = proc_def_node[0]
   if proc_name_node.kind == nnkEmpty:
     # We can't allow unnamed procs, because we need to be able
@@ -345,6 +455,173 @@ proc definePyObjectTypeImpl*(
   result = newStmtList()
 
 
+proc definePyExceptionImpl*(
+    pyExceptionDefs: var PyExceptionDefTable,
+    nim_type_node,
+    py_name_node,
+    py_base_name_node: NimNode): NimNode {. compileTime .} =
+  expectKind(nim_type_node, nnkIdent)
+  expectKind(py_name_node, nnkStrLit)
+  expectKind(py_base_name_node, nnkStrLit)
+
+  let nim_type: string = $nim_type_node
+  let prev_def_with_this_nim_type = py_exception_defs.get(nim_type)
+  if prev_def_with_this_nim_type != nil:
+    let prev_line_info = prev_def_with_this_nim_type.def_line_info
+    let msg = "Nim exception type `$1` [$2] has already been mapped to a Python exception [previously at $3]" %
+        [nim_type, lineinfo(nim_type_node), prev_line_info]
+    error(msg)
+
+  let py_name: string = $py_name_node
+  verifyValidCIdent(py_name, py_name_node)
+  for e in py_exception_defs:
+    if e.storedVal.py_name == py_name:
+      let msg = "Python exception `$1` [$2] has already been defined [previously at $3]" %
+          [py_name, lineinfo(py_name_node), e.storedVal.def_line_info]
+      error(msg)
+
+  # The base is either a built-in Python exception (`PyExc_$1` in C), or a
+  # previously-defined Python exception.
+  let py_base_name: string = $py_base_name_node
+  verifyValidCIdent(py_base_name, py_base_name_node)
+
+  let new_ped = new_PyExceptionDef(
+      nim_type,
+      nim_type_node.lineinfo,
+      py_name,
+      py_base_name
+  )
+  py_exception_defs << new_ped
+
+  # There's nothing we actually have to write back out...
+  result = newStmtList()
+
+
+proc exportpyKernelImpl*(
+    pyClassDefs: var PyClassDefTable,
+    nim_type_node: NimNode): NimNode {. compileTime .} =
+  expectKind(nim_type_node, nnkIdent)
+
+  let nim_type: string = $nim_type_node
+  verifyValidCIdent(nim_type, nim_type_node)
+  let prev_def_with_this_nim_type = py_class_defs.get(nim_type)
+  if prev_def_with_this_nim_type != nil:
+    let prev_line_info = prev_def_with_this_nim_type.def_line_info
+    let msg = "Nim type `$1` [$2] has already been exported as a Python class [previously at $3]" %
+        [nim_type, lineinfo(nim_type_node), prev_line_info]
+    error(msg)
+
+  py_class_defs << new_PyClassDef(nim_type, nim_type_node.lineinfo)
+
+  # There's nothing we actually have to write back out...
+  result = newStmtList()
+
+
+proc getIdentOfExportable(n: NimNode): tuple[ident: NimNode, is_exported: bool]
+    {. compileTime .} =
+  # The identifier of a type or field name, which might be exported (`*`) or
+  # followed by pragmas.
+  var name_node = n
+  if name_node.kind == nnkPragmaExpr:
+    name_node = name_node[0]
+  if name_node.kind == nnkPostfix:
+    result = (name_node[1], true)
+  else:
+    expectKind(name_node, nnkIdent)
+    result = (name_node, false)
+
+
+proc isGcManagedTypeNode(type_node: NimNode): bool {. compileTime .} =
+  # Whether a field of this type refers to Nim-GC-managed memory (which the Nim
+  # GC wouldn't find, if the Nim object were stored inline in a PyObject).
+  # This only checks the syntax of the type (eg, `string` or `seq[T]`), to
+  # report the field; the generated Nim wrapper checks the resolved type
+  # (using `supportsCopyMem`), which catches named types & aliases too.
+  case type_node.kind
+  of nnkRefTy, nnkProcTy:
+    result = true
+  of nnkIdent:
+    result = ($type_node == "string")
+  of nnkBracketExpr:
+    result = ($type_node[0] == "seq") or
+        (type_node.len > 2 and isGcManagedTypeNode(type_node[2]))
+  of nnkTupleTy:
+    result = false
+    for i in 0.. <type_node.len:
+      if isGcManagedTypeNode(type_node[i][type_node[i].len-2]):
+        result = true
+  else:
+    result = false
+
+
+proc exportpytypeImpl*(
+    pyClassDefs: var PyClassDefTable,
+    type_section_node: NimNode): NimNode {. compileTime .} =
+  var type_section = type_section_node
+  if type_section.kind == nnkStmtList and type_section.len == 1:
+    type_section = type_section[0]
+  expectKind(type_section, nnkTypeSection)
+
+  for i in 0.. <type_section.len:
+    let type_def_node = type_section[i]
+    expectKind(type_def_node, nnkTypeDef)
+    let nim_type_node = getIdentOfExportable(type_def_node[0]).ident
+    let nim_type: string = $nim_type_node
+    verifyValidCIdent(nim_type, nim_type_node)
+    let object_ty_node = type_def_node[2]
+    if type_def_node[1].kind != nnkEmpty or object_ty_node.kind != nnkObjectTy:
+      let msg = "can't exportpytype `$1` [$2]: only a non-generic Nim `object` type can be exported as a Python type (hint: use `exportpyKernel` for a `ref object` type)" %
+          [nim_type, lineinfo(nim_type_node)]
+      error(msg)
+    if object_ty_node[1].kind != nnkEmpty:
+      let msg = "can't exportpytype `$1` [$2]: an object type that inherits is not supported" %
+          [nim_type, lineinfo(nim_type_node)]
+      error(msg)
+
+    let prev_def_with_this_nim_type = py_class_defs.get(nim_type)
+    if prev_def_with_this_nim_type != nil:
+      let prev_line_info = prev_def_with_this_nim_type.def_line_info
+      let msg = "Nim type `$1` [$2] has already been exported as a Python class [previously at $3]" %
+          [nim_type, lineinfo(nim_type_node), prev_line_info]
+      error(msg)
+
+    let py_class_def = new_PyClassDef(nim_type, nim_type_node.lineinfo, true)
+    let rec_list_node = object_ty_node[2]
+    for j in 0.. <rec_list_node.len:
+      let field_defs_node = rec_list_node[j]
+      if field_defs_node.kind != nnkIdentDefs:
+        let msg = "can't exportpytype `$1` [$2]: an object variant is not supported" %
+            [nim_type, lineinfo(field_defs_node)]
+        error(msg)
+      # The Nim object is copied byte-for-byte into (& out of) the PyObject,
+      # which the Nim GC doesn't scan, so the object must not contain any
+      # references to GC-managed memory.
+      let field_type_node = field_defs_node[field_defs_node.len-2]
+      if isGcManagedTypeNode(field_type_node):
+        let msg = "can't exportpytype `$1` [$2]: the field type `$3` is managed by the Nim GC (hint: use `exportpyKernel` for a `ref object` type)" %
+            [nim_type, lineinfo(field_defs_node), repr(field_type_node)]
+        error(msg)
+
+      for k in 0.. <field_defs_node.len-2:
+        let (field_name_node, is_exported) = getIdentOfExportable(field_defs_node[k])
+        if not is_exported:
+          # A private field is state that isn't visible in Python.
+          continue
+        let field_name = $field_name_node
+        if field_type_node.kind != nnkIdent or
+            verifyBuiltinNimType(field_type_node).py_fmt_str == "s":
+          let msg = "can't exportpytype field `$1.$2` [$3]: only a field of a built-in number or `char` type can be exported (hint: don't export the field using `*`)" %
+              [nim_type, field_name, lineinfo(field_defs_node)]
+          error(msg)
+        let type_fmt_tuple = verifyBuiltinNimType(field_type_node)
+        py_class_def.fields.add(new_ParamNameTypeTuple(field_name, type_fmt_tuple, nil))
+
+    py_class_defs << py_class_def
+
+  # The type section is unchanged.
+  result = type_section_node
+
+
 proc getTupleReturnType(py_object_type_defs: PyObjectTypeDefTable, return_type_node: NimNode): seq[TypeFmtTuple] {. compileTime .} =
   assert(return_type_node.kind == nnkTupleTy)
 
@@ -364,6 +641,9 @@ proc getTupleReturnType(py_object_type_defs: PyObjectTypeDefTable, return_type_n
         let ptr_target_type_node = getTargetTypeNodeOfPtr(node[j], "return")
         return_types[i] = verifyDefinedPyObjectType(py_object_type_defs, ptr_target_type_node)
 
+      elif node[j].kind == nnkBracketExpr:
+        return_types[i] = verifyArrayReturnType(node[j])
+
       elif node[j].kind == nnkTupleTy:
         let msg = "nested tuple return value not implemented [$1]: " % lineinfo(node[j])
         error(msg & treeRepr(node[j]))
@@ -398,6 +678,9 @@ proc getReturnType(py_object_type_defs: PyObjectTypeDefTable,
   of nnkTupleTy:
     result = getTupleReturnType(py_object_type_defs, return_type_node)
 
+  of nnkBracketExpr:
+    result = @[ verifyArrayReturnType(return_type_node) ]
+
   else:
     #hint("return type: " & treeRepr(return_type_node))
     result = @[ verifyBuiltinNimType(return_type_node) ]
@@ -431,7 +714,7 @@ proc countNumIdentsToDefine(param_node: NimNode): int {. compileTime .} =
   #     Empty
 
   type PrevStates = enum
-    Start, WasIdent, WasEmpty, WasPtr
+    Start, WasIdent, WasEmpty, WasPtr, WasSeq
   var prev_state: PrevStates = Start
 
   let empty_or_ident_or_ptr_kind = {nnkEmpty, nnkIdent, nnkPtrTy}
@@ -469,6 +752,11 @@ proc countNumIdentsToDefine(param_node: NimNode): int {. compileTime .} =
         expectKind(ptr_target_type_node, nnkIdent)
         inc(result)
         prev_state = WasPtr
+      of nnkBracketExpr:
+        # A `seq[T]` or `openarray[T]`.  Like a pointer, this is clearly
+        # the type decl.
+        inc(result)
+        prev_state = WasSeq
       of nnkEmpty:
         # OK, so this is the ultimate empty we expected; decrement the
         # count.
@@ -501,6 +789,14 @@ proc countNumIdentsToDefine(param_node: NimNode): int {. compileTime .} =
         prev_state = WasEmpty
       else:
         expectKind(n, nnkEmpty)
+    of WasSeq:
+      # There are no default values for `seq[T]` or `openarray[T]` params.
+      if n.kind != nnkEmpty:
+        let msg = "default values are not supported for `seq` or `openarray` proc params [$1]: " %
+            lineinfo(param_node)
+        error(msg & treeRepr(param_node))
+      dec(result)
+      prev_state = WasEmpty
 
   if prev_state != WasEmpty:
     let msg = "incomplete proc param IdentDefs node [$1]: " % lineinfo(param_node)
@@ -530,13 +826,179 @@ proc hasPragma(proc_def_node: NimNode; pragma_name: string): bool {. compileTime
     let node = proc_def_node[i]
     if node.kind == nnkPragma:
       for j in 0 .. <node.len:
-        if cmpIgnoreStyle($(node[j]), pragma_name) == 0:
+        # (A pragma with a value, such as `memoize: 128`, is an ExprColonExpr.)
+        if node[j].kind in {nnkIdent, nnkSym} and
+            cmpIgnoreStyle($(node[j]), pragma_name) == 0:
           return true
   return false
 
 
+proc getPragmaValue(proc_def_node: NimNode; pragma_name: string): NimNode
+    {. compileTime .} =
+  # The value of a pragma such as `memoize: 128`; or nil, if there isn't one.
+  for i in 0 .. <proc_def_node.len:
+    let node = proc_def_node[i]
+    if node.kind == nnkPragma:
+      for j in 0 .. <node.len:
+        let pragma_node = node[j]
+        if pragma_node.kind == nnkExprColonExpr and
+            pragma_node[0].kind in {nnkIdent, nnkSym} and
+            cmpIgnoreStyle($(pragma_node[0]), pragma_name) == 0:
+          return pragma_node[1]
+  return nil
+
+
+proc getNumpyElemTypeOfScalar(type_fmt_tuple: TypeFmtTuple): string
+    {. compileTime .} =
+  # The Numpy-compatible Nim type of the same size & kind as a built-in Nim
+  # number type (as mapped by `verifyBuiltinNimType`); or nil.
+  case type_fmt_tuple.py_fmt_str
+  of "f":
+    result = "float32"
+  of "d":
+    result = "float64"
+  of "l":
+    result = "int64"
+  of "k":
+    result = "uint64"
+  of "i":
+    result = "int32"
+  of "I":
+    result = "uint32"
+  of "h":
+    result = "int16"
+  of "H":
+    result = "uint16"
+  of "B":
+    result = "uint8"
+  else:
+    result = nil
+
+
+proc createBatchProcPrototype(pp: ref ProcPrototype, proc_def_node: NimNode):
+    ref ProcPrototype {. compileTime .} =
+  # The batch variant of an exported proc receives a sequence of values for
+  # each (number) param of the proc, and returns a Numpy array of the results.
+  let proc_name = pp.proc_name
+  let return_type_fmt_tuple = pp.return_type_fmt_tuple
+  var return_elem_type: string = nil
+  if return_type_fmt_tuple.len == 1 and return_type_fmt_tuple[0].label == nil:
+    return_elem_type = getNumpyElemTypeOfScalar(return_type_fmt_tuple[0])
+  if pp.is_iterator or pp.class_nim_type != nil or return_elem_type == nil or
+      pp.param_name_type_tuple_seq.len == 0:
+    let msg = "can't create a batch variant of `$1` [$2]: only a proc (not a method) with number params & a number return type can be batched" %
+        [proc_name, lineinfo(proc_def_node)]
+    error(msg)
+  when not defined(pyarrayEnabled):
+    let msg = "can't create a batch variant of `$1` [$2] unless \"pmgen.py\" is invoked with \"--pyarrayEnabled\"" %
+        [proc_name, lineinfo(proc_def_node)]
+    error(msg)
+
+  var batch_params: seq[ref ParamNameTypeTuple] = @[]
+  for p in pp.param_name_type_tuple_seq:
+    let elem_type = getNumpyElemTypeOfScalar(p.type_fmt_tuple)
+    if elem_type == nil or p.type_fmt_tuple.py_object_type_def != nil:
+      let msg = "can't create a batch variant of `$1` [$2]: param `$3` isn't a number" %
+          [proc_name, lineinfo(proc_def_node), p.name]
+      error(msg)
+    # As for an `openarray[T]` param (cf, `verifySeqParamType`).
+    let batch_type_fmt_tuple: TypeFmtTuple = ("openarray[$1]" % elem_type, "pointer",
+        "sequence of $1" % elem_type, "O", nil, nil)
+    batch_params.add(new_ParamNameTypeTuple(p.name, batch_type_fmt_tuple, nil))
+
+  # As for a `seq[T]` return type (cf, `verifyArrayReturnType`).
+  let batch_return_type_fmt_tuple: TypeFmtTuple = ("seq[$1]" % return_elem_type,
+      "ptr PyArrayObject", "numpy.ndarray[$1]" % return_elem_type, "O&", nil, nil)
+  let docstring_lines = @[
+      "Call `$1` for each element of the args (which must all be the same length)." %
+          proc_name
+  ]
+  result = new_ProcPrototype(
+      proc_name & "_batch",
+      proc_def_node.lineinfo,
+      @[ batch_return_type_fmt_tuple ],
+      batch_params,
+      docstring_lines
+  )
+
+
+proc createBatchProcDef(pp, batch_pp: ref ProcPrototype): NimNode {. compileTime .} =
+  # The loop over the args runs in Nim, so each element isn't converted to or
+  # from a PyObject.  (The generated proc is exported, like the proc itself.)
+  var params_and_types: seq[string] = @[]
+  var call_args: seq[string] = @[]
+  var len_checks: seq[string] = @[]
+  for i in 0.. <pp.param_name_type_tuple_seq.len:
+    let p = pp.param_name_type_tuple_seq[i]
+    params_and_types << "$1: $2" % [p.name, batch_pp.param_name_type_tuple_seq[i].type_fmt_tuple.nim_type]
+    call_args << "$1($2[i])" % [p.type_fmt_tuple.nim_type, p.name]
+    if i > 0:
+      len_checks << "$1.len != n" % p.name
+  let first_param_name = pp.param_name_type_tuple_seq[0].name
+  let return_elem_type = getNumpyElemTypeOfScalar(pp.return_type_fmt_tuple[0])
+  var lines: seq[string] = @[]
+  lines << "proc $1*($2): $3 =" % [batch_pp.proc_name, params_and_types.join(", "),
+      batch_pp.return_type_fmt_tuple[0].nim_type]
+  lines << "  let n = $1.len" % first_param_name
+  if len_checks.len > 0:
+    lines << "  if $1:" % len_checks.join(" or ")
+    lines << "    raise newException(ValueError, \"the args of `$1` must all be the same length\")" %
+        batch_pp.proc_name
+  lines << "  newSeq(result, n)"
+  lines << "  for i in 0.. <n:"
+  lines << "    result[i] = $1($2($3))" % [return_elem_type, pp.proc_name, call_args.join(", ")]
+  result = parseStmt(lines.join("\n"))
+
+
+proc getMemoizeSize(pp: ref ProcPrototype, proc_def_node: NimNode): int
+    {. compileTime .} =
+  # The results of a memoized proc are cached, keyed on the bytes of its C args,
+  # so its args must be numbers, chars or strings (not Python objects, whose
+  # contents might change); & its results are shared by the calls, so they
+  # mustn't be mutable Python objects.
+  let proc_name = pp.proc_name
+  let size_node = getPragmaValue(proc_def_node, "memoize")
+  if size_node == nil or size_node.kind notin {nnkIntLit .. nnkInt64Lit} or
+      size_node.intVal <= 0:
+    let msg = "can't memoize `$1` [$2]: expected a positive integer cache size, such as `{.memoize: 128.}`" %
+        [proc_name, lineinfo(proc_def_node)]
+    error(msg)
+
+  var can_memoize = not pp.is_iterator and pp.class_nim_type == nil and
+      pp.return_class_nim_type == nil and not pp.do_return_dict
+  for p in pp.param_name_type_tuple_seq:
+    case p.type_fmt_tuple.py_fmt_str
+    of "f", "d", "l", "k", "i", "I", "h", "H", "B", "c", "s":
+      discard
+    else:
+      can_memoize = false
+  for tft in pp.return_type_fmt_tuple:
+    if tft.py_fmt_str.startsWith("O"):
+      can_memoize = false
+  if not can_memoize:
+    let msg = "can't memoize `$1` [$2]: only a proc (not an iterator or a method) with number, char or string params, which doesn't return a Python object or a dict, can be memoized" %
+        [proc_name, lineinfo(proc_def_node)]
+    error(msg)
+  result = int(size_node.intVal)
+
+
+proc getPyClassDefOfType(py_class_defs: PyClassDefTable, type_node: NimNode):
+    ref PyClassDef {. compileTime .} =
+  # The Python class def of the Nim type, if it's exported as a Python class.
+  # (A method of an inline Nim object may modify it, using a `var` param.)
+  if type_node.kind == nnkIdent:
+    result = py_class_defs.get($type_node)
+  elif type_node.kind == nnkVarTy and type_node[0].kind == nnkIdent:
+    result = py_class_defs.get($type_node[0])
+    if result != nil and not result.is_inline_object:
+      result = nil
+  else:
+    result = nil
+
+
 proc exportpyImpl*(
     pyObjectTypeDefs: PyObjectTypeDefTable,
+    pyClassDefs: PyClassDefTable,
     procPrototypes: var ProcPrototypeTable,
     proc_def_node: NimNode): NimNode {. compileTime .} =
 
@@ -547,9 +1009,62 @@ proc exportpyImpl*(
   let proc_params = params(proc_def_node)
   #hint(treeRepr(proc_params))
   let return_type_node = proc_params[0]  # This will always exist, even if Empty.
-  let return_type_fmt_tuple = getReturnType(pyObjectTypeDefs, return_type_node)
+
+  # A proc (marked by the "pyConstructor" pragma) that returns a Nim object of
+  # an exported Python class is the constructor of the class; a proc whose
+  # first param is such a Nim object is a method of the class.  (The first
+  # param isn't a Python param.)  Any other proc that returns such a Nim object
+  # (eg, a `clone` method) returns a new Python object of the class.
+  let return_class_def = getPyClassDefOfType(pyClassDefs, return_type_node)
+  let is_constructor = proc_def_node.hasPragma("pyConstructor")
+  if is_constructor and return_class_def == nil:
+    let msg = "can't exportpy `$1` [$2] as a constructor: it doesn't return an exported Python class" %
+        [proc_name, lineinfo(proc_def_node)]
+    error(msg)
+  var py_class_def = if is_constructor: return_class_def else: nil
+  var first_param_idx = 1
+  if proc_params.len > 1:
+    let first_param_node = proc_params[1]
+    let self_class_def = getPyClassDefOfType(pyClassDefs,
+        first_param_node[first_param_node.len-2])
+    if self_class_def != nil:
+      if is_constructor or proc_def_node.kind == nnkIteratorDef:
+        let msg = "can't exportpy `$1` [$2] as a method of Python class `$3`: a constructor or an iterator can't be a method" %
+            [proc_name, lineinfo(proc_def_node), self_class_def.nim_type]
+        error(msg)
+      if first_param_node.len != 3:
+        let msg = "can't exportpy method `$1` [$2] with more than one param of its Python class type `$3`" %
+            [proc_name, lineinfo(proc_def_node), self_class_def.nim_type]
+        error(msg)
+      py_class_def = self_class_def
+      first_param_idx = 2
+
+  var return_type_fmt_tuple: seq[TypeFmtTuple]
+  var return_class_nim_type: string = nil
+  if return_class_def != nil:
+    # A new Python object of the class is returned.
+    return_class_nim_type = return_class_def.nim_type
+    return_type_fmt_tuple = @[ (return_class_nim_type, "pointer", return_class_nim_type,
+        "", nil, nil) ]
+  else:
+    return_type_fmt_tuple = getReturnType(pyObjectTypeDefs, return_type_node)
 
   let do_return_dict = proc_def_node.hasPragma("returnDict")
+  if do_return_dict and py_class_def != nil:
+    # A proc of a Python class has no module state to hold the dict keys.
+    let msg = "can't exportpy `$1` [$2] of Python class `$3` with the \"returnDict\" pragma" %
+        [proc_name, lineinfo(proc_def_node), py_class_def.nim_type]
+    error(msg)
+
+  let is_iterator = (proc_def_node.kind == nnkIteratorDef)
+  if is_iterator and return_type_fmt_tuple[0].nim_type == "void":
+    let msg = "can't exportpy iterator `$1` [$2] that doesn't yield any values" %
+        [proc_name, lineinfo(proc_def_node)]
+    error(msg)
+  if is_iterator and return_class_nim_type != nil:
+    let msg = "can't exportpy iterator `$1` [$2] that yields Python class `$3`" %
+        [proc_name, lineinfo(proc_def_node), return_class_nim_type]
+    error(msg)
 
   # NOTE:  We expect that each `param_node` is of kind `nnkIdentDefs`:
   # it defines an identifier as a parameter-name with a type.  However,
@@ -586,13 +1101,14 @@ proc exportpyImpl*(
   # (then allocate name+type sequences of the apppropriate length)
   #  2. fill up the sequences with the names+types
   var num_idents = 0
-  let num_params = proc_params.len - 1
+  let num_params = proc_params.len - first_param_idx
   var num_idents_per_param: seq[int]
   newSeq(num_idents_per_param, num_params)
 
-  for i in 1..num_params:  # start at 1 because params[0] is the return type.
+  # Start at 1 because params[0] is the return type (or at 2, for a method).
+  for i in first_param_idx .. <proc_params.len:
     let param_node = proc_params[i]
-    let j = i-1  # because `i` is counting over range [1, N]
+    let j = i-first_param_idx  # because `i` is counting from `first_param_idx`
     #hint("arg " & $i & " (len = " & $param_node.len & "): " & treeRepr(param_node))
 
     let num_idents_in_param_node = countNumIdentsToDefine(param_node)
@@ -605,9 +1121,9 @@ proc exportpyImpl*(
   newSeq(param_name_type_tuple_seq, num_idents)
 
   var storage_idx = 0
-  for i in 1..num_params:  # start at 1 because params[0] is the return type.
+  for i in first_param_idx .. <proc_params.len:
     let param_node = proc_params[i]
-    let j = i-1  # because `i` is counting over range [1, N]
+    let j = i-first_param_idx  # because `i` is counting from `first_param_idx`
     #hint("arg " & $i & " (len = " & $param_node.len & "): " & treeRepr(param_node))
 
     let num_idents_in_param_node = num_idents_per_param[j]
@@ -630,7 +1146,9 @@ proc exportpyImpl*(
   result = newStmtList()
   result.add(proc_def_node)
 
-  let prev_proc_with_this_name = proc_prototypes.get(proc_name)
+  let class_nim_type = if py_class_def != nil: py_class_def.nim_type else: nil
+  let proc_key = getProcPrototypeKey(proc_name, class_nim_type)
+  let prev_proc_with_this_name = proc_prototypes.get(proc_key)
   if prev_proc_with_this_name != nil:
     let prev_line_info = prev_proc_with_this_name.proc_line_info
     let msg = "proc name `$1` [$2] has already been exportpy-ed [previously at $3]" %
@@ -646,9 +1164,42 @@ proc exportpyImpl*(
       return_type_fmt_tuple,
       param_name_type_tuple_seq,
       docstring_lines,
-      do_return_dict
+      do_return_dict,
+      is_iterator,
+      class_nim_type,
+      is_constructor,
+      return_class_nim_type
   )
   proc_prototypes << new_pp
+
+  if is_constructor:
+    if py_class_def.constructor_key != nil:
+      let prev_pp = proc_prototypes.get(py_class_def.constructor_key)
+      let msg = "Python class `$1` [$2] already has a constructor [previously at $3]" %
+          [py_class_def.nim_type, lineinfo(proc_def_node), prev_pp.proc_line_info]
+      error(msg)
+    py_class_def.constructor_key = proc_key
+  elif py_class_def != nil:
+    py_class_def.method_keys << proc_key
+
+  if proc_def_node.hasPragma("batched"):
+    let batch_pp = createBatchProcPrototype(new_pp, proc_def_node)
+    if proc_prototypes.get(batch_pp.proc_name) != nil:
+      let msg = "can't create a batch variant of `$1` [$2]: proc name `$3` has already been exportpy-ed" %
+          [proc_name, lineinfo(proc_def_node), batch_pp.proc_name]
+      error(msg)
+    proc_prototypes << batch_pp
+    new_pp.batch_proc_name = batch_pp.proc_name
+    result.add(createBatchProcDef(new_pp, batch_pp))
+
+  if proc_def_node.hasPragma("memoize") or
+      getPragmaValue(proc_def_node, "memoize") != nil:
+    new_pp.memoize_size = getMemoizeSize(new_pp, proc_def_node)
+    for suffix in ["_cache_clear", "_cache_info"]:
+      if proc_prototypes.get(proc_name & suffix) != nil:
+        let msg = "can't memoize `$1` [$2]: proc name `$3` has already been exportpy-ed" %
+            [proc_name, lineinfo(proc_def_node), proc_name & suffix]
+        error(msg)
   #let wrapper_node = generateNimWrapper(new_pp)
   #result.add(wrapper_node)
 
@@ -737,6 +1288,55 @@ proc generateSafeVariableName(name, proc_name: string): string
   result = "$1_$2" % [name, substr($h, 0, 2)]
 
 
+proc getExportName(pp: ref ProcPrototype): string {. compileTime .} =
+  # The name that identifies the generated C function & Nim wrapper proc of an
+  # exported proc (which is qualified by its Python class, if any).
+  if pp.class_nim_type == nil:
+    result = pp.proc_name
+  else:
+    result = pp.class_nim_type & "_" & pp.proc_name
+
+
+proc getPyClassCName(class_nim_type, suffix: string): string {. compileTime .} =
+  # The names of the C struct, type-object & functions of a Python class.
+  result = "pyclass_$1_$2" % [class_nim_type, suffix]
+
+
+proc getModNameIdentPart(mod_name: string): string {. compileTime .} =
+  # A Python module name will often begin with an underscore (it's the default),
+  # but Nim doesn't allow double-underscores (or a trailing underscore) in
+  # identifiers.  Simply stripping the underscores would give the same Nim
+  # identifiers (& C symbols) to (eg) `_foo` & `foo`, which might be built into
+  # the same bundle; so each "_" is encoded as "Zu" (& each "Z" as "ZZ").
+  result = ""
+  for c in mod_name:
+    case c
+    of '_':
+      result.add("Zu")
+    of 'Z':
+      result.add("ZZ")
+    else:
+      result.add(c)
+
+
+proc getNimWrapperProcName(mod_name, proc_name: string): string {. compileTime .} =
+  result = exportpy_nim_wrapper_template % [getModNameIdentPart(mod_name), proc_name]
+
+
+proc getParamCType(type_fmt_tuple: TypeFmtTuple, proc_name_node: NimNode): string
+    {. compileTime .} =
+  if type_fmt_tuple.isSeqParam:
+    # It's a `seq[T]` or `openarray[T]`, received as any Python object.
+    result = "PyObject *"
+  elif type_fmt_tuple.py_object_type_def != nil:
+    # It's a defined Python type (eg, Numpy array).
+    # It will have a pointer sigil.
+    result = "$1 *" % type_fmt_tuple.py_object_type_def.py_obj_ctype
+  else:
+    # It's a built-in Python type.
+    result = convertFormatStringToCType(type_fmt_tuple.py_fmt_str, proc_name_node)
+
+
 proc extendWithLocalVars(output_lines: var seq[string],
     nim_wrapper_proc_args_str: var string,
     param_name_type_tuple_seq: seq[ref ParamNameTypeTuple],
@@ -747,19 +1347,20 @@ proc extendWithLocalVars(output_lines: var seq[string],
   newSeq(nim_wrapper_proc_arg_seq, num_params)
   var take_addr_of_local_var_seq: seq[string]
   newSeq(take_addr_of_local_var_seq, num_params)
+  var seq_arg_decls: seq[string] = @[]
   for i in 0.. <num_params:
     let (param_name, type_fmt_tuple, default_value) = param_name_type_tuple_seq[i][]
     let safe_var_name = generateSafeVariableName(param_name, proc_name)
     nim_wrapper_proc_arg_seq[i] = safe_var_name
+    if type_fmt_tuple.isSeqParam:
+      # The Nim wrapper proc receives the elements as a C array & its length.
+      nim_wrapper_proc_arg_seq[i] = "$1_arg.data, $1_arg.len" % safe_var_name
+      seq_arg_decls << "\tPymodSeqArg $1_arg = PYMOD_SEQ_ARG_INIT;" % safe_var_name
 
-    var ctype_str: string
+    let ctype_str = getParamCType(type_fmt_tuple, proc_name_node)
     if type_fmt_tuple.py_object_type_def != nil:
       # It's a defined Python type (eg, Numpy array).
-      let potd = type_fmt_tuple.py_object_type_def
-      # It will have a pointer sigil.
-      ctype_str = "$1 *" % potd.py_obj_ctype
-
-      let py_type_obj = potd.py_type_obj
+      let py_type_obj = type_fmt_tuple.py_object_type_def.py_type_obj
       if py_type_obj == "":
         # There is no Python type-object to use for type-verification
         # of the PyObject received from the client code.  It will just
@@ -772,8 +1373,6 @@ proc extendWithLocalVars(output_lines: var seq[string],
         take_addr_of_local_var_seq[i] = "&$1, &$2" % [py_type_obj, safe_var_name]
     else:
       # It's a built-in Python type.
-      let py_fmt_str = type_fmt_tuple.py_fmt_str
-      ctype_str = convertFormatStringToCType(py_fmt_str, proc_name_node)
       take_addr_of_local_var_seq[i] = "&$1" % safe_var_name
 
     var default_init = if default_value == nil: "" else: " = " & default_value;
@@ -786,13 +1385,203 @@ proc extendWithLocalVars(output_lines: var seq[string],
     let var_decl = "\t$1$2$3$4;" % [ctype_str, padding, safe_var_name, default_init]
     output_lines << var_decl
 
+  if seq_arg_decls.len > 0:
+    output_lines << seq_arg_decls.join("\n")
+    output_lines << "\tPyObject *result = NULL;"
+
   nim_wrapper_proc_args_str = nim_wrapper_proc_arg_seq.join(", ")
   result = take_addr_of_local_var_seq.join(", ")
 
 
-proc extendWithOneFunctionDef(output_lines: var seq[string],
-    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode)
+proc extendWithLazyInitCheck(output_lines: var seq[string],
+    pp: ref ProcPrototype) {. compileTime .} =
+  # If "pmgen.py" was invoked with "--lazyInit", the module (including the Nim
+  # runtime & the Numpy C-API) is initialised by the first call of any exported
+  # function, rather than when the module is imported.  It must be initialised
+  # before the arguments are parsed (since eg, `PyArray_Type` is provided by
+  # the Numpy C-API).  (The procs of a Python class don't receive the module,
+  # so a module that exports a Python class is always initialised when it's
+  # imported.)
+  when defined(pymodLazyInit):
+    if pp.class_nim_type != nil:
+      return
+    output_lines << "\tif (lazy_init_module(class_) == NULL) {"
+    output_lines << "\t\treturn NULL;"
+    output_lines << "\t}"
+
+
+proc hasSeqParams(pp: ref ProcPrototype): bool {. compileTime .} =
+  for p in pp.param_name_type_tuple_seq:
+    if p.type_fmt_tuple.isSeqParam:
+      return true
+  return false
+
+
+proc getSeqArgElemTypeEnum(type_fmt_tuple: TypeFmtTuple): string {. compileTime .} =
+  # The `enum PymodSeqArgElemType` value in "pymodpkg/private/pyobject_c.h".
+  result = "PYMOD_SEQ_ARG_" & type_fmt_tuple.getSeqParamElemType.toUpper
+
+
+proc returnsDict(pp: ref ProcPrototype): bool {. compileTime .} =
+  # The "returnDict" pragma is ignored for a return value that isn't a tuple,
+  # and for an iterator (which yields its tuples unconverted).  (It's an error
+  # for a proc of a Python class, which has no module state to hold the keys.)
+  result = pp.do_return_dict and pp.return_type_fmt_tuple[0].label != nil and
+      not pp.is_iterator
+
+
+proc getReturnDictProcNames(proc_prototypes: ProcPrototypeTable,
+    proc_names_node: NimNode): seq[string] {. compileTime .} =
+  result = @[]
+  for i in 0.. <proc_names_node.len:
+    let proc_name = $proc_names_node[i]
+    let pp = proc_prototypes.get(proc_name)
+    # (A proc that wasn't exportpy-ed is reported by `extendWithAllFunctionDefs`.)
+    if pp != nil and pp.returnsDict:
+      result.add(proc_name)
+
+
+proc getReturnDictKeysExpr(proc_name: string): string {. compileTime .} =
+  # The keys of the dict returned by a "returnDict" proc are created once, at
+  # module init:  In Python 3, they're stored in the module state (`class_`
+  # is the module object); in Python 2, in a static array.
+  when defined(python3):
+    result = "((struct module_state *) PyModule_GetState(class_))->return_dict_keys_$1" %
+        proc_name
+  else:
+    result = "return_dict_keys_$1" % proc_name
+
+
+proc getMemoizeProcNames(proc_prototypes: ProcPrototypeTable,
+    proc_names_node: NimNode): seq[string] {. compileTime .} =
+  result = @[]
+  for i in 0.. <proc_names_node.len:
+    let proc_name = $proc_names_node[i]
+    let pp = proc_prototypes.get(proc_name)
+    if pp != nil and pp.memoize_size > 0:
+      result.add(proc_name)
+
+
+proc getMemoCacheExpr(proc_name: string): string {. compileTime .} =
+  # The cache of a "memoize" proc:  In Python 3, it's stored in the module
+  # state (`class_` is the module object); in Python 2, in a static.
+  when defined(python3):
+    result = "&((struct module_state *) PyModule_GetState(class_))->memo_cache_$1" %
+        proc_name
+  else:
+    result = "&memo_cache_$1" % proc_name
+
+
+proc extendWithMemoCaches(output_lines: var seq[string],
+    proc_prototypes: ProcPrototypeTable, memoize_proc_names: seq[string])
+    {. compileTime .} =
+  # (In Python 3, the caches are in the module state instead.)
+  for proc_name in memoize_proc_names:
+    let pp = proc_prototypes.get(proc_name)
+    output_lines << ""
+    output_lines << "static PymodMemoCache memo_cache_$1 = PYMOD_MEMO_CACHE_INIT($2);" %
+        [proc_name, $pp.memoize_size]
+
+
+proc extendWithReturnDictHelpers(output_lines: var seq[string],
+    proc_prototypes: ProcPrototypeTable, return_dict_proc_names: seq[string])
     {. compileTime .} =
+  if return_dict_proc_names.len == 0:
+    return
+
+  for proc_name in return_dict_proc_names:
+    let pp = proc_prototypes.get(proc_name)
+    var key_names: seq[string] = @[]
+    for tft in pp.return_type_fmt_tuple:
+      key_names.add("\"$1\"" % tft.label)
+    output_lines << ""
+    output_lines << "static const char *const return_dict_key_names_$1[] = { $2 };" %
+        [proc_name, key_names.join(", ")]
+    when not defined(python3):
+      output_lines << "static PyObject *return_dict_keys_$1[$2];" %
+          [proc_name, $key_names.len]
+
+  when defined(python3):
+    let intern_func = "PyUnicode_InternFromString"
+  else:
+    let intern_func = "PyString_InternFromString"
+  output_lines << ""
+  output_lines << "/*"
+  output_lines << " * Create the interned keys of the dict returned by a \"returnDict\" function."
+  output_lines << " * Returns -1 (with a Python exception set) if they couldn't be created."
+  output_lines << " */"
+  output_lines << "static int"
+  output_lines << "create_return_dict_keys(PyObject **keys, const char *const *key_names, Py_ssize_t n)"
+  output_lines << "{"
+  output_lines << "\tPy_ssize_t i;"
+  output_lines << "\tfor (i = 0; i < n; ++i) {"
+  output_lines << "\t\tkeys[i] = $1(key_names[i]);" % intern_func
+  output_lines << "\t\tif (keys[i] == NULL) {"
+  output_lines << "\t\t\treturn -1;"
+  output_lines << "\t\t}"
+  output_lines << "\t}"
+  output_lines << "\treturn 0;"
+  output_lines << "}"
+  output_lines << ""
+  output_lines << "/*"
+  output_lines << " * Convert the tuple returned by a Nim wrapper proc into a dict, using the"
+  output_lines << " * keys created at module init.  Steals the reference to the tuple."
+  output_lines << " */"
+  output_lines << "static PyObject *"
+  output_lines << "return_tuple_to_dict(PyObject *tuple, PyObject *const *keys)"
+  output_lines << "{"
+  output_lines << "\tPyObject *dict;"
+  output_lines << "\tPy_ssize_t i;"
+  output_lines << "\tif (tuple == NULL) {"
+  output_lines << "\t\treturn NULL;"
+  output_lines << "\t}"
+  output_lines << "\tdict = PyDict_New();"
+  output_lines << "\tfor (i = 0; dict != NULL && i < PyTuple_GET_SIZE(tuple); ++i) {"
+  output_lines << "\t\tif (PyDict_SetItem(dict, keys[i], PyTuple_GET_ITEM(tuple, i)) < 0) {"
+  output_lines << "\t\t\tPy_CLEAR(dict);"
+  output_lines << "\t\t}"
+  output_lines << "\t}"
+  output_lines << "\tPy_DECREF(tuple);"
+  output_lines << "\treturn dict;"
+  output_lines << "}"
+
+
+proc extendWithCreateReturnDictKeys(output_lines: var seq[string],
+    proc_prototypes: ProcPrototypeTable, return_dict_proc_names: seq[string],
+    keys_prefix, error_return: string) {. compileTime .} =
+  for proc_name in return_dict_proc_names:
+    let pp = proc_prototypes.get(proc_name)
+    output_lines << "\tif (create_return_dict_keys($1return_dict_keys_$2, return_dict_key_names_$2, $3) < 0) {" %
+        [keys_prefix, proc_name, $pp.return_type_fmt_tuple.len]
+    output_lines << "\t\treturn$1;" % error_return
+    output_lines << "\t}"
+
+
+proc extendWithMemoCacheFuncDefs(output_lines: var seq[string],
+    proc_name: string) {. compileTime .} =
+  # The functions `<name>_cache_clear()` & `<name>_cache_info()` of a
+  # "memoize" proc.
+  let memo_cache_expr = getMemoCacheExpr(proc_name)
+  output_lines << "static PyObject *"
+  output_lines << "$1_cache_clear(PyObject *class_, PyObject *unused)" %
+      (exportpy_c_func_name_template % proc_name)
+  output_lines << "{"
+  output_lines << "\tpymodMemoCacheClear($1);" % memo_cache_expr
+  output_lines << "\tPy_RETURN_NONE;"
+  output_lines << "}"
+  output_lines << ""
+  output_lines << "static PyObject *"
+  output_lines << "$1_cache_info(PyObject *class_, PyObject *unused)" %
+      (exportpy_c_func_name_template % proc_name)
+  output_lines << "{"
+  output_lines << "\treturn pymodMemoCacheInfo($1);" % memo_cache_expr
+  output_lines << "}"
+  output_lines << ""
+
+
+proc extendWithOneFunctionDef(output_lines: var seq[string],
+    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode,
+    mod_name: string) {. compileTime .} =
   output_lines << ""
   output_lines << "/*"
   output_lines << " * Auto-generated from exported function `$1`:" % proc_name
@@ -804,8 +1593,11 @@ proc extendWithOneFunctionDef(output_lines: var seq[string],
   let c_func_prototype = c_func_name & "(PyObject *class_, PyObject *args, PyObject *kwargs)"
   output_lines << c_func_prototype
   output_lines << "{"
+  if pp.memoize_size > 0:
+    output_lines << "\tPymodMemoKey memo_key = PYMOD_MEMO_KEY_INIT;"
+    output_lines << "\tPyObject *result;"
 
-  let nim_wrapper_proc_name = exportpy_nim_wrapper_template % proc_name
+  let nim_wrapper_proc_name = getNimWrapperProcName(mod_name, proc_name)
   var nim_wrapper_proc_args = ""
 
   let params = pp.param_name_type_tuple_seq
@@ -835,17 +1627,81 @@ proc extendWithOneFunctionDef(output_lines: var seq[string],
 
     let PyArg_ParseTuple_args = "args, kwargs, \"$1\", kwlist,\n\t\t\t$2" %
         [param_type_fmt_seq.join(""), take_addrs_of_local_vars_str]
+    extendWithLazyInitCheck(output_lines, pp)
     let PyArg_ParseTuple_invoc = "\tif (! PyArg_ParseTupleAndKeywords($1)) {" %
         PyArg_ParseTuple_args
     output_lines << PyArg_ParseTuple_invoc
     output_lines << "\t\treturn NULL;"
     output_lines << "\t}"
+  else:
+    extendWithLazyInitCheck(output_lines, pp)
 
   output_lines << ""
-  output_lines << "\treturn $1($2);" % [nim_wrapper_proc_name, nim_wrapper_proc_args]
+  if pp.class_nim_type != nil and not pp.is_constructor:
+    # A method receives the Nim object of its Python object, as its first arg.
+    let self_arg = "$1(class_)" % getPyClassCName(pp.class_nim_type, "nim_ptr")
+    if nim_wrapper_proc_args == "":
+      nim_wrapper_proc_args = self_arg
+    else:
+      nim_wrapper_proc_args = self_arg & ", " & nim_wrapper_proc_args
+  var nim_wrapper_call = "$1($2)" % [nim_wrapper_proc_name, nim_wrapper_proc_args]
+  if pp.returnsDict:
+    nim_wrapper_call = "return_tuple_to_dict($1,\n\t\t\t$2)" %
+        [nim_wrapper_call, getReturnDictKeysExpr(proc_name)]
+
+  if pp.hasSeqParams:
+    # Get the elements of each sequence argument (without copying them, if
+    # possible), then release them all after the call (or any failure).
+    var seq_arg_names: seq[string] = @[]
+    for p in params:
+      if p.type_fmt_tuple.isSeqParam:
+        let safe_var_name = generateSafeVariableName(p.name, proc_name)
+        seq_arg_names << safe_var_name
+        output_lines << "\tif (pymodSeqArgFromPyObject($1, $2, &$1_arg) < 0) {" %
+            [safe_var_name, getSeqArgElemTypeEnum(p.type_fmt_tuple)]
+        output_lines << "\t\tgoto release_seq_args;"
+        output_lines << "\t}"
+    output_lines << "\tresult = $1;" % nim_wrapper_call
+    output_lines << ""
+    output_lines << "release_seq_args:"
+    for safe_var_name in seq_arg_names:
+      output_lines << "\tpymodSeqArgRelease(&$1_arg);" % safe_var_name
+    output_lines << "\treturn result;"
+  elif pp.memoize_size > 0:
+    # The key is the bytes of the converted args (including the NUL of each
+    # string, so that consecutive strings are delimited).
+    var key_adds: seq[string] = @[]
+    for p in params:
+      let safe_var_name = generateSafeVariableName(p.name, proc_name)
+      if p.type_fmt_tuple.py_fmt_str == "s":
+        key_adds << "pymodMemoKeyAddStr(&memo_key, $1) < 0" % safe_var_name
+      else:
+        key_adds << "pymodMemoKeyAdd(&memo_key, &$1, sizeof($1)) < 0" % safe_var_name
+    if key_adds.len > 0:
+      output_lines << "\tif ($1) {" % key_adds.join(" ||\n\t\t\t")
+      output_lines << "\t\tpymodMemoKeyRelease(&memo_key);"
+      output_lines << "\t\treturn NULL;"
+      output_lines << "\t}"
+    let memo_cache_expr = getMemoCacheExpr(proc_name)
+    output_lines << "\tresult = pymodMemoCacheGet($1, &memo_key);" % memo_cache_expr
+    output_lines << "\tif (result == NULL) {"
+    output_lines << "\t\tresult = $1;" % nim_wrapper_call
+    output_lines << "\t\tif (result != NULL &&"
+    output_lines << "\t\t\t\tpymodMemoCachePut($1, &memo_key, result) < 0) {" %
+        memo_cache_expr
+    output_lines << "\t\t\tPy_CLEAR(result);"
+    output_lines << "\t\t}"
+    output_lines << "\t}"
+    output_lines << "\tpymodMemoKeyRelease(&memo_key);"
+    output_lines << "\treturn result;"
+  else:
+    output_lines << "\treturn $1;" % nim_wrapper_call
   output_lines << "}"
   output_lines << ""
 
+  if pp.memoize_size > 0:
+    extendWithMemoCacheFuncDefs(output_lines, proc_name)
+
 
 proc extendWithAllFunctionDefs(output_lines: var seq[string],
     proc_prototypes: ProcPrototypeTable,
@@ -861,7 +1717,10 @@ proc extendWithAllFunctionDefs(output_lines: var seq[string],
           [proc_name, mod_name, lineinfo(proc_name_node)]
       error(msg)
 
-    extendWithOneFunctionDef(output_lines, pp, proc_name, proc_name_node)
+    extendWithOneFunctionDef(output_lines, pp, proc_name, proc_name_node, mod_name)
+    if pp.batch_proc_name != nil:
+      extendWithOneFunctionDef(output_lines, proc_prototypes.get(pp.batch_proc_name),
+          pp.batch_proc_name, proc_name_node, mod_name)
 
 
 template outputPyMethodDefDoc(output_lines: var seq[string], s: string) =
@@ -882,22 +1741,35 @@ proc py_type(type_fmt_tuples: seq[TypeFmtTuple]; do_return_dict: bool = false) :
   else:
     result = "None"
 
-proc py_fmt_str(type_fmt_tuples: seq[TypeFmtTuple]; do_return_dict: bool = false) : string {. compileTime .} =
-  # "O!" is not a valid format string for `Py_BuildValue`.
-  # We convert it to O when building the combined format string.
-  if do_return_dict and type_fmt_tuples[0].label != nil:
-    result = "{"
-    for i in 0 .. <type_fmt_tuples.len:
-      let py_fmt_str = type_fmt_tuples[i].py_fmt_str
-      result = result & "s" & (if py_fmt_str == "O!": "O" else: py_fmt_str)
-    result = result & "}"
-  elif type_fmt_tuples[0].nim_type != "void":
-    result = ""
-    for i in 0 .. <type_fmt_tuples.len:
-      let py_fmt_str = type_fmt_tuples[i].py_fmt_str
-      result = result & (if py_fmt_str == "O!": "O" else: py_fmt_str)
+proc getNewPyObjectCall(type_fmt_tuple: TypeFmtTuple, nim_val: string): string
+    {. compileTime .} =
+  # Create a new PyObject directly from the Nim value, using the constructor
+  # that `Py_BuildValue` would have chosen for the Python format string (so
+  # that no format string is interpreted at every call).
+  case type_fmt_tuple.py_fmt_str
+  of "O", "O!":
+    # Note: `newPyRef` increments the ref-count of the object.
+    result = "newPyRef(cast[ptr PyObject]($1))" % nim_val
+  of "O&":
+    # A `seq[T]` or `array[N, T]`, copied into a new (registered) Numpy array.
+    result = "newPyRef(cast[ptr PyObject](createSimpleNewFromValues($1)))" % nim_val
+  of "l", "i", "h", "H", "B":
+    result = "newPyInt(clong($1))" % nim_val
+  of "k", "I":
+    result = "newPyIntFromUnsigned(culong($1))" % nim_val
+  of "f", "d":
+    result = "newPyFloat(cdouble($1))" % nim_val
+  of "c":
+    result = "newPyChar(cchar($1))" % nim_val
+  of "s":
+    if type_fmt_tuple.nim_type == "string":
+      result = "newPyStr($1)" % nim_val
+    else:
+      result = "newPyStrFromCString($1)" % nim_val
   else:
-    result = ""
+    let msg = "unhandled Python format string \"$1\" for return type `$2`" %
+        [type_fmt_tuple.py_fmt_str, type_fmt_tuple.nim_type]
+    error(msg)
 
 proc nim_type(type_fmt_tuples: seq[TypeFmtTuple]) : string {. compileTime .} =
   if type_fmt_tuples[0].nim_type != "void":
@@ -926,7 +1798,9 @@ proc extendWithPyFuncPrototypeDoc(output_lines: var seq[string],
     params_and_types[i] = "$1: $2" % [p_name, py_type]
 
   let params_str = params_and_types.join(", ")
-  let return_type_str = pp.return_type_fmt_tuple.py_type
+  var return_type_str = pp.return_type_fmt_tuple.py_type
+  if pp.is_iterator:
+    return_type_str = "Iterator[$1]" % return_type_str
   let prototype_str = "$1($2) -> $3" % [proc_name, params_str, return_type_str]
   outputPyMethodDefDoc(output_lines, prototype_str)
   outputPyMethodDefDoc(output_lines, "")
@@ -950,16 +1824,35 @@ proc extendWithPyFuncParametersDoc(output_lines: var seq[string],
       outputPyMethodDefDoc(output_lines, s)
     outputPyMethodDefDoc(output_lines, "")
 
-  outputPyMethodDefDoc(output_lines, "Returns")
-  outputPyMethodDefDoc(output_lines, "-------")
+  if pp.is_iterator:
+    outputPyMethodDefDoc(output_lines, "Yields")
+    outputPyMethodDefDoc(output_lines, "------")
+  else:
+    outputPyMethodDefDoc(output_lines, "Returns")
+    outputPyMethodDefDoc(output_lines, "-------")
 
-  let py_type = pp.return_type_fmt_tuple.py_type(pp.do_return_dict)
+  let py_type = pp.return_type_fmt_tuple.py_type(pp.returnsDict)
   let nim_type = pp.return_type_fmt_tuple.nim_type
   let s = "out : $1 <- $2" % [py_type, nim_type]
   outputPyMethodDefDoc(output_lines, s)
   outputPyMethodDefDoc(output_lines, "")
 
 
+proc extendWithPyMethodDefEntry(output_lines: var seq[string],
+    pp: ref ProcPrototype, proc_name_node: NimNode) {. compileTime .} =
+  # The entry of a module function or a class method, in its `PyMethodDef` array.
+  let proc_name = pp.proc_name
+  let c_func_name = exportpy_c_func_name_template % getExportName(pp)
+  let method_line = "\t{ \"$1\", (PyCFunction) $2, METH_VARARGS | METH_KEYWORDS," %
+      [proc_name, c_func_name]
+  output_lines << method_line
+  extendWithPyFuncPrototypeDoc(output_lines, pp, proc_name, proc_name_node)
+  extendWithPyFuncParametersDoc(output_lines, pp, proc_name, proc_name_node)
+  for s in pp.docstring_lines:
+    output_lines << "\t\t\"$1\\n\"" % s.replace("\"", "\\\"")
+  output_lines << "\t},"
+
+
 proc extendWithOnePyMethodDef(output_lines: var seq[string],
     proc_prototypes: ProcPrototypeTable,
     proc_name_node: NimNode, mod_name: string) {. compileTime .} =
@@ -970,15 +1863,27 @@ proc extendWithOnePyMethodDef(output_lines: var seq[string],
         [proc_name, mod_name, lineinfo(proc_name_node)]
     error(msg)
 
-  let c_func_name = exportpy_c_func_name_template % proc_name
-  let method_line = "\t{ \"$1\", (PyCFunction) $2, METH_VARARGS | METH_KEYWORDS," %
-      [proc_name, c_func_name]
-  output_lines << method_line
-  extendWithPyFuncPrototypeDoc(output_lines, pp, proc_name, proc_name_node)
-  extendWithPyFuncParametersDoc(output_lines, pp, proc_name, proc_name_node)
-  for s in pp.docstring_lines:
-    output_lines << "\t\t\"$1\\n\"" % s.replace("\"", "\\\"")
-  output_lines << "\t},"
+  extendWithPyMethodDefEntry(output_lines, pp, proc_name_node)
+  if pp.batch_proc_name != nil:
+    extendWithPyMethodDefEntry(output_lines, proc_prototypes.get(pp.batch_proc_name),
+        proc_name_node)
+  if pp.memoize_size > 0:
+    let c_func_name = exportpy_c_func_name_template % proc_name
+    output_lines << "\t{ \"$1_cache_clear\", (PyCFunction) $2_cache_clear, METH_NOARGS," %
+        [proc_name, c_func_name]
+    outputPyMethodDefDoc(output_lines, "$1_cache_clear() -> None" % proc_name)
+    outputPyMethodDefDoc(output_lines, "")
+    outputPyMethodDefDoc(output_lines,
+        "Clear the cache of results of `$1`, & its hit & miss counts." % proc_name)
+    output_lines << "\t},"
+    output_lines << "\t{ \"$1_cache_info\", (PyCFunction) $2_cache_info, METH_NOARGS," %
+        [proc_name, c_func_name]
+    outputPyMethodDefDoc(output_lines, "$1_cache_info() -> (int, int, int, int)" % proc_name)
+    outputPyMethodDefDoc(output_lines, "")
+    outputPyMethodDefDoc(output_lines,
+        "Return (hits, misses, maxsize, currsize) of the cache of results of `$1`." %
+        proc_name)
+    output_lines << "\t},"
 
 
 proc extendWithPyMethodDefs(output_lines: var seq[string],
@@ -995,50 +1900,621 @@ proc extendWithPyMethodDefs(output_lines: var seq[string],
   output_lines << "};"
 
 
+# Each built-in Nim exception type (in the order in which they're tested),
+# the built-in Python exception type that is raised for it, and any comment.
+# The empty Nim type matches any other Exception.  The Nim exception types
+# mapped by `definePyException` are tested before these.
+const NimToPyExceptions = [
+    ("AssertionError", "AssertionError", ""),
+    ("IndexError", "IndexError", ""),
+    ("KeyError", "KeyError", ""),
+    ("ObjectConversionError", "TypeError", ""),
+    ("RangeError", "IndexError", "  # There's no RangeError in Python."),
+    ("ValueError", "ValueError", ""),
+    ("", "RuntimeError", ""),
+]
+
+# In a bundle (a single Python module, whose submodules are the Python modules
+# defined by `initPyModule`), "pmgen.py" supplies the name of the bundle in the
+# Nim symbol below, and compiles a C source file that defines the functions
+# `pymodBundleRegisterSubmodule` & `pymodNimMainOnce`.
+const pymodBundle {.strdefine.} = ""
+
+proc getFullModName(mod_name: string): string {. compileTime .} =
+  result = mod_name
+  when defined(pymodBundle):
+    result = "$1.$2" % [pymodBundle, mod_name]
+
+
+proc getRaiseNimExceptionCFuncName(mod_name: string): string {. compileTime .} =
+  result = "pmgen$1RaiseNimException" % mod_name
+
+
+proc extendWithExceptionTypes(output_lines: var seq[string],
+    py_exception_defs: PyExceptionDefTable, mod_name: string) {. compileTime .} =
+  # The Python exception types are indexed by the Nim wrapper procs:  First
+  # the Python exceptions defined by `definePyException` (in the order in which
+  # they were defined), then the built-in Python exceptions of
+  # `NimToPyExceptions`.
+  let num_defined = py_exception_defs.len
+  output_lines << ""
+  output_lines << "/*"
+  output_lines << " * The built-in Python exception types that are raised for Nim exceptions"
+  output_lines << " * (filled in by `init_module_types`)."
+  output_lines << " */"
+  output_lines << "static PyObject *builtin_exception_types[$1];" % $NimToPyExceptions.len
+  if num_defined > 0:
+    output_lines << ""
+    output_lines << "/*"
+    output_lines << " * The Python exception types defined by `definePyException`, which are"
+    output_lines << " * created for each module object (in Python 3, in its module state).  This"
+    output_lines << " * points to those of the module object that was most recently initialised"
+    output_lines << " * (or is NULL if that module object has been freed)."
+    output_lines << " */"
+    output_lines << "static PyObject **exception_types = NULL;"
+  output_lines << ""
+  output_lines << "/*"
+  output_lines << " * Raise the Python exception type at `exc_idx`.  If `nim_stack_trace` isn't"
+  output_lines << " * NULL, it's attached to the Python exception, to be formatted only if it's"
+  output_lines << " * read (\"--lazyTraceback\").  Always returns NULL."
+  output_lines << " */"
+  output_lines << "PyObject *"
+  output_lines << "$1(int exc_idx, const char *msg, const char *nim_stack_trace)" %
+      getRaiseNimExceptionCFuncName(mod_name)
+  output_lines << "{"
+  if num_defined > 0:
+    output_lines << "\tPyObject *exc_type = PyExc_RuntimeError;"
+    output_lines << "\tif (exc_idx >= $1) {" % $num_defined
+    output_lines << "\t\texc_type = builtin_exception_types[exc_idx - $1];" % $num_defined
+    output_lines << "\t} else if (exception_types != NULL) {"
+    output_lines << "\t\texc_type = exception_types[exc_idx];"
+    output_lines << "\t}"
+  else:
+    output_lines << "\tPyObject *exc_type = builtin_exception_types[exc_idx];"
+  output_lines << "\tif (nim_stack_trace != NULL) {"
+  output_lines << "\t\treturn raisePyErrorWithNimTraceback(exc_type, msg, nim_stack_trace);"
+  output_lines << "\t}"
+  output_lines << "\tPyErr_SetString(exc_type, msg);"
+  output_lines << "\treturn NULL;"
+  output_lines << "}"
+
+
+proc getExportedPyClassDefs(py_class_defs: PyClassDefTable,
+    class_names_node: NimNode): seq[ref PyClassDef] {. compileTime .} =
+  # The Python classes listed in `initPyModule` (in the order listed).
+  result = @[]
+  for i in 0.. <class_names_node.len:
+    result.add(py_class_defs.get($class_names_node[i]))
+
+
+proc getPyClassMemberProcPrototypes(proc_prototypes: ProcPrototypeTable,
+    py_class_def: ref PyClassDef): seq[ref ProcPrototype] {. compileTime .} =
+  # The constructor (first) & the methods of the Python class.
+  result = @[ proc_prototypes.get(py_class_def.constructor_key) ]
+  for method_key in py_class_def.method_keys:
+    result.add(proc_prototypes.get(method_key))
+
+
+proc extendWithPyClassDefaultConstructor(output_lines: var seq[string],
+    py_class_def: ref PyClassDef, class_name_node: NimNode, mod_name: string)
+    {. compileTime .} =
+  # An inline Nim object without an exported constructor is constructed from
+  # its exported fields (as optional args), like a C struct; any other fields
+  # are zero (like the Nim default value of an object).
+  let class_name = py_class_def.nim_type
+  let object_struct = getPyClassCName(class_name, "object")
+  let fields = py_class_def.fields
+  output_lines << "static PyObject *"
+  output_lines << "$1(PyTypeObject *type, PyObject *args, PyObject *kwargs)" %
+      getPyClassCName(class_name, "new")
+  output_lines << "{"
+  output_lines << "\t$1 *self;" % object_struct
+  var fmt_str = "|"
+  var take_addrs: seq[string] = @[]
+  for f in fields:
+    let ctype_str = convertFormatStringToCType(f.type_fmt_tuple.py_fmt_str, class_name_node)
+    let safe_var_name = generateSafeVariableName(f.name, class_name)
+    output_lines << "\t$1 $2 = 0;" % [ctype_str, safe_var_name]
+    fmt_str.add(f.type_fmt_tuple.py_fmt_str)
+    take_addrs << "&" & safe_var_name
+  output_lines << "\tstatic char *kwlist[] = $1;" % createPyArgKeywordList(fields)
+  output_lines << ""
+  if fields.len > 0:
+    output_lines << "\tif (! PyArg_ParseTupleAndKeywords(args, kwargs, \"$1\", kwlist,\n\t\t\t$2)) {" %
+        [fmt_str, take_addrs.join(", ")]
+  else:
+    output_lines << "\tif (! PyArg_ParseTupleAndKeywords(args, kwargs, \"\", kwlist)) {"
+  output_lines << "\t\treturn NULL;"
+  output_lines << "\t}"
+  output_lines << "\tself = PyObject_New($1, &$2);" %
+      [object_struct, getPyClassCName(class_name, "type")]
+  output_lines << "\tif (self == NULL) {"
+  output_lines << "\t\treturn NULL;"
+  output_lines << "\t}"
+  output_lines << "\tmemset(self->nim_obj, 0, type->tp_basicsize - sizeof($1));" % object_struct
+  for f in fields:
+    output_lines << "\t$1(self->nim_obj, $2);" %
+        [getNimWrapperProcName(mod_name, "$1_set_$2" % [class_name, f.name]),
+        generateSafeVariableName(f.name, class_name)]
+  output_lines << "\treturn (PyObject *) self;"
+  output_lines << "}"
+
+
+proc extendWithPyClassGetSetDefs(output_lines: var seq[string],
+    py_class_def: ref PyClassDef, class_name_node: NimNode, mod_name: string)
+    {. compileTime .} =
+  # The exported fields of an inline Nim object are read & written in place
+  # (by the Nim procs), so the other fields aren't converted.
+  let class_name = py_class_def.nim_type
+  let object_struct = getPyClassCName(class_name, "object")
+  for f in py_class_def.fields:
+    let getter_name = getPyClassCName(class_name, "get_" & f.name)
+    let setter_name = getPyClassCName(class_name, "set_" & f.name)
+    let ctype_str = convertFormatStringToCType(f.type_fmt_tuple.py_fmt_str, class_name_node)
+    let safe_var_name = generateSafeVariableName(f.name, class_name)
+    output_lines << ""
+    output_lines << "static PyObject *"
+    output_lines << "$1($2 *self, void *closure)" % [getter_name, object_struct]
+    output_lines << "{"
+    output_lines << "\treturn $1(self->nim_obj);" %
+        getNimWrapperProcName(mod_name, "$1_get_$2" % [class_name, f.name])
+    output_lines << "}"
+    output_lines << ""
+    output_lines << "static int"
+    output_lines << "$1($2 *self, PyObject *value, void *closure)" % [setter_name, object_struct]
+    output_lines << "{"
+    output_lines << "\t$1 $2;" % [ctype_str, safe_var_name]
+    output_lines << "\tif (value == NULL) {"
+    output_lines << "\t\tPyErr_SetString(PyExc_AttributeError, \"can't delete attribute '$1'\");" %
+        f.name
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+    output_lines << "\tif (! PyArg_Parse(value, \"$1\", &$2)) {" %
+        [f.type_fmt_tuple.py_fmt_str, safe_var_name]
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+    output_lines << "\t$1(self->nim_obj, $2);" %
+        [getNimWrapperProcName(mod_name, "$1_set_$2" % [class_name, f.name]), safe_var_name]
+    output_lines << "\treturn 0;"
+    output_lines << "}"
+
+  output_lines << ""
+  output_lines << "static PyGetSetDef $1[] = {" % getPyClassCName(class_name, "getset")
+  for f in py_class_def.fields:
+    output_lines << "\t{ \"$1\", (getter) $2, (setter) $3," %
+        [f.name, getPyClassCName(class_name, "get_" & f.name),
+        getPyClassCName(class_name, "set_" & f.name)]
+    output_lines << "\t\t\"$1 : $2 -> $3\", NULL }," %
+        [f.name, f.type_fmt_tuple.py_type, f.type_fmt_tuple.nim_type]
+  output_lines << "\t{ NULL, NULL, NULL, NULL, NULL },"
+  output_lines << "};"
+
+
+proc extendWithPyClassDef(output_lines: var seq[string],
+    proc_prototypes: ProcPrototypeTable, py_class_def: ref PyClassDef,
+    class_name_node: NimNode, mod_name: string) {. compileTime .} =
+  # A kernel Python object refers to its Nim object, which is kept alive (by
+  # `GC_ref`) until the Python object is deallocated.  An inline Nim object is
+  # stored in its Python object (after the PyObject header), so it's freed
+  # with it.  Either way, the state of the Nim object persists between calls
+  # of its methods, without conversion.
+  let class_name = py_class_def.nim_type
+  let object_struct = getPyClassCName(class_name, "object")
+  let type_obj = getPyClassCName(class_name, "type")
+  let release_func = getNimWrapperProcName(mod_name, class_name & "_release")
+  let has_constructor = (py_class_def.constructor_key != nil)
+
+  output_lines << ""
+  output_lines << "/*"
+  if py_class_def.is_inline_object:
+    output_lines << " * Auto-generated from exported Python type `$1`:" % class_name
+  else:
+    output_lines << " * Auto-generated from exported kernel type `$1`:" % class_name
+  output_lines << " *  $1" % py_class_def.def_line_info
+  output_lines << " */"
+  output_lines << "typedef struct {"
+  output_lines << "\tPyObject_HEAD"
+  if py_class_def.is_inline_object:
+    output_lines << "\t/* The Nim object (whose size is only known to Nim, so `tp_basicsize` is"
+    output_lines << "\t * set when the module is initialised). */"
+    output_lines << "\tunion { long double ld; long long ll; void *p; } nim_obj[];"
+  else:
+    output_lines << "\tvoid *nim_ref;"
+  output_lines << "} $1;" % object_struct
+  output_lines << ""
+  output_lines << "static PyTypeObject $1;" % type_obj
+  output_lines << ""
+  output_lines << "/* The Nim object of the Python object, for the Nim procs. */"
+  output_lines << "static void *"
+  output_lines << "$1(PyObject *self)" % getPyClassCName(class_name, "nim_ptr")
+  output_lines << "{"
+  if py_class_def.is_inline_object:
+    output_lines << "\treturn (($1 *) self)->nim_obj;" % object_struct
+  else:
+    output_lines << "\treturn (($1 *) self)->nim_ref;" % object_struct
+  output_lines << "}"
+  output_lines << ""
+  output_lines << "/* Called by the Nim wrapper of the constructor. */"
+  output_lines << "PyObject *"
+  if py_class_def.is_inline_object:
+    output_lines << "pmgen$1New$2(const void *nim_obj)" % [mod_name, class_name]
+    output_lines << "{"
+    output_lines << "\t$1 *self = PyObject_New($1, &$2);" % [object_struct, type_obj]
+    output_lines << "\tif (self == NULL) {"
+    output_lines << "\t\treturn NULL;"
+    output_lines << "\t}"
+    output_lines << "\tmemcpy(self->nim_obj, nim_obj, $1.tp_basicsize - sizeof($2));" %
+        [type_obj, object_struct]
+  else:
+    output_lines << "pmgen$1New$2(void *nim_ref)" % [mod_name, class_name]
+    output_lines << "{"
+    output_lines << "\t$1 *self = PyObject_New($1, &$2);" % [object_struct, type_obj]
+    output_lines << "\tif (self == NULL) {"
+    output_lines << "\t\t$1(nim_ref);" % release_func
+    output_lines << "\t\treturn NULL;"
+    output_lines << "\t}"
+    output_lines << "\tself->nim_ref = nim_ref;"
+  output_lines << "\treturn (PyObject *) self;"
+  output_lines << "}"
+  output_lines << ""
+  output_lines << "static void"
+  output_lines << "$1($2 *self)" % [getPyClassCName(class_name, "dealloc"), object_struct]
+  output_lines << "{"
+  if not py_class_def.is_inline_object:
+    output_lines << "\t$1(self->nim_ref);" % release_func
+  output_lines << "\tPyObject_Del(self);"
+  output_lines << "}"
+
+  for pp in getPyClassMemberProcPrototypes(proc_prototypes, py_class_def):
+    extendWithOneFunctionDef(output_lines, pp, getExportName(pp), class_name_node,
+        mod_name)
+
+  if has_constructor:
+    let ctor_pp = proc_prototypes.get(py_class_def.constructor_key)
+    output_lines << "static PyObject *"
+    output_lines << "$1(PyTypeObject *type, PyObject *args, PyObject *kwargs)" %
+        getPyClassCName(class_name, "new")
+    output_lines << "{"
+    output_lines << "\treturn $1((PyObject *) type, args, kwargs);" %
+        (exportpy_c_func_name_template % getExportName(ctor_pp))
+    output_lines << "}"
+  else:
+    extendWithPyClassDefaultConstructor(output_lines, py_class_def, class_name_node,
+        mod_name)
+  output_lines << ""
+  output_lines << "static PyMethodDef $1[] = {" % getPyClassCName(class_name, "methods")
+  for method_key in py_class_def.method_keys:
+    extendWithPyMethodDefEntry(output_lines, proc_prototypes.get(method_key),
+        class_name_node)
+  output_lines << "\t{ NULL, NULL, 0, NULL },"
+  output_lines << "};"
+  if py_class_def.is_inline_object:
+    extendWithPyClassGetSetDefs(output_lines, py_class_def, class_name_node, mod_name)
+  output_lines << ""
+  output_lines << "static PyTypeObject $1 = {" % type_obj
+  output_lines << "\tPyVarObject_HEAD_INIT(NULL, 0)"
+  output_lines << "\t.tp_name = \"$1.$2\"," % [getFullModName(mod_name), class_name]
+  output_lines << "\t.tp_basicsize = sizeof($1)," % object_struct
+  output_lines << "\t.tp_dealloc = (destructor) $1," % getPyClassCName(class_name, "dealloc")
+  output_lines << "\t.tp_flags = Py_TPFLAGS_DEFAULT,"
+  # The class docstring is that of the constructor.
+  output_lines << "\t.tp_doc ="
+  if has_constructor:
+    let ctor_pp = proc_prototypes.get(py_class_def.constructor_key)
+    extendWithPyFuncPrototypeDoc(output_lines, ctor_pp, class_name, class_name_node)
+    extendWithPyFuncParametersDoc(output_lines, ctor_pp, class_name, class_name_node)
+    for s in ctor_pp.docstring_lines:
+      output_lines << "\t\t\"$1\\n\"" % s.replace("\"", "\\\"")
+  else:
+    var params_and_types: seq[string] = @[]
+    for f in py_class_def.fields:
+      params_and_types << "$1: $2 = 0" % [f.name, f.type_fmt_tuple.py_type]
+    outputPyMethodDefDoc(output_lines, "$1($2) -> ($1)" %
+        [class_name, params_and_types.join(", ")])
+  output_lines << "\t\t\"\","
+  output_lines << "\t.tp_methods = $1," % getPyClassCName(class_name, "methods")
+  if py_class_def.is_inline_object:
+    output_lines << "\t.tp_getset = $1," % getPyClassCName(class_name, "getset")
+  output_lines << "\t.tp_new = $1," % getPyClassCName(class_name, "new")
+  output_lines << "};"
+
+
+proc getInitModuleTypesCall(py_exception_defs: PyExceptionDefTable,
+    module_exception_types: string): string {. compileTime .} =
+  if py_exception_defs.len > 0:
+    result = "init_module_types(m, $1)" % module_exception_types
+  else:
+    result = "init_module_types(m)"
+
+
+proc extendWithInitModuleTypes(output_lines: var seq[string],
+    py_exception_defs: PyExceptionDefTable, py_class_defs: seq[ref PyClassDef],
+    mod_name: string) {. compileTime .} =
+  # Create the Python exception types (in `module_exception_types`, which
+  # belongs to the module object) & ready the Python classes (which belong to
+  # the whole process), then add them to the module object.
+  let full_mod_name = getFullModName(mod_name)
+  output_lines << ""
+  output_lines << "static int"
+  if py_exception_defs.len > 0:
+    output_lines << "init_module_types(PyObject *m, PyObject **module_exception_types)"
+  else:
+    output_lines << "init_module_types(PyObject *m)"
+  output_lines << "{"
+  for i in 0.. <py_exception_defs.len:
+    let ped = py_exception_defs[i].storedVal
+    var py_base = "PyExc_" & ped.py_base_name
+    for j in 0.. <i:
+      if py_exception_defs[j].storedVal.py_name == ped.py_base_name:
+        py_base = "module_exception_types[$1]" % $j
+    output_lines << "\tmodule_exception_types[$1] = PyErr_NewException(\"$2.$3\", $4, NULL);" %
+        [$i, full_mod_name, ped.py_name, py_base]
+    output_lines << "\tif (module_exception_types[$1] == NULL) {" % $i
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+    output_lines << "\tPy_INCREF(module_exception_types[$1]);" % $i
+    output_lines << "\tif (PyModule_AddObject(m, \"$1\", module_exception_types[$2]) < 0) {" %
+        [ped.py_name, $i]
+    output_lines << "\t\tPy_DECREF(module_exception_types[$1]);" % $i
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+  if py_exception_defs.len > 0:
+    output_lines << "\texception_types = module_exception_types;"
+  for k in 0.. <NimToPyExceptions.len:
+    output_lines << "\tbuiltin_exception_types[$1] = PyExc_$2;" %
+        [$k, NimToPyExceptions[k][1]]
+  for py_class_def in py_class_defs:
+    let type_obj = getPyClassCName(py_class_def.nim_type, "type")
+    if py_class_def.is_inline_object:
+      output_lines << "\t$1.tp_basicsize = sizeof($2) + $3();" %
+          [type_obj, getPyClassCName(py_class_def.nim_type, "object"),
+          getNimWrapperProcName(mod_name, py_class_def.nim_type & "_sizeof")]
+    output_lines << "\tif (PyType_Ready(&$1) < 0) {" % type_obj
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+    output_lines << "\tPy_INCREF(&$1);" % type_obj
+    output_lines << "\tif (PyModule_AddObject(m, \"$1\", (PyObject *) &$2) < 0) {" %
+        [py_class_def.nim_type, type_obj]
+    output_lines << "\t\tPy_DECREF(&$1);" % type_obj
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+  output_lines << "\treturn 0;"
+  output_lines << "}"
+
+
 when defined(python3):
+  proc extendWithBundleSubmoduleRegistration(output_lines: var seq[string],
+      mod_name: string) {. compileTime .} =
+    # The submodule registers itself when the shared library is loaded, but
+    # it's only initialised when it's first accessed.
+    output_lines << ""
+    output_lines << "struct pymod_bundle_submodule {"
+    output_lines << "\tconst char *name;"
+    output_lines << "\tPyObject *(*init_func)(void);"
+    output_lines << "\tstruct pymod_bundle_submodule *next;"
+    output_lines << "};"
+    output_lines << ""
+    output_lines << "extern void pymodBundleRegisterSubmodule(struct pymod_bundle_submodule *submodule);"
+    output_lines << ""
+    output_lines << "static struct pymod_bundle_submodule bundle_submodule = { \"$1\", PyInit_$1, NULL };" % mod_name
+    output_lines << ""
+    output_lines << "__attribute__((constructor))"
+    output_lines << "static void"
+    output_lines << "register_bundle_submodule(void)"
+    output_lines << "{"
+    output_lines << "\tpymodBundleRegisterSubmodule(&bundle_submodule);"
+    output_lines << "}"
+
+  proc hasModuleState(py_exception_defs: PyExceptionDefTable,
+      return_dict_proc_names, memoize_proc_names: seq[string]): bool {. compileTime .} =
+    result = defined(pymodLazyInit) or py_exception_defs.len > 0 or
+        return_dict_proc_names.len > 0 or memoize_proc_names.len > 0
+
+  proc extendWithModuleState(output_lines: var seq[string],
+      extra_init_node: NimNode, proc_prototypes: ProcPrototypeTable,
+      py_exception_defs: PyExceptionDefTable,
+      return_dict_proc_names, memoize_proc_names: seq[string],
+      has_py_classes: bool) {. compileTime .} =
+    # In Python 3, the module uses multi-phase initialisation (PEP 489), so it
+    # can be loaded into several interpreters.  Anything that belongs to one
+    # module object (rather than to the whole process, like the Nim runtime &
+    # the Python classes) is stored in its module state, rather than in a C or
+    # Nim global.
+    output_lines << ""
+    when defined(pymodBundle):
+      # The Nim runtime is shared by all the submodules of the bundle.
+      output_lines << "extern void pymodNimMainOnce(void);"
+    else:
+      output_lines << "static int nim_main_called = 0;"
+    output_lines << ""
+    output_lines << "/*"
+    output_lines << " * Initialise the module:  Any extra initialisation is run for each module"
+    output_lines << " * object (it might `return NULL`), but the Nim runtime is only initialised"
+    output_lines << " * once per process."
+    output_lines << " */"
+    output_lines << "static PyObject *"
+    output_lines << "run_module_init(void)"
+    output_lines << "{"
+    let num_extra_init = extra_init_node.len
+    for i in 0.. <num_extra_init:
+      let ei = $extra_init_node[i]
+      output_lines << "\t$1" % ei
+    when defined(pymodBundle):
+      output_lines << "\tpymodNimMainOnce();"
+    else:
+      output_lines << "\tif (!nim_main_called) {"
+      output_lines << "\t\tnim_main_called = 1;"
+      output_lines << "\t\tNimMain();"
+      output_lines << "\t}"
+    output_lines << "\treturn Py_None;"
+    output_lines << "}"
+
+    if hasModuleState(py_exception_defs, return_dict_proc_names, memoize_proc_names):
+      output_lines << ""
+      output_lines << "struct module_state {"
+      when defined(pymodLazyInit):
+        output_lines << "\t/* The initialisation is deferred until the first call of any exported"
+        output_lines << "\t * function (by \"--lazyInit\"). */"
+        output_lines << "\tPyThread_type_lock lazy_init_lock;"
+        output_lines << "\tvolatile int lazy_init_done;"
+      if py_exception_defs.len > 0:
+        output_lines << "\tPyObject *exception_types[$1];" % $py_exception_defs.len
+      for proc_name in return_dict_proc_names:
+        let pp = proc_prototypes.get(proc_name)
+        output_lines << "\tPyObject *return_dict_keys_$1[$2];" %
+            [proc_name, $pp.return_type_fmt_tuple.len]
+      for proc_name in memoize_proc_names:
+        output_lines << "\tPymodMemoCache memo_cache_$1;" % proc_name
+      output_lines << "};"
+      extendWithReturnDictHelpers(output_lines, proc_prototypes, return_dict_proc_names)
+
+    when defined(pymodLazyInit):
+      output_lines << ""
+      output_lines << "/*"
+      output_lines << " * Initialise the module exactly once, even if the exported functions are"
+      output_lines << " * called concurrently by several threads.  Returns NULL (with a Python"
+      output_lines << " * exception set) if the initialisation failed."
+      output_lines << " */"
+      output_lines << "static PyObject *"
+      output_lines << "lazy_init_module(PyObject *m)"
+      output_lines << "{"
+      output_lines << "\tstruct module_state *st = (struct module_state *) PyModule_GetState(m);"
+      output_lines << "\tPyObject *result = Py_None;"
+      output_lines << "\tif (st->lazy_init_done) {"
+      output_lines << "\t\treturn result;"
+      output_lines << "\t}"
+      output_lines << ""
+      output_lines << "\t/* Release the GIL while waiting for any other thread to finish. */"
+      output_lines << "\tPy_BEGIN_ALLOW_THREADS"
+      output_lines << "\tPyThread_acquire_lock(st->lazy_init_lock, WAIT_LOCK);"
+      output_lines << "\tPy_END_ALLOW_THREADS"
+      output_lines << "\tif (!st->lazy_init_done) {"
+      output_lines << "\t\tresult = run_module_init();"
+      output_lines << "\t\tif (result != NULL) {"
+      output_lines << "\t\t\tst->lazy_init_done = 1;"
+      output_lines << "\t\t}"
+      output_lines << "\t}"
+      output_lines << "\tPyThread_release_lock(st->lazy_init_lock);"
+      output_lines << "\treturn result;"
+      output_lines << "}"
+
+    if hasModuleState(py_exception_defs, return_dict_proc_names, memoize_proc_names):
+      output_lines << ""
+      output_lines << "static void"
+      output_lines << "module_free(void *m)"
+      output_lines << "{"
+      output_lines << "\tstruct module_state *st = (struct module_state *) PyModule_GetState((PyObject *) m);"
+      output_lines << "\tif (st == NULL) {"
+      output_lines << "\t\treturn;"
+      output_lines << "\t}"
+      when defined(pymodLazyInit):
+        output_lines << "\tif (st->lazy_init_lock != NULL) {"
+        output_lines << "\t\tPyThread_free_lock(st->lazy_init_lock);"
+        output_lines << "\t\tst->lazy_init_lock = NULL;"
+        output_lines << "\t}"
+      if py_exception_defs.len > 0:
+        output_lines << "\tif (exception_types == st->exception_types) {"
+        output_lines << "\t\texception_types = NULL;"
+        output_lines << "\t}"
+        for i in 0.. <py_exception_defs.len:
+          output_lines << "\tPy_CLEAR(st->exception_types[$1]);" % $i
+      for proc_name in return_dict_proc_names:
+        let pp = proc_prototypes.get(proc_name)
+        for i in 0.. <pp.return_type_fmt_tuple.len:
+          output_lines << "\tPy_CLEAR(st->return_dict_keys_$1[$2]);" % [proc_name, $i]
+      for proc_name in memoize_proc_names:
+        output_lines << "\tpymodMemoCacheClear(&st->memo_cache_$1);" % proc_name
+      output_lines << "}"
+
+    output_lines << ""
+    output_lines << "static int"
+    output_lines << "module_exec(PyObject *m)"
+    output_lines << "{"
+    if hasModuleState(py_exception_defs, return_dict_proc_names, memoize_proc_names):
+      output_lines << "\tstruct module_state *st = (struct module_state *) PyModule_GetState(m);"
+      extendWithCreateReturnDictKeys(output_lines, proc_prototypes,
+          return_dict_proc_names, "st->", " -1")
+      for proc_name in memoize_proc_names:
+        # (The rest of the module state is zeroed by Python.)
+        output_lines << "\tst->memo_cache_$1.capacity = $2;" %
+            [proc_name, $proc_prototypes.get(proc_name).memoize_size]
+    output_lines << "\tif ($1 < 0) {" %
+        getInitModuleTypesCall(py_exception_defs, "st->exception_types")
+    output_lines << "\t\treturn -1;"
+    output_lines << "\t}"
+    when defined(pymodLazyInit):
+      output_lines << "\tst->lazy_init_done = 0;"
+      output_lines << "\tst->lazy_init_lock = PyThread_allocate_lock();"
+      output_lines << "\tif (st->lazy_init_lock == NULL) {"
+      output_lines << "\t\tPyErr_NoMemory();"
+      output_lines << "\t\treturn -1;"
+      output_lines << "\t}"
+      if has_py_classes:
+        # The methods of a Python class don't receive the module object, so
+        # they can't initialise it.
+        output_lines << "\treturn (lazy_init_module(m) == NULL) ? -1 : 0;"
+      else:
+        output_lines << "\treturn 0;"
+    else:
+      output_lines << "\treturn (run_module_init() == NULL) ? -1 : 0;"
+    output_lines << "}"
+
   proc extendWithPyModinitFunc(output_lines: var seq[string],
-      extra_init_node: NimNode, mod_name: string) {. compileTime .} =
+      extra_init_node: NimNode, mod_name: string,
+      proc_prototypes: ProcPrototypeTable, py_exception_defs: PyExceptionDefTable,
+      return_dict_proc_names, memoize_proc_names: seq[string]) {. compileTime .} =
+    let full_mod_name = getFullModName(mod_name)
+    var m_size = "0"
+    var m_free = "NULL"
+    if hasModuleState(py_exception_defs, return_dict_proc_names, memoize_proc_names):
+      m_size = "sizeof(struct module_state)"
+      m_free = "module_free"
+
     output_lines << ""
     output_lines << "/*"
-    output_lines << " * This port to Python3 is based upon the example code at:"
-    output_lines << " *  https://docs.python.org/3/howto/cporting.html"
-    output_lines << " * and:"
-    output_lines << " *  http://docs.scipy.org/doc/numpy/user/c-info.ufunc-tutorial.html#example-non-ufunc-extension"
+    output_lines << " * Multi-phase module initialisation, as described in:"
+    output_lines << " *  https://www.python.org/dev/peps/pep-0489/"
     output_lines << " */"
-    output_lines << "struct module_state {"
-    output_lines << "\tPyObject *error;"
+    output_lines << "static PyModuleDef_Slot module_slots[] = {"
+    output_lines << "\t{ Py_mod_exec, (void *) module_exec },"
+    output_lines << "#if PY_VERSION_HEX >= 0x030C0000"
+    output_lines << "\t/* The Nim runtime (including its GC heap & the registry of the PyObjects"
+    output_lines << "\t * allocated by the exported procs) & the Python classes (static types)"
+    output_lines << "\t * belong to the whole process, so the interpreters must share the GIL. */"
+    output_lines << "\t{ Py_mod_multiple_interpreters, Py_MOD_MULTIPLE_INTERPRETERS_SUPPORTED },"
+    output_lines << "#endif"
+    output_lines << "\t{ 0, NULL },"
     output_lines << "};"
     output_lines << ""
     output_lines << "static struct PyModuleDef module_def = {"
     output_lines << "\tPyModuleDef_HEAD_INIT,"
-    output_lines << "\t\"$1\",                         /* m_name */" % mod_name
+    output_lines << "\t\"$1\",                         /* m_name */" % full_mod_name
     output_lines << "\t\"\",                             /* m_doc */"
-    output_lines << "\tsizeof(struct module_state),    /* m_size */"
+    output_lines << "\t$1,                              /* m_size */" % m_size
     output_lines << "\tmethods,                        /* m_methods */"
-    output_lines << "\tNULL,                           /* m_reload */"
+    output_lines << "\tmodule_slots,                   /* m_slots */"
     output_lines << "\tNULL,                           /* m_traverse */"
     output_lines << "\tNULL,                           /* m_clear */"
-    output_lines << "\tNULL,                           /* m_free */"
+    output_lines << "\t$1,                           /* m_free */" % m_free
     output_lines << "};"
     output_lines << ""
     output_lines << "PyMODINIT_FUNC"
     output_lines << "PyInit_$1(void) {" % mod_name
-    output_lines << "\tPyObject *m = PyModule_Create(&module_def);"
-    output_lines << "\tif (!m) {"
-    output_lines << "\t\treturn NULL;"
-    output_lines << "\t}"
-
-    let num_extra_init = extra_init_node.len
-    for i in 0.. <num_extra_init:
-      let ei = $extra_init_node[i]
-      output_lines << "\t$1" % ei
-    output_lines << "\tNimMain();"
-    output_lines << "\treturn m;"
+    output_lines << "\treturn PyModuleDef_Init(&module_def);"
     output_lines << "}"
 
+    when defined(pymodBundle):
+      extendWithBundleSubmoduleRegistration(output_lines, mod_name)
+
 else:
   proc extendWithPyModinitFunc(output_lines: var seq[string],
-      extra_init_node: NimNode, mod_name: string) {. compileTime .} =
+      extra_init_node: NimNode, mod_name: string,
+      proc_prototypes: ProcPrototypeTable, py_exception_defs: PyExceptionDefTable,
+      return_dict_proc_names, memoize_proc_names: seq[string]) {. compileTime .} =
+    if py_exception_defs.len > 0:
+      # In Python 2, the module is only initialised once.
+      output_lines << ""
+      output_lines << "static PyObject *module_exception_types[$1];" % $py_exception_defs.len
     output_lines << ""
     output_lines << "PyMODINIT_FUNC"
     output_lines << "init$1(void)" % mod_name
@@ -1047,6 +2523,12 @@ else:
     output_lines << "\tif (m == NULL) {"
     output_lines << "\t\treturn;"
     output_lines << "\t}"
+    extendWithCreateReturnDictKeys(output_lines, proc_prototypes,
+        return_dict_proc_names, "", "")
+    output_lines << "\tif ($1 < 0) {" %
+        getInitModuleTypesCall(py_exception_defs, "module_exception_types")
+    output_lines << "\t\treturn;"
+    output_lines << "\t}"
 
     let num_extra_init = extra_init_node.len
     for i in 0.. <num_extra_init:
@@ -1056,39 +2538,130 @@ else:
     output_lines << "}"
 
 
+proc extendWithNimWrapperCPrototype(output_lines: var seq[string],
+    pp: ref ProcPrototype, proc_name_node: NimNode, mod_name: string)
+    {. compileTime .} =
+  var param_ctypes: seq[string] = @[]
+  if pp.class_nim_type != nil and not pp.is_constructor:
+    # The Nim object of the Python object.
+    param_ctypes.add("void *")
+  for p in pp.param_name_type_tuple_seq:
+    if p.type_fmt_tuple.isSeqParam:
+      param_ctypes.add("void *")
+      param_ctypes.add("Py_ssize_t")
+    else:
+      param_ctypes.add(getParamCType(p.type_fmt_tuple, proc_name_node))
+  if param_ctypes.len == 0:
+    param_ctypes.add("void")
+  let nim_wrapper_proc_name = getNimWrapperProcName(mod_name, getExportName(pp))
+  output_lines << "extern PyObject *$1($2);" %
+      [nim_wrapper_proc_name, param_ctypes.join(", ")]
+
+
+proc extendWithNimWrapperCPrototypes(output_lines: var seq[string],
+    proc_prototypes: ProcPrototypeTable, py_class_defs: PyClassDefTable,
+    proc_names_node: NimNode, class_names_node: NimNode, mod_name: string)
+    {. compileTime .} =
+  # In a single-pass build, there is no header file generated for the Nim
+  # wrapper procs (they are compiled into the user's own Nim module), so we
+  # declare their C prototypes ourselves.  The parameter types are the same
+  # C types that are used for the local variables filled by `PyArg_Parse...`.
+  output_lines << "#include <Python.h>"
+  output_lines << ""
+  output_lines << "extern void NimMain(void);"
+  let num_proc_names = proc_names_node.len
+  for i in 0.. <num_proc_names:
+    let proc_name_node = proc_names_node[i]
+    let proc_name = $proc_name_node
+    let pp = proc_prototypes.get(proc_name)
+    if pp == nil:
+      # This will be reported by `extendWithAllFunctionDefs`.
+      continue
+    extendWithNimWrapperCPrototype(output_lines, pp, proc_name_node, mod_name)
+    if pp.batch_proc_name != nil:
+      extendWithNimWrapperCPrototype(output_lines,
+          proc_prototypes.get(pp.batch_proc_name), proc_name_node, mod_name)
+
+  let exported_class_defs = getExportedPyClassDefs(py_class_defs, class_names_node)
+  for i in 0.. <exported_class_defs.len:
+    let py_class_def = exported_class_defs[i]
+    for pp in getPyClassMemberProcPrototypes(proc_prototypes, py_class_def):
+      extendWithNimWrapperCPrototype(output_lines, pp, class_names_node[i], mod_name)
+    let class_name = py_class_def.nim_type
+    if py_class_def.is_inline_object:
+      output_lines << "extern Py_ssize_t $1(void);" %
+          getNimWrapperProcName(mod_name, class_name & "_sizeof")
+      for f in py_class_def.fields:
+        let ctype_str = convertFormatStringToCType(f.type_fmt_tuple.py_fmt_str,
+            class_names_node[i])
+        output_lines << "extern PyObject *$1(void *nim_obj);" %
+            getNimWrapperProcName(mod_name, "$1_get_$2" % [class_name, f.name])
+        output_lines << "extern void $1(void *nim_obj, $2);" %
+            [getNimWrapperProcName(mod_name, "$1_set_$2" % [class_name, f.name]), ctype_str]
+    else:
+      output_lines << "extern void $1(void *nim_ref);" %
+          getNimWrapperProcName(mod_name, class_name & "_release")
+
+
 proc outputPyModuleC(
     proc_prototypes: ProcPrototypeTable,
+    py_exception_defs: PyExceptionDefTable,
+    py_class_defs: PyClassDefTable,
     mod_name: string,
     extra_includes_node: NimNode, extra_init_node: NimNode,
-    proc_names_node: NimNode) {. compileTime .} =
+    proc_names_node: NimNode, class_names_node: NimNode) {. compileTime .} =
   let c_mod_fname = pymod_c_mod_fname_template % mod_name
   #hint(c_mod_fname)
-  let nim_mod_header_fname = pymod_nim_mod_fname_template % [mod_name, "h"]
-
   # http://nim-lang.org/system.html#CompileDate
   let compilation_date_time = "/* Auto-generated by Pymod on $1 at $2 */" %
       [CompileDate, CompileTime]
   var output_lines: seq[string] = @[compilation_date_time, ""]
   output_lines << "#define YES_IMPORT_ARRAY"
   extendWithExtraIncludes(output_lines, extra_includes_node)
-  # TODO: This should actually instead by the header file generated for the
-  # exported Nim procs, which will itself #include "nimbase.h"
-  output_lines << "#include \"nimcache/$1\"" % nim_mod_header_fname
+  when defined(pymodSinglePass):
+    extendWithNimWrapperCPrototypes(output_lines, proc_prototypes, py_class_defs,
+        proc_names_node, class_names_node, mod_name)
+  else:
+    # TODO: This should actually instead by the header file generated for the
+    # exported Nim procs, which will itself #include "nimbase.h"
+    # The nimcache directory (wherever "pmgen.py" has put it) is in `cincludes`.
+    let nim_mod_header_fname = pymod_nim_mod_fname_template % [mod_name, "h"]
+    output_lines << "#include \"$1\"" % nim_mod_header_fname
+  # For `pymodSeqArgFromPyObject` (to get the elements of sequence args) &
+  # `raisePyErrorWithNimTraceback`.
+  output_lines << "#include \"pymodpkg/private/pyobject_c.h\""
+  let return_dict_proc_names = getReturnDictProcNames(proc_prototypes, proc_names_node)
+  let memoize_proc_names = getMemoizeProcNames(proc_prototypes, proc_names_node)
+  extendWithExceptionTypes(output_lines, py_exception_defs, mod_name)
+  let exported_class_defs = getExportedPyClassDefs(py_class_defs, class_names_node)
+  for i in 0.. <exported_class_defs.len:
+    extendWithPyClassDef(output_lines, proc_prototypes, exported_class_defs[i],
+        class_names_node[i], mod_name)
+  extendWithInitModuleTypes(output_lines, py_exception_defs, exported_class_defs,
+      mod_name)
+  when defined(python3):
+    extendWithModuleState(output_lines, extra_init_node, proc_prototypes,
+        py_exception_defs, return_dict_proc_names, memoize_proc_names,
+        exported_class_defs.len > 0)
+  else:
+    extendWithReturnDictHelpers(output_lines, proc_prototypes, return_dict_proc_names)
+    extendWithMemoCaches(output_lines, proc_prototypes, memoize_proc_names)
   output_lines << ""
   extendWithAllFunctionDefs(output_lines, proc_prototypes, proc_names_node, mod_name)
   extendWithPyMethodDefs(output_lines, proc_prototypes, proc_names_node, mod_name)
   output_lines << ""
-  extendWithPyModinitFunc(output_lines, extra_init_node, mod_name)
+  extendWithPyModinitFunc(output_lines, extra_init_node, mod_name, proc_prototypes,
+      py_exception_defs, return_dict_proc_names, memoize_proc_names)
 
   let output_content = output_lines.join("\n")
   #hint(output_content)
-  writeFile(c_mod_fname, output_content)
+  writeFileIfChanged(c_mod_fname, output_content)
   hint("Created C file: " & c_mod_fname)
 
 
 proc extendWithNimProcPrototype(output_lines: var seq[string],
-    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode)
-    {. compileTime .} =
+    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode,
+    mod_name: string) {. compileTime .} =
   output_lines << "#"
   output_lines << "# Regardless of the return-type of the underlying Nim proc, we always"
   output_lines << "# return `ptr PyObject`, so we can return `nil` if an exception is raised."
@@ -1102,9 +2675,15 @@ proc extendWithNimProcPrototype(output_lines: var seq[string],
     let p = params[i]
     let p_name = p.name
     let nim_ctype = p.type_fmt_tuple.nim_ctype
-    params_and_types[i] = "$1: $2" % [p_name, nim_ctype]
+    if p.type_fmt_tuple.isSeqParam:
+      params_and_types[i] = "$1: pointer, $1_len: int" % p_name
+    else:
+      params_and_types[i] = "$1: $2" % [p_name, nim_ctype]
+  if pp.class_nim_type != nil and not pp.is_constructor:
+    # The Nim object of the Python object.
+    params_and_types.insert("self: pointer", 0)
 
-  let nim_wrapper_proc_name = exportpy_nim_wrapper_template % proc_name
+  let nim_wrapper_proc_name = getNimWrapperProcName(mod_name, getExportName(pp))
   let params_str = params_and_types.join(", ")
   # http://forum.nim-lang.org/t/634
   # http://forum.nim-lang.org/t/573
@@ -1115,43 +2694,75 @@ proc extendWithNimProcPrototype(output_lines: var seq[string],
   output_lines << "        $1 =" % pragma_str
 
 
+proc getRaisePyExceptionProcName(mod_name: string): string {. compileTime .} =
+  result = "raisePyException_" & getModNameIdentPart(mod_name)
+
+
+proc extendWithRaisePyExceptionProcDef(output_lines: var seq[string],
+    py_exception_defs: PyExceptionDefTable, mod_name: string) {. compileTime .} =
+  # The Nim wrapper procs all share this single dispatch from the current Nim
+  # exception to the Python exception type (by its index in the table of
+  # `extendWithExceptionTypes`).  The Nim exception types are tested in order,
+  # so the `definePyException` types are tested most-recently-defined first
+  # (ie, subtypes before the base types that they were defined after).
+  let raise_py_exception_proc_name = getRaisePyExceptionProcName(mod_name)
+  let raise_nim_exception_proc_name = "raiseNimException_" & getModNameIdentPart(mod_name)
+  var nim_exc_idx_seq: seq[tuple[nim_exc: string, exc_idx: int, comment: string]] = @[]
+  for i in countdown(py_exception_defs.len-1, 0):
+    nim_exc_idx_seq.add((py_exception_defs[i].storedVal.nim_type, i, ""))
+  for k in 0.. <NimToPyExceptions.len:
+    let nim_exc = NimToPyExceptions[k][0]
+    let comment = NimToPyExceptions[k][2]
+    nim_exc_idx_seq.add((nim_exc, py_exception_defs.len + k, comment))
+
+  output_lines << ""
+  output_lines << "proc $1(exc_idx: cint, msg, nim_stack_trace: cstring): ptr PyObject" %
+      raise_nim_exception_proc_name
+  output_lines << "        {. importc: \"$1\", cdecl .}" % getRaiseNimExceptionCFuncName(mod_name)
+  output_lines << ""
+  output_lines << "# Auto-generated:  Raise the Python exception for the current Nim exception."
+  output_lines << "proc $1(): ptr PyObject =" % raise_py_exception_proc_name
+  output_lines << "  let e = getCurrentException()"
+  output_lines << "  var exc_idx: cint"
+  for j in 0.. <nim_exc_idx_seq.len:
+    let (nim_exc, exc_idx, comment) = nim_exc_idx_seq[j]
+    if nim_exc == "":
+      output_lines << "  else:  # any other Exception"
+    elif j == 0:
+      output_lines << "  if e of $1:$2" % [nim_exc, comment]
+    else:
+      output_lines << "  elif e of $1:$2" % [nim_exc, comment]
+    output_lines << "    exc_idx = $1" % $exc_idx
+
+  when defined(pymodLazyTraceback):
+    # If "pmgen.py" was invoked with "--lazyTraceback", the Python exception
+    # has just the Nim exception message.  The (unformatted) Nim stack trace
+    # is attached to it, to be formatted only if the `nim_traceback` attribute
+    # is read.  (Exceptions are often used for expected rejections of invalid
+    # input, for which formatting the stack trace would cost more than the
+    # validation itself.)
+    output_lines << "  return $1(exc_idx, getCurrentExceptionMsg(), getStackTrace(e))" %
+        raise_nim_exception_proc_name
+  else:
+    output_lines << "  let msg = \"$1\\n$2\" % [getCurrentExceptionMsg(),"
+    output_lines << "      prettyPrintStackTrace(getStackTrace(e))]"
+    output_lines << "  return $1(exc_idx, msg, nil)" % raise_nim_exception_proc_name
+  output_lines << ""
+
+
 const NimWrapperBodyTemplate = """
+  ensureNimGcIsSetUp()
+  # Only the PyObjects registered by this call are collected when it returns.
+  let registered_py_objects_mark = beginRegisteredPyObjects()
   # http://nim-lang.org/manual.html#defer-statement
-  defer: collectAllGarbage()
+  defer: $5(registered_py_objects_mark)
 
   try:
-    initRegisteredPyObjects()
     $1
     # $2
     return $3
-  except AssertionError:
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyAssertionError(msg)
-  except IndexError:
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyIndexError(msg)
-  except KeyError:
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyKeyError(msg)
-  except ObjectConversionError:
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyTypeError(msg)
-  except RangeError:
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyIndexError(msg)  # There's no RangeError in Python.
-  except ValueError:
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyValueError(msg)
-  except:  # catch any other Exception
-    let msg = "$$1\n$$2" % [getCurrentExceptionMsg(),
-        prettyPrintStackTrace(getStackTrace(getCurrentException()))]
-    return raisePyRuntimeError(msg)
+  except:
+    return $4()
   finally:
     # Anything that needs to run after any exception has been handled.
     discard
@@ -1160,20 +2771,155 @@ const NimWrapperBodyTemplate = """
 """
 
 
-proc extendWithOneNimWrapperProcDef(output_lines: var seq[string],
-    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode)
+proc getCollectGarbageProcName(pp: ref ProcPrototype): string {. compileTime .} =
+  # The procs of a Python class are called repeatedly on the same Nim object
+  # (eg, for each chunk of a stream), so they don't run a full Nim GC each
+  # time; the Nim objects are collected by the usual incremental GC instead.
+  if pp.class_nim_type != nil:
+    result = "decRefRegisteredPyObjects"
+  else:
+    result = "collectAllGarbage"
+
+
+proc getFuncCall(call_prefix, call, open_array_call: string,
+    has_open_array_params: bool): string {. compileTime .} =
+  if has_open_array_params:
+    # (A `when` statement doesn't open a new scope, so `return_val` is still
+    # defined after it.)
+    result = "when declared(toOpenArray):\n      $1$2\n    else:\n      $1$3" %
+        [call_prefix, open_array_call, call]
+  else:
+    result = call_prefix & call
+
+
+proc getYieldNimType(return_type_fmt_tuple: seq[TypeFmtTuple]): string
     {. compileTime .} =
+  if return_type_fmt_tuple[0].label == nil:
+    result = return_type_fmt_tuple[0].nim_type
+  else:
+    var fields: seq[string] = @[]
+    for tft in return_type_fmt_tuple:
+      fields << "$1: $2" % [tft.label, tft.nim_type]
+    result = "tuple[$1]" % fields.join(", ")
+
+
+proc extendWithOneNimIteratorWrapperProcDefs(output_lines: var seq[string],
+    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode,
+    mod_name: string) {. compileTime .} =
+  # An exported Nim iterator is wrapped in a Nim closure iterator (so it can
+  # be resumed after the wrapper proc has returned), which is wrapped in a
+  # Python iterator (`newPyNimIterator`).  Each call of `next` by Python
+  # resumes the closure iterator, to convert just the next yielded item; so
+  # the items are never all in memory at once.
+  let nim_wrapper_proc_name = getNimWrapperProcName(mod_name, proc_name)
+  let state_type_name = "PyNimIteratorState_" &
+      nim_wrapper_proc_name.substr("exportpy_".len)
+  let next_proc_name = nim_wrapper_proc_name & "_next"
+  let release_proc_name = nim_wrapper_proc_name & "_release"
+  let yield_type = getYieldNimType(pp.return_type_fmt_tuple)
+  let raise_py_exception_proc_name = getRaisePyExceptionProcName(mod_name)
+
+  output_lines << ""
+  output_lines << "# Auto-generated from exported iterator `$1`:" % proc_name
+  output_lines << "#  $1" % pp.proc_line_info
+  output_lines << "#"
+  output_lines << "# The state of a Python iterator:  It's kept alive by `GC_ref` until the"
+  output_lines << "# Python iterator releases it, as are any PyObject args (by their ref-counts)."
+  output_lines << "type $1 = ref object" % state_type_name
+  output_lines << "  it: iterator(): $1" % yield_type
+  output_lines << "  py_objects: seq[ptr PyObject]"
+  output_lines << ""
+  output_lines << "proc $1(state: pointer): ptr PyObject {. cdecl .} =" % next_proc_name
+  output_lines << "  ensureNimGcIsSetUp()"
+  output_lines << "  # Only the PyObjects registered by this call are collected when it returns."
+  output_lines << "  let registered_py_objects_mark = beginRegisteredPyObjects()"
+  output_lines << "  defer: collectAllGarbage(registered_py_objects_mark)"
+  output_lines << ""
+  output_lines << "  try:"
+  output_lines << "    let s = cast[$1](state)" % state_type_name
+  output_lines << "    let return_val = s.it()"
+  output_lines << "    if finished(s.it):"
+  output_lines << "      # No Python exception is set, so this ends the Python iteration."
+  output_lines << "      return nil"
+  let return_type_fmt_tuple = pp.return_type_fmt_tuple
+  if return_type_fmt_tuple[0].label == nil:
+    output_lines << "    # Create a new PyObject value from the Nim value."
+    output_lines << "    return $1" % getNewPyObjectCall(return_type_fmt_tuple[0], "return_val")
+  else:
+    var items: seq[string] = @[]
+    for tft in return_type_fmt_tuple:
+      items.add(getNewPyObjectCall(tft, "return_val.$1" % tft.label))
+    output_lines << "    # Construct tuple from the Nim values."
+    output_lines << "    return packNewPyTuple($1, $2)" % [$items.len, items.join(", ")]
+  output_lines << "  except:"
+  output_lines << "    return $1()" % raise_py_exception_proc_name
+  output_lines << ""
+  output_lines << "proc $1(state: pointer) {. cdecl .} =" % release_proc_name
+  output_lines << "  ensureNimGcIsSetUp()"
+  output_lines << "  let s = cast[$1](state)" % state_type_name
+  output_lines << "  for obj in s.py_objects:"
+  output_lines << "    doPyDecRef(obj)"
+  output_lines << "  GC_unref(s)"
+  output_lines << ""
+  extendWithNimProcPrototype(output_lines, pp, proc_name, proc_name_node, mod_name)
+
+  # The args are converted before the wrapper proc returns, because the C args
+  # are only valid during the call.  (So `openarray` params receive a copy.)
+  var func_call_lines: seq[string] = @[]
+  func_call_lines << "var state: $1" % state_type_name
+  func_call_lines << "new(state)"
+  func_call_lines << "state.py_objects = @[]"
+  var func_args: seq[string] = @[]
+  for p in pp.param_name_type_tuple_seq:
+    let arg_name = "arg_" & p.name
+    let p_type = p.type_fmt_tuple.nim_ctype
+    var arg_val = p.name
+    if p_type == "cstring":
+      arg_val = "$" & p.name
+    elif p.type_fmt_tuple.isSeqParam:
+      arg_val = "seqArgToSeq[$1]($2, $2_len)" %
+          [p.type_fmt_tuple.getSeqParamElemType, p.name]
+    elif p.type_fmt_tuple.py_object_type_def != nil:
+      # The iterator might refer to the PyObject after the call.
+      func_call_lines << "if $1 != nil:" % p.name
+      func_call_lines << "  doPyIncRef(cast[ptr PyObject]($1))" % p.name
+      func_call_lines << "  state.py_objects.add(cast[ptr PyObject]($1))" % p.name
+    func_call_lines << "let $1 = $2" % [arg_name, arg_val]
+    func_args << arg_name
+  func_call_lines << "state.it = iterator(): $1 =" % yield_type
+  func_call_lines << "  for item in $1($2):" % [proc_name, func_args.join(", ")]
+  func_call_lines << "    yield item"
+  func_call_lines << "GC_ref(state)"
+
+  let comment = "Create a new Python iterator, which resumes the Nim iterator for each item."
+  let return_val = "newPyNimIterator(cast[pointer](state), $1, $2)" %
+      [next_proc_name, release_proc_name]
+  output_lines << NimWrapperBodyTemplate % [func_call_lines.join("\n    "), comment,
+      return_val, raise_py_exception_proc_name, getCollectGarbageProcName(pp)]
+  output_lines << ""
+
+
+proc extendWithOneNimWrapperProcDef(output_lines: var seq[string],
+    pp: ref ProcPrototype, proc_name: string, proc_name_node: NimNode,
+    mod_name: string) {. compileTime .} =
+  if pp.is_iterator:
+    extendWithOneNimIteratorWrapperProcDefs(output_lines, pp, proc_name,
+        proc_name_node, mod_name)
+    return
 
   output_lines << ""
   output_lines << "# Auto-generated from exported function `$1`:" % proc_name
   output_lines << "#  $1" % pp.proc_line_info
-  extendWithNimProcPrototype(output_lines, pp, proc_name, proc_name_node)
+  extendWithNimProcPrototype(output_lines, pp, proc_name, proc_name_node, mod_name)
 
   let params = pp.param_name_type_tuple_seq
   let num_params = params.len
 
   var func_args: seq[string]
   newSeq(func_args, num_params)
+  var open_array_func_args: seq[string]
+  newSeq(open_array_func_args, num_params)
+  var has_open_array_params = false
   for i in 0.. <num_params:
     let p = params[i]
     let p_name = p.name
@@ -1182,55 +2928,151 @@ proc extendWithOneNimWrapperProcDef(output_lines: var seq[string],
       # Convert the cstring to a string.
       #  http://nim-lang.org/manual.html#cstring-type
       func_args[i] = "$" & p_name
+    elif p.type_fmt_tuple.isSeqParam:
+      # Copy the C array of elements into a new seq.
+      let elem_type = p.type_fmt_tuple.getSeqParamElemType
+      func_args[i] = "seqArgToSeq[$1]($2, $2_len)" % [elem_type, p_name]
+      if p.type_fmt_tuple.nim_type.startsWith("openarray["):
+        # An openarray can refer to the C array directly (if this version
+        # of Nim can create an openarray from a pointer).
+        has_open_array_params = true
+        open_array_func_args[i] = "toOpenArray(cast[ptr UncheckedArray[$1]]($2), 0, $2_len - 1)" %
+            [elem_type, p_name]
+        continue
     else:
       func_args[i] = p_name
+    open_array_func_args[i] = func_args[i]
+  if pp.class_nim_type != nil and not pp.is_constructor:
+    # A method receives the Nim object of the Python object.
+    let self_arg = "$1(self)" %
+        getNimWrapperProcName(mod_name, pp.class_nim_type & "_self")
+    func_args.insert(self_arg, 0)
+    open_array_func_args.insert(self_arg, 0)
+
+  let call = "$1($2)" % [proc_name, func_args.join(", ")]
+  let open_array_call = "$1($2)" % [proc_name, open_array_func_args.join(", ")]
 
   let return_type = pp.return_type_fmt_tuple.nim_type
   if return_type != "void":
-    let func_call = "let return_val = $1($2)" % [proc_name, func_args.join(", ")]
-    var return_type_fmt_str = pp.return_type_fmt_tuple.py_fmt_str(pp.do_return_dict)
+    let func_call = getFuncCall("let return_val = ", call, open_array_call,
+        has_open_array_params)
+    let return_type_fmt_tuple = pp.return_type_fmt_tuple
 
     var comment : string
     var return_val : string
-    if pp.return_type_fmt_tuple[0].label == nil:
+    if pp.return_class_nim_type != nil:
+      comment = "Create a new Python object of the Nim object."
+      return_val = "$1(return_val)" %
+          getNimWrapperProcName(mod_name, pp.return_class_nim_type & "_toPyObject")
+    elif return_type_fmt_tuple[0].label == nil:
       # Straightforward single return value
-      comment = if return_type_fmt_str == "O":
-          "Note: `Py_BuildValue(\"O\")` increments the ref-count of the object."
-        else:
-          "Create a new PyObject value from the Nim value."
+      comment = "Create a new PyObject value from the Nim value."
       if pp.do_return_dict:
         comment = comment & " Ignoring \"returnDict\" pragma for non-tuple."
 
-      return_val = "Py_BuildValue(\"$1\", return_val)" % return_type_fmt_str
-    elif pp.do_return_dict:
-      # Multiple return values in a dict
-      comment = "Construct dict from the Nim return values."
-      return_val = "PyBuildValue(\"$1\"" % return_type_fmt_str
-      for i in 0 .. <pp.return_type_fmt_tuple.len:
-        let label = pp.return_type_fmt_tuple[i].label
-        return_val = return_val & (", \"$1\", return_val.$1" % label)
-      return_val = return_val & ")"
+      return_val = getNewPyObjectCall(return_type_fmt_tuple[0], "return_val")
     else:
-      # Multiple return values in a tuple
+      # Multiple return values in a tuple.  (For "returnDict", the C function
+      # converts this tuple to a dict, using keys created at module init.)
       comment = "Construct tuple from the Nim return values."
-      return_val = "PyBuildValue(\"$1\"" % return_type_fmt_str
-      for i in 0 .. <pp.return_type_fmt_tuple.len:
-        return_val = return_val & (", return_val.$1" % pp.return_type_fmt_tuple[i].label)
-      return_val = return_val & ")"
+      var items: seq[string] = @[]
+      for i in 0 .. <return_type_fmt_tuple.len:
+        let nim_val = "return_val.$1" % return_type_fmt_tuple[i].label
+        items.add(getNewPyObjectCall(return_type_fmt_tuple[i], nim_val))
+      return_val = "packNewPyTuple($1, $2)" % [$items.len, items.join(", ")]
 
-    output_lines << NimWrapperBodyTemplate % [func_call, comment, return_val]
+    output_lines << NimWrapperBodyTemplate % [func_call, comment, return_val,
+        getRaisePyExceptionProcName(mod_name), getCollectGarbageProcName(pp)]
 
   else:
-    let func_call = "$1($2)" % [proc_name, func_args.join(", ")]
+    let func_call = getFuncCall("", call, open_array_call, has_open_array_params)
     let comment = "No return value => return None."
     let return_val = "getPyNone()"
-    output_lines << NimWrapperBodyTemplate % [func_call, comment, return_val]
+    output_lines << NimWrapperBodyTemplate % [func_call, comment, return_val,
+        getRaisePyExceptionProcName(mod_name), getCollectGarbageProcName(pp)]
   output_lines << ""
 
+proc extendWithPyClassNimHelperProcDefs(output_lines: var seq[string],
+    py_class_def: ref PyClassDef, mod_name: string) {. compileTime .} =
+  let class_name = py_class_def.nim_type
+  let new_py_object_proc_name = getNimWrapperProcName(mod_name, class_name & "_newPyObject")
+  let to_py_object_proc_name = getNimWrapperProcName(mod_name, class_name & "_toPyObject")
+  let self_proc_name = getNimWrapperProcName(mod_name, class_name & "_self")
+  output_lines << ""
+  if py_class_def.is_inline_object:
+    output_lines << "# Auto-generated from exported Python type `$1`:" % class_name
+    output_lines << "#  $1" % py_class_def.def_line_info
+    output_lines << "#"
+    output_lines << "# The Nim object is stored inline in the Python object.  (It contains no"
+    output_lines << "# GC-managed memory, so it's simply copied into the Python object.)"
+    # `exportpytype` only checked the syntax of the field types, so check the
+    # resolved type (eg, a named `ref` type, or an object that has a `string`).
+    output_lines << "when not supportsCopyMem($1):" % class_name
+    output_lines << "  {. error: \"can't exportpytype `$1` [$2]: the type contains memory that is managed by the Nim GC (hint: use `exportpyKernel` for a `ref object` type)\" .}" %
+        [class_name, py_class_def.def_line_info]
+    output_lines << ""
+    output_lines << "proc $1(nim_obj: pointer): ptr PyObject" % new_py_object_proc_name
+    output_lines << "        {. importc: \"pmgen$1New$2\", cdecl .}" % [mod_name, class_name]
+    output_lines << ""
+    output_lines << "proc $1(nim_obj: $2): ptr PyObject =" % [to_py_object_proc_name, class_name]
+    output_lines << "  var obj = nim_obj"
+    output_lines << "  return $1(addr(obj))" % new_py_object_proc_name
+    output_lines << ""
+    output_lines << "proc $1(): int {. exportc, dynlib, cdecl .} =" %
+        getNimWrapperProcName(mod_name, class_name & "_sizeof")
+    output_lines << "  return sizeof($1)" % class_name
+    output_lines << ""
+    output_lines << "proc $1(nim_obj: pointer): var $2 =" % [self_proc_name, class_name]
+    output_lines << "  return cast[ptr $1](nim_obj)[]" % class_name
+    for f in py_class_def.fields:
+      let field_val = "cast[ptr $1](nim_obj).$2" % [class_name, f.name]
+      output_lines << ""
+      output_lines << "proc $1(nim_obj: pointer): ptr PyObject {. exportc, dynlib, cdecl .} =" %
+          getNimWrapperProcName(mod_name, "$1_get_$2" % [class_name, f.name])
+      output_lines << "  return $1" % getNewPyObjectCall(f.type_fmt_tuple, field_val)
+      output_lines << ""
+      output_lines << "proc $1(nim_obj: pointer, value: $2) {. exportc, dynlib, cdecl .} =" %
+          [getNimWrapperProcName(mod_name, "$1_set_$2" % [class_name, f.name]),
+          f.type_fmt_tuple.nim_ctype]
+      output_lines << "  $1 = $2(value)" % [field_val, f.type_fmt_tuple.nim_type]
+    output_lines << ""
+    return
+
+  output_lines << "# Auto-generated from exported kernel type `$1`:" % class_name
+  output_lines << "#  $1" % py_class_def.def_line_info
+  output_lines << "#"
+  output_lines << "# The Python object keeps the Nim object alive (by `GC_ref`) until the"
+  output_lines << "# Python object is deallocated, which releases it."
+  output_lines << "proc $1(nim_ref: pointer): ptr PyObject" % new_py_object_proc_name
+  output_lines << "        {. importc: \"pmgen$1New$2\", cdecl .}" % [mod_name, class_name]
+  output_lines << ""
+  output_lines << "proc $1(nim_obj: $2): ptr PyObject =" % [to_py_object_proc_name, class_name]
+  output_lines << "  if nim_obj == nil:"
+  output_lines << "    raise newException(ValueError, \"can't return a nil `$1` to Python\")" %
+      class_name
+  output_lines << "  GC_ref(nim_obj)"
+  output_lines << "  return $1(cast[pointer](nim_obj))" % new_py_object_proc_name
+  output_lines << ""
+  output_lines << "proc $1(nim_ref: pointer) {. exportc, dynlib, cdecl .} =" %
+      getNimWrapperProcName(mod_name, class_name & "_release")
+  output_lines << "  ensureNimGcIsSetUp()"
+  output_lines << "  GC_unref(cast[$1](nim_ref))" % class_name
+  output_lines << ""
+  output_lines << "proc $1(nim_ref: pointer): $2 =" % [self_proc_name, class_name]
+  output_lines << "  return cast[$1](nim_ref)" % class_name
+  output_lines << ""
+
+
 proc extendWithAllNimWrapperProcDefs(output_lines: var seq[string],
-    proc_prototypes: ProcPrototypeTable,
-    proc_names_node: NimNode, mod_name: string) {. compileTime .} =
+    proc_prototypes: ProcPrototypeTable, py_exception_defs: PyExceptionDefTable,
+    py_class_defs: PyClassDefTable, proc_names_node: NimNode,
+    class_names_node: NimNode, mod_name: string) {. compileTime .} =
   expectArrayOfKind(proc_names_node, nnkSym)
+  extendWithRaisePyExceptionProcDef(output_lines, py_exception_defs, mod_name)
+  # Any wrapper proc (not just those of its class) might return a Python class.
+  let exported_class_defs = getExportedPyClassDefs(py_class_defs, class_names_node)
+  for py_class_def in exported_class_defs:
+    extendWithPyClassNimHelperProcDefs(output_lines, py_class_def, mod_name)
   let num_proc_names = proc_names_node.len
   for i in 0.. <num_proc_names:
     let proc_name_node = proc_names_node[i]
@@ -1241,14 +3083,39 @@ proc extendWithAllNimWrapperProcDefs(output_lines: var seq[string],
           [proc_name, mod_name, lineinfo(proc_name_node)]
       error(msg)
 
-    extendWithOneNimWrapperProcDef(output_lines, pp, proc_name, proc_name_node)
+    extendWithOneNimWrapperProcDef(output_lines, pp, proc_name, proc_name_node, mod_name)
+    if pp.batch_proc_name != nil:
+      extendWithOneNimWrapperProcDef(output_lines, proc_prototypes.get(pp.batch_proc_name),
+          pp.batch_proc_name, proc_name_node, mod_name)
+
+  for i in 0.. <exported_class_defs.len:
+    let py_class_def = exported_class_defs[i]
+    for pp in getPyClassMemberProcPrototypes(proc_prototypes, py_class_def):
+      extendWithOneNimWrapperProcDef(output_lines, pp, pp.proc_name,
+          class_names_node[i], mod_name)
+
+
+proc extendWithNimWrapperImports(output_lines: var seq[string]) {. compileTime .} =
+  output_lines << "import strutils"
+  output_lines << "import typetraits  # supportsCopyMem(t: typedesc)"
+  output_lines << ""
+  output_lines << "import pymodpkg/miscutils"
+  output_lines << "import pymodpkg/pyobject"
+  output_lines << "import pymodpkg/private/membrain"
+  # FIXME:  Ideally, we only want to import `pyarrayobject` if we need to.
+  # However, this sin is also made by `definePyObjectType(PyArrayObject,`
+  # in "pymod.nim".
+  when defined(pyarrayEnabled) :
+    output_lines << "import pymodpkg/pyarrayobject"
 
 
 proc outputPyModuleNim(
     proc_prototypes: ProcPrototypeTable,
+    py_exception_defs: PyExceptionDefTable,
+    py_class_defs: PyClassDefTable,
     nimModulesToImport: NimModulesToImportTable,
     mod_name: string,
-    proc_names_node: NimNode)
+    proc_names_node: NimNode, class_names_node: NimNode)
     {. compileTime .} =
   let nim_mod_fname = pymod_nim_mod_fname_template % [mod_name, "nim"]
   #hint(nim_mod_fname)
@@ -1270,24 +3137,17 @@ proc outputPyModuleNim(
       pragma_line,
       ""
   ]
-  output_lines << "import strutils"
-  output_lines << ""
-  output_lines << "import pymodpkg/miscutils"
-  output_lines << "import pymodpkg/pyobject"
-  output_lines << "import pymodpkg/private/membrain"
-  # FIXME:  Ideally, we only want to import `pyarrayobject` if we need to.
-  # However, this sin is also made by `definePyObjectType(PyArrayObject,`
-  # in "pymod.nim".
-  when defined(pyarrayEnabled) :
-    output_lines << "import pymodpkg/pyarrayobject"
+  extendWithNimWrapperImports(output_lines)
+  # The module names are absolute paths, so they must be string literals.
   for nm in nimModulesToImport:
-    output_lines << "import $1" % nm
+    output_lines << "import \"$1\"" % nm
   output_lines << ""
-  extendWithAllNimWrapperProcDefs(output_lines, proc_prototypes, proc_names_node, mod_name)
+  extendWithAllNimWrapperProcDefs(output_lines, proc_prototypes, py_exception_defs,
+      py_class_defs, proc_names_node, class_names_node, mod_name)
 
   let output_content = output_lines.join("\n")
   #hint(output_content)
-  writeFile(nim_mod_fname, output_content)
+  writeFileIfChanged(nim_mod_fname, output_content)
   hint("Created Nim file: " & nim_mod_fname)
 
 
@@ -1317,8 +3177,13 @@ proc outputPyModuleNimCfg(mod_name: string, proc_names_node: NimNode)
   # in proc `open`.
   #open(parser, newFileStream("PyObject.cfg", fmRead), "PyObject.cfg")
 
-  # OK, I don't have time to implement that.  Just hard-code them for now...
-  # FIXME:  Do this properly one day?
+  # Instead, "pmgen.py" parses the [Python] sections of "pymod-extensions.cfg"
+  # & "pymod.cfg" for us, and writes the resulting Nim cfg options to a file.
+  # The absolute path of this file is supplied in the Nim symbol below.
+  const pymodWrapperCfg {.strdefine.} = ""
+  var extra_cfg_content = ""
+  when defined(pymodWrapperCfg):
+    extra_cfg_content = staticRead(pymodWrapperCfg)
 
   # NOTE:  We want to compile the auto-generated Nim & C source files in a
   # single Nim compiler invocation.  However, the auto-generated C source
@@ -1350,16 +3215,53 @@ proc outputPyModuleNimCfg(mod_name: string, proc_names_node: NimNode)
       "noMain",
       out_cfg,
       #"passL:\"-lpython2.7 -fPIC\"",
-      ""  # Join an empty string, so the content ends with a newline.
+      extra_cfg_content,
   ].join("\n")
   let nim_mod_cfg_fname = "$1.cfg" % nim_mod_fname
-  writeFile(nim_mod_cfg_fname, nim_mod_cfg_content)
+  writeFileIfChanged(nim_mod_cfg_fname, nim_mod_cfg_content)
   hint("Created Nim cfg file: " & nim_mod_cfg_fname)
 
 
+proc createPyModuleNimWrappers(
+    proc_prototypes: ProcPrototypeTable,
+    py_exception_defs: PyExceptionDefTable,
+    py_class_defs: PyClassDefTable,
+    mod_name: string,
+    proc_names_node: NimNode, class_names_node: NimNode): NimNode
+    {. compileTime .} =
+  # In a single-pass build (`pymodSinglePass`), the Nim wrapper procs are not
+  # written to a separate Nim module to be compiled by a second invocation of
+  # the Nim compiler.  Instead, they're returned from the `initPyModule` macro,
+  # so they're compiled into the user's own Nim module, in the same invocation
+  # of the Nim compiler that ran the macro.  So there's no need to import the
+  # user's Nim modules; and the exported procs don't need to be exported from
+  # their Nim modules.
+  #
+  # The auto-generated C source file is compiled by the "compile" pragma, which
+  # is processed after all the Nim code has been generated.  As the macro isn't
+  # expanded in the build directory, "pmgen.py" supplies the absolute path of
+  # the build directory in the Nim symbol below.
+  const pymodBuildDir {.strdefine.} = ""
+  var c_mod_fname = pymod_c_mod_fname_template % mod_name
+  when defined(pymodBuildDir):
+    c_mod_fname = pymodBuildDir & "/" & c_mod_fname
+
+  var output_lines: seq[string] = @[]
+  output_lines << "{. compile: \"$1\" .}" % c_mod_fname
+  output_lines << ""
+  extendWithNimWrapperImports(output_lines)
+  output_lines << ""
+  extendWithAllNimWrapperProcDefs(output_lines, proc_prototypes, py_exception_defs,
+      py_class_defs, proc_names_node, class_names_node, mod_name)
+
+  result = parseStmt(output_lines.join("\n"))
+
+
 proc initPyModuleImpl*(
     pyObjectTypeDefs: PyObjectTypeDefTable,
     procPrototypes: ProcPrototypeTable,
+    pyExceptionDefs: PyExceptionDefTable,
+    pyClassDefs: PyClassDefTable,
     nimModulesToImport: NimModulesToImportTable,
     mod_name_node: NimNode,
     extra_includes_node: NimNode,
@@ -1383,9 +3285,53 @@ proc initPyModuleImpl*(
   
   #hint("mod name: " & mod_name)
   verifyValidCIdent(mod_name, mod_name_node)
-  outputPyModuleC(procPrototypes, mod_name, extra_includes_node, extra_init_node, proc_names_node)
-  outputPyModuleNim(procPrototypes, nimModulesToImport, mod_name, proc_names_node)
-  outputPyModuleNimCfg(mod_name, proc_names_node)
+  # The names of the exported Python classes are listed with the procs; they
+  # are separated into the classes & the (module) functions here.
+  let func_names_node = newNimNode(nnkBracket)
+  let class_names_node = newNimNode(nnkBracket)
+  for i in 0.. <proc_names_node.len:
+    let name_node = proc_names_node[i]
+    let py_class_def = pyClassDefs.get($name_node)
+    if py_class_def == nil:
+      func_names_node.add(name_node)
+    elif py_class_def.constructor_key == nil and not py_class_def.is_inline_object:
+      let msg = "Python class `$1` must have a constructor (an exported proc with the \"pyConstructor\" pragma that returns `$1`), before it can be listed in \"$2\" module methods [at $3]" %
+          [$name_node, mod_name, lineinfo(name_node)]
+      error(msg)
+    else:
+      class_names_node.add(name_node)
+
+  # A Python class that's returned by an exported proc must also be listed.
+  var exported_class_names: seq[string] = @[]
+  for i in 0.. <class_names_node.len:
+    exported_class_names.add($class_names_node[i])
+  for i in 0.. <proc_names_node.len:
+    let name_node = proc_names_node[i]
+    var pps: seq[ref ProcPrototype] = @[]
+    let py_class_def = pyClassDefs.get($name_node)
+    if py_class_def == nil:
+      let pp = procPrototypes.get($name_node)
+      if pp != nil:
+        pps.add(pp)
+    else:
+      for method_key in py_class_def.method_keys:
+        pps.add(procPrototypes.get(method_key))
+    for pp in pps:
+      if pp.return_class_nim_type != nil and
+          pp.return_class_nim_type notin exported_class_names:
+        let msg = "Python class `$1` must be listed in \"$2\" module methods, because `$3` returns it [at $4]" %
+            [pp.return_class_nim_type, mod_name, pp.proc_name, lineinfo(name_node)]
+        error(msg)
+
+  outputPyModuleC(procPrototypes, pyExceptionDefs, pyClassDefs, mod_name,
+      extra_includes_node, extra_init_node, func_names_node, class_names_node)
+  when defined(pymodSinglePass):
+    result = createPyModuleNimWrappers(procPrototypes, pyExceptionDefs, pyClassDefs,
+        mod_name, func_names_node, class_names_node)
+  else:
+    outputPyModuleNim(procPrototypes, pyExceptionDefs, pyClassDefs, nimModulesToImport,
+        mod_name, func_names_node, class_names_node)
+    outputPyModuleNimCfg(mod_name, func_names_node)
 
-  result = newStmtList()
+    result = newStmtList()
 
@@ -18,6 +18,8 @@ import pymodpkg/private/registrytypes
 static:
   var pyObjectTypeDefs: PyObjectTypeDefTable = @[]
   var procPrototypes: ProcPrototypeTable = @[]
+  var pyExceptionDefs: PyExceptionDefTable = @[]
+  var pyClassDefs: PyClassDefTable = @[]
   var nimModulesToImport: NimModulesToImportTable = @[]
 
 
@@ -30,7 +32,7 @@ macro registerNimModuleToImport*(nimModName: string): stmt =
 
 
 #
-#=== User-invoked macros part 1: Define new PyObject types
+#=== User-invoked macros part 1: Define new PyObject types & Python exceptions
 #
 
 macro definePyObjectType*(nimType, objCType, pyTypeObj, pyTypeLabel,
@@ -38,6 +40,27 @@ macro definePyObjectType*(nimType, objCType, pyTypeObj, pyTypeLabel,
   result = definePyObjectTypeImpl(pyObjectTypeDefs,
       nimType, objCType, pyTypeObj, pyTypeLabel, extraIncludes)
 
+# Raise the Nim exception type `nimExcType` (& its subtypes) as a new Python
+# exception class `pyExcName` (an attribute of the Python module), derived
+# from the built-in or previously-defined Python exception `pyBaseExcName`.
+macro definePyException*(nimExcType, pyExcName, pyBaseExcName: expr): stmt =
+  result = definePyExceptionImpl(pyExceptionDefs,
+      nimExcType, pyExcName, pyBaseExcName)
+
+# Export the Nim `ref object` type `nimType` as a Python class (a "kernel"),
+# whose constructor & methods are the exportpy-ed procs that return `nimType`
+# (marked by the "pyConstructor" pragma) or take it as their first param (which
+# must be exportpy-ed after this).
+macro exportpyKernel*(nimType: expr): stmt =
+  result = exportpyKernelImpl(pyClassDefs, nimType)
+
+# Export each Nim `object` type defined in the type section `typeDef` as a
+# Python extension type, which stores the Nim object inline.  Its exported
+# fields are the attributes of the Python type; its constructor & methods are
+# exportpy-ed procs (as for `exportpyKernel`).
+macro exportpytype*(typeDef: stmt): stmt =
+  result = exportpytypeImpl(pyClassDefs, typeDef)
+
 
 #
 #=== User-invoked macros part 2: exporting Nim procs to Python
@@ -45,11 +68,26 @@ macro definePyObjectType*(nimType, objCType, pyTypeObj, pyTypeLabel,
 
 # http://nim-lang.org/manual.html#macros-as-pragmas
 macro exportpy*(procDef: expr): stmt =
-  result = exportpyImpl(pyObjectTypeDefs, procPrototypes, procDef)
+  result = exportpyImpl(pyObjectTypeDefs, pyClassDefs, procPrototypes, procDef)
 
 macro return_dict*(procDef: expr): stmt =
   result = procDef
 
+# The exportpy macro finds this pragma, and exports the proc (which returns a
+# Nim object of an exported Python class) as the constructor of the class.
+macro pyConstructor*(procDef: expr): stmt =
+  result = procDef
+
+# The exportpy macro finds this pragma, and also exports a batch variant of the
+# proc, `<name>_batch`.
+macro batched*(procDef: expr): stmt =
+  result = procDef
+
+# The exportpy macro finds this pragma (eg, `{.memoize: 128.}`), and caches the
+# results of (at most) that many calls of the proc.
+macro memoize*(size: expr, procDef: expr): stmt =
+  result = procDef
+
 #
 #=== User-invoked macros part 3: Python C-API code generation
 #
@@ -66,8 +104,8 @@ macro initPyModule*(modName: string, procNames: varargs[expr]): stmt =
       extraInit = createStrLitArray()
 
   result = initPyModuleImpl(
-      pyObjectTypeDefs, procPrototypes, nimModulesToImport,
-      modName, extraIncludes, extraInit, procNames)
+      pyObjectTypeDefs, procPrototypes, pyExceptionDefs, pyClassDefs,
+      nimModulesToImport, modName, extraIncludes, extraInit, procNames)
 
 
 # TODO:  Remove these next two macros entirely, when "pymod-extensions.cfg" is
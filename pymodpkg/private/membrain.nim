@@ -27,6 +27,11 @@
 ## All others will have their ref-counts decremented -- which, since they were
 ## allocated in Nim with a newborn ref-count of 1, will leave them all with
 ## ref-counts of zero, causing them to be deallocated.
+##
+## Each call of a Pymod-wrapped Nim proc only collects the PyObjects that were
+## registered since that call began (in the same thread).  So the wrapped procs
+## can be nested (eg, through a callback into Python), and can run concurrently
+## in several threads, without any locking.
 
 import strutils
 
@@ -65,13 +70,44 @@ type RegisteredPyObject* = object
   info: ref RegisteredPyObjectInfo
 
 
-var RegisteredPyObjects: seq[RegisteredPyObject] = @[]
+# The PyObjects registered in this thread, by all the Pymod-wrapped Nim procs
+# that are currently running in this thread (innermost call last).
+# (Thread-local variables can't be initialised, so this starts as nil.)
+var RegisteredPyObjects {. threadvar .}: seq[RegisteredPyObject]
+
+# The number of PyObjects that were registered (in this thread) before a call
+# of a Pymod-wrapped Nim proc began.  When the call returns, all the PyObjects
+# registered after this mark are collected.
+type RegisteredPyObjectsMark* = distinct int
+
+
+proc beginRegisteredPyObjects*(): RegisteredPyObjectsMark =
+  result = RegisteredPyObjectsMark(RegisteredPyObjects.len)
 
 
 proc initRegisteredPyObjects*() =
   RegisteredPyObjects = @[]
 
 
+when compileOption("threads"):
+  # Any thread (other than the thread that ran `NimMain`) must set up the Nim
+  # GC before it runs any Nim code.
+  var NimGcIsSetUp {. threadvar .}: bool
+  NimGcIsSetUp = true  # This is run by `NimMain`, in its thread.
+
+  proc isNimGcSetUpInThisThread*(): bool = NimGcIsSetUp
+  proc markNimGcSetUpInThisThread*() = NimGcIsSetUp = true
+
+# This must be expanded in the outermost Nim proc (ie, the Pymod-wrapped Nim
+# proc), because `setupForeignThreadGc` uses the current stack frame as the
+# bottom of the stack to scan for GC roots.
+template ensureNimGcIsSetUp*() =
+  when compileOption("threads"):
+    if not isNimGcSetUpInThisThread():
+      setupForeignThreadGc()
+      markNimGcSetUpInThisThread()
+
+
 when DoPrintDebugInfo:
   template echoInfo(rpo: RegisteredPyObject, context: string) =
     echo(context, " ", rpo.obj.toHex)
@@ -118,10 +154,10 @@ proc registerNewPyObject*[T](obj: ptr T,
   return cast[ptr T](registerNewPyObjectImpl(py_obj, from_where, which_func, created_at))
 
 
-proc decRefAllRegisteredPyObjects*() =
+proc decRefRegisteredPyObjects*(mark: RegisteredPyObjectsMark) =
   when DoPrintDebugInfo:
-    echo("\ndecRefAllRegisteredPyObjects()...")
-  while RegisteredPyObjects.len > 0:
+    echo("\ndecRefRegisteredPyObjects()...")
+  while RegisteredPyObjects.len > int(mark):
     let rpo = RegisteredPyObjects.pop()
     when DoPrintDebugInfo:
       rpo.echoInfo("Processing registered PyObject")
@@ -147,6 +183,10 @@ proc decRefAllRegisteredPyObjects*() =
     doPyDecRef(rpo.obj)
 
 
+proc decRefAllRegisteredPyObjects*() =
+  decRefRegisteredPyObjects(RegisteredPyObjectsMark(0))
+
+
 proc findRegisteredPyObjectByValue*[T](obj: ptr T): ref RegisteredPyObject =
   let cast_obj = cast[ptr PyObject](obj)
   for rpo in RegisteredPyObjects:
@@ -158,9 +198,13 @@ proc findRegisteredPyObjectByValue*[T](obj: ptr T): ref RegisteredPyObject =
   return nil
 
 
-proc collectAllGarbage*() =
+proc collectAllGarbage*(mark: RegisteredPyObjectsMark) =
   when DoPrintDebugInfo:
     echo("\ncollectAllGarbage()...")
-  decRefAllRegisteredPyObjects()
+  decRefRegisteredPyObjects(mark)
   GC_fullCollect()  # http://nim-lang.org/system.html#GC_fullCollect
 
+
+proc collectAllGarbage*() =
+  collectAllGarbage(RegisteredPyObjectsMark(0))
+
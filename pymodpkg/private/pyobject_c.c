@@ -6,8 +6,11 @@
  * found in the "LICENSE" file in the root directory of this source tree.
  */
 
+#include <ctype.h>
+#include <stdarg.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "pyobject_c.h"
 
@@ -104,3 +107,887 @@ getPyNone() {
 	return Py_None;
 }
 
+
+
+/*
+ * Each of these returns the same PyObject as the corresponding single-char
+ * format string of `Py_BuildValue` (noted in brackets), but without parsing
+ * a format string at every call.
+ */
+
+/* ["l"] */
+PyObject *
+newPyInt(long val) {
+#if PY_MAJOR_VERSION >= 3
+	return PyLong_FromLong(val);
+#else
+	return PyInt_FromLong(val);
+#endif
+}
+
+
+/* ["k"] */
+PyObject *
+newPyIntFromUnsigned(unsigned long val) {
+#if PY_MAJOR_VERSION < 3
+	if (val <= (unsigned long) LONG_MAX) {
+		return PyInt_FromLong((long) val);
+	}
+#endif
+	return PyLong_FromUnsignedLong(val);
+}
+
+
+/* ["d"] */
+PyObject *
+newPyFloat(double val) {
+	return PyFloat_FromDouble(val);
+}
+
+
+/* ["c"] */
+PyObject *
+newPyChar(char val) {
+#if PY_MAJOR_VERSION >= 3
+	return PyBytes_FromStringAndSize(&val, 1);
+#else
+	return PyString_FromStringAndSize(&val, 1);
+#endif
+}
+
+
+/* ["s#"]:  A NULL string (eg, a nil Nim string) is converted to None. */
+PyObject *
+newPyStr(const char *s, Py_ssize_t len) {
+	if (s == NULL) {
+		return getPyNone();
+	}
+#if PY_MAJOR_VERSION >= 3
+	return PyUnicode_FromStringAndSize(s, len);
+#else
+	return PyString_FromStringAndSize(s, len);
+#endif
+}
+
+
+/* ["s"] */
+PyObject *
+newPyStrFromCString(const char *s) {
+	if (s == NULL) {
+		return getPyNone();
+	}
+	return newPyStr(s, (Py_ssize_t) strlen(s));
+}
+
+
+/* ["O"]:  Increments the ref-count of the object. */
+PyObject *
+newPyRef(PyObject *obj) {
+	if (obj == NULL) {
+		if (!PyErr_Occurred()) {
+			PyErr_SetString(PyExc_SystemError,
+					"NULL object returned to Python");
+		}
+		return NULL;
+	}
+	Py_INCREF(obj);
+	return obj;
+}
+
+
+/*
+ * Pack `n` new references (supplied as the variadic arguments) into a new
+ * tuple.  Unlike `PyTuple_Pack`, the tuple steals the references.  If any of
+ * them is NULL (because it couldn't be created), the others are released &
+ * NULL is returned.
+ */
+PyObject *
+packNewPyTuple(Py_ssize_t n, ...) {
+	PyObject *tuple = PyTuple_New(n);
+	int failed = (tuple == NULL);
+	va_list items;
+	Py_ssize_t i;
+
+	va_start(items, n);
+	for (i = 0; i < n; ++i) {
+		PyObject *item = va_arg(items, PyObject *);
+		if (item == NULL) {
+			failed = 1;
+		} else if (failed) {
+			Py_DECREF(item);
+		} else {
+			PyTuple_SET_ITEM(tuple, i, item);
+		}
+	}
+	va_end(items);
+
+	if (failed) {
+		/* Releases any items that were already set in the tuple. */
+		Py_XDECREF(tuple);
+		return NULL;
+	}
+	return tuple;
+}
+
+
+/*
+ * The size, & the kind ('b' = bool, 'i' = signed int, 'u' = unsigned int,
+ * 'f' = float), of each `enum PymodSeqArgElemType`.
+ */
+static const struct {
+	Py_ssize_t itemsize;
+	char kind;
+} seq_arg_elem_types[] = {
+	{ 1, 'b' },
+	{ 1, 'i' }, { 2, 'i' }, { 4, 'i' }, { 8, 'i' },
+	{ 1, 'u' }, { 2, 'u' }, { 4, 'u' }, { 8, 'u' },
+	{ 4, 'f' }, { 8, 'f' },
+};
+
+
+/*
+ * Return the kind (as above) of the elements in a buffer with the (native,
+ * single-element) struct-module format `format`, or 0 if it isn't one of them.
+ */
+static char
+getBufferFormatKind(const char *format) {
+	if (format == NULL) {
+		/* "If format is NULL, 'B' (unsigned bytes) is assumed." */
+		return 'u';
+	}
+	if (format[0] == '@' || format[0] == '=') {
+		++format;
+	}
+	if (format[0] == '\0' || format[1] != '\0') {
+		return 0;
+	}
+	switch (format[0]) {
+	case '?':
+		return 'b';
+	case 'b': case 'h': case 'i': case 'l': case 'q': case 'n':
+		return 'i';
+	case 'B': case 'H': case 'I': case 'L': case 'Q': case 'N':
+		return 'u';
+	case 'f': case 'd':
+		return 'f';
+	default:
+		return 0;
+	}
+}
+
+
+/*
+ * The zero-copy path:  Returns 1 if `arg` now points into the buffer of `obj`,
+ * or 0 if `obj` has no buffer of the right element type & layout.
+ */
+static int
+getSeqArgFromBuffer(PyObject *obj, int elem_type, PymodSeqArg *arg) {
+	if (!PyObject_CheckBuffer(obj)) {
+		return 0;
+	}
+	if (PyObject_GetBuffer(obj, &arg->view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+		/* Eg, the array isn't C-contiguous.  Convert the elements instead. */
+		PyErr_Clear();
+		return 0;
+	}
+	if (arg->view.ndim != 1 ||
+			arg->view.itemsize != seq_arg_elem_types[elem_type].itemsize ||
+			getBufferFormatKind(arg->view.format) != seq_arg_elem_types[elem_type].kind) {
+		PyBuffer_Release(&arg->view);
+		return 0;
+	}
+	arg->data = arg->view.buf;
+	arg->len = arg->view.shape[0];
+	return 1;
+}
+
+
+static int
+storeIntSeqArgElem(PyObject *item, int elem_type, char *dest) {
+	long long val;
+	unsigned long long uval = 0;
+	int is_unsigned = (seq_arg_elem_types[elem_type].kind == 'u');
+
+	val = PyLong_AsLongLong(item);
+	if (val == -1 && PyErr_Occurred()) {
+		if (!is_unsigned || !PyErr_ExceptionMatches(PyExc_OverflowError)) {
+			return -1;
+		}
+		/* It might be too large for a `long long`, but not for a uint64. */
+		PyErr_Clear();
+		uval = PyLong_AsUnsignedLongLong(item);
+		if (uval == (unsigned long long) -1 && PyErr_Occurred()) {
+			return -1;
+		}
+	} else if (is_unsigned) {
+		if (val < 0) {
+			goto overflow;
+		}
+		uval = (unsigned long long) val;
+	}
+
+	switch (elem_type) {
+	case PYMOD_SEQ_ARG_INT8:
+		if (val < -128 || val > 127) goto overflow;
+		*(signed char *) dest = (signed char) val;
+		break;
+	case PYMOD_SEQ_ARG_INT16:
+		if (val < -32768 || val > 32767) goto overflow;
+		*(short *) dest = (short) val;
+		break;
+	case PYMOD_SEQ_ARG_INT32:
+		if (val < -2147483647LL - 1 || val > 2147483647LL) goto overflow;
+		*(int *) dest = (int) val;
+		break;
+	case PYMOD_SEQ_ARG_INT64:
+		*(long long *) dest = val;
+		break;
+	case PYMOD_SEQ_ARG_UINT8:
+		if (uval > 0xFFULL) goto overflow;
+		*(unsigned char *) dest = (unsigned char) uval;
+		break;
+	case PYMOD_SEQ_ARG_UINT16:
+		if (uval > 0xFFFFULL) goto overflow;
+		*(unsigned short *) dest = (unsigned short) uval;
+		break;
+	case PYMOD_SEQ_ARG_UINT32:
+		if (uval > 0xFFFFFFFFULL) goto overflow;
+		*(unsigned int *) dest = (unsigned int) uval;
+		break;
+	case PYMOD_SEQ_ARG_UINT64:
+		*(unsigned long long *) dest = uval;
+		break;
+	}
+	return 0;
+
+overflow:
+	PyErr_SetString(PyExc_OverflowError,
+			"sequence element is out of range for the element type");
+	return -1;
+}
+
+
+/*
+ * Get the elements of `obj` (for a Nim `seq[T]` or `openarray[T]` parameter
+ * with element type `elem_type`) into `arg`, which must be initialised with
+ * `PYMOD_SEQ_ARG_INIT`.  Returns -1 (with a Python exception set) if `obj`
+ * isn't a sequence of numbers that can be converted to the element type.
+ *
+ * `arg` must be released by `pymodSeqArgRelease`, whether or not this failed.
+ */
+int
+pymodSeqArgFromPyObject(PyObject *obj, int elem_type, PymodSeqArg *arg) {
+	PyObject *seq;
+	PyObject **items;
+	Py_ssize_t itemsize = seq_arg_elem_types[elem_type].itemsize;
+	char kind = seq_arg_elem_types[elem_type].kind;
+	Py_ssize_t i;
+
+	if (getSeqArgFromBuffer(obj, elem_type, arg)) {
+		return 0;
+	}
+
+	seq = PySequence_Fast(obj, "argument must be a sequence of numbers");
+	if (seq == NULL) {
+		return -1;
+	}
+	arg->len = PySequence_Fast_GET_SIZE(seq);
+	/* Allocate at least 1 byte, so an empty sequence isn't a NULL array. */
+	arg->data = PyMem_Malloc(arg->len * itemsize + 1);
+	if (arg->data == NULL) {
+		Py_DECREF(seq);
+		PyErr_NoMemory();
+		return -1;
+	}
+	arg->owns_data = 1;
+
+	items = PySequence_Fast_ITEMS(seq);
+	for (i = 0; i < arg->len; ++i) {
+		char *dest = (char *) arg->data + i * itemsize;
+		if (kind == 'f') {
+			double val = PyFloat_AsDouble(items[i]);
+			if (val == -1.0 && PyErr_Occurred()) {
+				break;
+			}
+			if (itemsize == sizeof(float)) {
+				*(float *) dest = (float) val;
+			} else {
+				*(double *) dest = val;
+			}
+		} else if (kind == 'b') {
+			int val = PyObject_IsTrue(items[i]);
+			if (val < 0) {
+				break;
+			}
+			*dest = (char) val;
+		} else if (storeIntSeqArgElem(items[i], elem_type, dest) < 0) {
+			break;
+		}
+	}
+	Py_DECREF(seq);
+	return (i < arg->len) ? -1 : 0;
+}
+
+
+void
+pymodSeqArgRelease(PymodSeqArg *arg) {
+	if (arg->owns_data) {
+		PyMem_Free(arg->data);
+		arg->owns_data = 0;
+	} else if (arg->view.obj != NULL) {
+		PyBuffer_Release(&arg->view);
+	}
+	arg->data = NULL;
+	arg->len = 0;
+}
+
+
+/*
+ * The Nim stack trace that is attached (as attribute `nim_traceback`) to a
+ * Python exception by `raisePyErrorWithNimTraceback`.  It's only formatted
+ * to look like a Python traceback (as by `prettyPrintStackTrace` in
+ * "pymodpkg/miscutils.nim") when it's converted to a string.
+ */
+typedef struct {
+	PyObject_HEAD
+	char *raw;
+	PyObject *formatted;
+} NimTracebackObject;
+
+
+/*
+ * Format one line of a Nim stack trace into `out`; return the length written.
+ * `out` must have room for `len + 32` chars.
+ *
+ * The first line should look like this:
+ *   Traceback (most recent call last)
+ * and the remaining lines should look something like these:
+ *   testpymod3_pymod_wrap.nim(102) exportpy_myNumpyAdd
+ *   testPymod.nim(163)       myNumpyAdd
+ */
+static size_t
+formatNimStackTraceLine(const char *line, size_t len, int is_first, char *out) {
+	const char *lparen;
+	const char *rparen;
+	const char *p;
+	const char *func;
+	size_t func_len;
+	size_t n;
+
+	if (is_first) {
+		if (len >= 9 && strncmp(line, "Traceback", 9) == 0) {
+			memcpy(out, "Nim t", 5);
+			memcpy(out + 5, line + 1, len - 1);
+			n = len + 4;
+		} else {
+			memcpy(out, line, len);
+			n = len;
+		}
+		if (len > 0 && line[len - 1] == ')') {
+			out[n++] = ':';  /* A bit more Python-like... */
+		}
+		return n;
+	}
+
+	lparen = (const char *) memchr(line, '(', len);
+	if (lparen == NULL || lparen == line) {
+		goto unparsed;
+	}
+	rparen = (const char *) memchr(lparen + 1, ')', len - (size_t) (lparen + 1 - line));
+	if (rparen == NULL || rparen == lparen + 1) {
+		goto unparsed;
+	}
+	for (p = lparen + 1; p < rparen; ++p) {
+		if (!isdigit((unsigned char) *p)) {
+			goto unparsed;
+		}
+	}
+	func = rparen + 1;
+	func_len = (size_t) (line + len - func);
+	while (func_len > 0 && isspace((unsigned char) func[0])) {
+		++func;
+		--func_len;
+	}
+	while (func_len > 0 && isspace((unsigned char) func[func_len - 1])) {
+		--func_len;
+	}
+
+	/* This is also more Python-like... */
+	n = 0;
+	memcpy(out + n, "  File \"", 8);
+	n += 8;
+	memcpy(out + n, line, (size_t) (lparen - line));
+	n += (size_t) (lparen - line);
+	memcpy(out + n, "\", line ", 8);
+	n += 8;
+	memcpy(out + n, lparen + 1, (size_t) (rparen - lparen - 1));
+	n += (size_t) (rparen - lparen - 1);
+	memcpy(out + n, ", in ", 5);
+	n += 5;
+	memcpy(out + n, func, func_len);
+	n += func_len;
+	return n;
+
+unparsed:
+	/* Unable to parse line.  Just store it, unparsed. */
+	memcpy(out, line, len);
+	return len;
+}
+
+
+static PyObject *
+formatNimStackTrace(const char *raw) {
+	size_t num_lines = 1;
+	const char *p;
+	char *buf;
+	char *out;
+	PyObject *result;
+
+	for (p = raw; *p != '\0'; ++p) {
+		if (*p == '\n') {
+			++num_lines;
+		}
+	}
+	buf = (char *) PyMem_Malloc(strlen(raw) + 32 * num_lines + 1);
+	if (buf == NULL) {
+		return PyErr_NoMemory();
+	}
+
+	out = buf;
+	for (p = raw; ; ) {
+		const char *end = strchr(p, '\n');
+		size_t len = (end != NULL) ? (size_t) (end - p) : strlen(p);
+		if (p != raw) {
+			*out++ = '\n';
+		}
+		out += formatNimStackTraceLine(p, len, (p == raw), out);
+		if (end == NULL) {
+			break;
+		}
+		p = end + 1;
+	}
+
+	result = newPyStr(buf, (Py_ssize_t) (out - buf));
+	PyMem_Free(buf);
+	return result;
+}
+
+
+static void
+NimTraceback_dealloc(NimTracebackObject *self) {
+	PyMem_Free(self->raw);
+	Py_XDECREF(self->formatted);
+	PyObject_Del(self);
+}
+
+
+static PyObject *
+NimTraceback_str(NimTracebackObject *self) {
+	if (self->formatted == NULL) {
+		self->formatted = formatNimStackTrace(self->raw);
+		if (self->formatted == NULL) {
+			return NULL;
+		}
+	}
+	Py_INCREF(self->formatted);
+	return self->formatted;
+}
+
+
+static PyObject *
+NimTraceback_get_raw(NimTracebackObject *self, void *closure) {
+	(void) closure;
+	return newPyStrFromCString(self->raw);
+}
+
+
+static PyGetSetDef NimTraceback_getset[] = {
+	{ (char *) "raw", (getter) NimTraceback_get_raw, NULL,
+			(char *) "the unformatted Nim stack trace", NULL },
+	{ NULL, NULL, NULL, NULL, NULL }
+};
+
+
+static PyTypeObject NimTracebackType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "pymod.NimTraceback",
+	.tp_basicsize = sizeof(NimTracebackObject),
+	.tp_dealloc = (destructor) NimTraceback_dealloc,
+	.tp_repr = (reprfunc) NimTraceback_str,
+	.tp_str = (reprfunc) NimTraceback_str,
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_doc = "A Nim stack trace, formatted when converted to a string.",
+	.tp_getset = NimTraceback_getset,
+};
+
+
+static PyObject *
+newNimTraceback(const char *nim_stack_trace) {
+	NimTracebackObject *tb;
+	size_t len = strlen(nim_stack_trace);
+
+	if (!(NimTracebackType.tp_flags & Py_TPFLAGS_READY)) {
+		if (PyType_Ready(&NimTracebackType) < 0) {
+			return NULL;
+		}
+	}
+	tb = PyObject_New(NimTracebackObject, &NimTracebackType);
+	if (tb == NULL) {
+		return NULL;
+	}
+	tb->formatted = NULL;
+	tb->raw = (char *) PyMem_Malloc(len + 1);
+	if (tb->raw == NULL) {
+		Py_DECREF(tb);
+		return PyErr_NoMemory();
+	}
+	memcpy(tb->raw, nim_stack_trace, len + 1);
+	return (PyObject *) tb;
+}
+
+
+PyObject *
+raisePyErrorWithNimTraceback(PyObject *exc_type, const char *msg,
+		const char *nim_stack_trace) {
+	PyObject *py_msg;
+	PyObject *exc;
+	PyObject *tb;
+
+	py_msg = newPyStrFromCString(msg);
+	if (py_msg == NULL) {
+		return NULL;
+	}
+	exc = PyObject_CallFunctionObjArgs(exc_type, py_msg, NULL);
+	Py_DECREF(py_msg);
+	if (exc == NULL) {
+		return NULL;
+	}
+
+	tb = newNimTraceback(nim_stack_trace != NULL ? nim_stack_trace : "");
+	if (tb == NULL || PyObject_SetAttrString(exc, "nim_traceback", tb) < 0) {
+		/* The exception is still raised, without its Nim traceback. */
+		PyErr_Clear();
+	}
+	Py_XDECREF(tb);
+
+	PyErr_SetObject(exc_type, exc);
+	Py_DECREF(exc);
+	return NULL;
+}
+
+
+/*
+ * A Python iterator over the items yielded by a Nim iterator.
+ */
+typedef struct {
+	PyObject_HEAD
+	void *state;
+	PymodNimIteratorNextFunc next;
+	PymodNimIteratorReleaseFunc release;
+} NimIteratorObject;
+
+
+static void
+NimIterator_dealloc(NimIteratorObject *self) {
+	if (self->state != NULL) {
+		self->release(self->state);
+	}
+	PyObject_Del(self);
+}
+
+
+static PyObject *
+NimIterator_iternext(NimIteratorObject *self) {
+	PyObject *item;
+
+	if (self->state == NULL) {
+		/* The Nim iterator has already finished (or failed). */
+		return NULL;
+	}
+	item = self->next(self->state);
+	if (item == NULL) {
+		/* Release the Nim iterator (& anything it refers to) now, rather
+		 * than when the Python iterator is deallocated.  If no exception
+		 * is set, this ends the Python iteration. */
+		self->release(self->state);
+		self->state = NULL;
+	}
+	return item;
+}
+
+
+static PyTypeObject NimIteratorType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "pymod.NimIterator",
+	.tp_basicsize = sizeof(NimIteratorObject),
+	.tp_dealloc = (destructor) NimIterator_dealloc,
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_doc = "An iterator over the items yielded by a Nim iterator.",
+	.tp_iter = PyObject_SelfIter,
+	.tp_iternext = (iternextfunc) NimIterator_iternext,
+};
+
+
+PyObject *
+newPyNimIterator(void *state, PymodNimIteratorNextFunc next,
+		PymodNimIteratorReleaseFunc release) {
+	NimIteratorObject *it;
+
+	if (!(NimIteratorType.tp_flags & Py_TPFLAGS_READY)) {
+		if (PyType_Ready(&NimIteratorType) < 0) {
+			release(state);
+			return NULL;
+		}
+	}
+	it = PyObject_New(NimIteratorObject, &NimIteratorType);
+	if (it == NULL) {
+		release(state);
+		return NULL;
+	}
+	it->state = state;
+	it->next = next;
+	it->release = release;
+	return (PyObject *) it;
+}
+
+
+int
+pymodMemoKeyAdd(PymodMemoKey *key, const void *bytes, size_t n) {
+	if (key->data == NULL) {
+		key->data = key->small;
+		key->cap = sizeof(key->small);
+	}
+	if (key->len + n > key->cap) {
+		size_t new_cap = 2 * key->cap;
+		char *new_data;
+
+		while (key->len + n > new_cap) {
+			new_cap *= 2;
+		}
+		if (key->data == key->small) {
+			new_data = (char *) PyMem_Malloc(new_cap);
+			if (new_data != NULL) {
+				memcpy(new_data, key->small, key->len);
+			}
+		} else {
+			new_data = (char *) PyMem_Realloc(key->data, new_cap);
+		}
+		if (new_data == NULL) {
+			PyErr_NoMemory();
+			return -1;
+		}
+		key->data = new_data;
+		key->cap = new_cap;
+	}
+	memcpy(key->data + key->len, bytes, n);
+	key->len += n;
+	return 0;
+}
+
+
+int
+pymodMemoKeyAddStr(PymodMemoKey *key, const char *s) {
+	/* Include the terminating NUL, so ("ab", "c") & ("a", "bc") differ. */
+	return pymodMemoKeyAdd(key, s, strlen(s) + 1);
+}
+
+
+void
+pymodMemoKeyRelease(PymodMemoKey *key) {
+	if (key->data != NULL && key->data != key->small) {
+		PyMem_Free(key->data);
+	}
+	key->data = NULL;
+	key->len = 0;
+	key->cap = 0;
+}
+
+
+struct PymodMemoEntry {
+	/* The next entry in the same bucket. */
+	struct PymodMemoEntry *chain;
+	/* The LRU list: `prev` is more-recently used; `next` less-recently used. */
+	struct PymodMemoEntry *prev;
+	struct PymodMemoEntry *next;
+	PyObject *value;
+	size_t hash;
+	size_t key_len;
+	char key[];
+};
+
+
+static size_t
+hashMemoKey(const PymodMemoKey *key) {
+	/* FNV-1a. */
+	size_t h = (size_t) 14695981039346656037ULL;
+	size_t i;
+
+	for (i = 0; i < key->len; ++i) {
+		h ^= (unsigned char) key->data[i];
+		h *= (size_t) 1099511628211ULL;
+	}
+	return h;
+}
+
+
+static void
+unlinkMemoEntryFromLru(PymodMemoCache *cache, struct PymodMemoEntry *e) {
+	if (e->prev != NULL) {
+		e->prev->next = e->next;
+	} else {
+		cache->lru_head = e->next;
+	}
+	if (e->next != NULL) {
+		e->next->prev = e->prev;
+	} else {
+		cache->lru_tail = e->prev;
+	}
+	e->prev = e->next = NULL;
+}
+
+
+static void
+pushMemoEntryToLruHead(PymodMemoCache *cache, struct PymodMemoEntry *e) {
+	e->prev = NULL;
+	e->next = cache->lru_head;
+	if (cache->lru_head != NULL) {
+		cache->lru_head->prev = e;
+	} else {
+		cache->lru_tail = e;
+	}
+	cache->lru_head = e;
+}
+
+
+static struct PymodMemoEntry **
+findMemoEntry(PymodMemoCache *cache, const char *key, size_t key_len, size_t hash) {
+	struct PymodMemoEntry **pe = &cache->buckets[hash & (cache->num_buckets - 1)];
+
+	while (*pe != NULL) {
+		if ((*pe)->hash == hash && (*pe)->key_len == key_len &&
+				(key_len == 0 || memcmp((*pe)->key, key, key_len) == 0)) {
+			break;
+		}
+		pe = &(*pe)->chain;
+	}
+	return pe;
+}
+
+
+PyObject *
+pymodMemoCacheGet(PymodMemoCache *cache, const PymodMemoKey *key) {
+	struct PymodMemoEntry *e = NULL;
+
+	if (cache->buckets != NULL) {
+		e = *findMemoEntry(cache, key->data, key->len, hashMemoKey(key));
+	}
+	if (e == NULL) {
+		++cache->misses;
+		return NULL;
+	}
+	++cache->hits;
+	if (e != cache->lru_head) {
+		unlinkMemoEntryFromLru(cache, e);
+		pushMemoEntryToLruHead(cache, e);
+	}
+	Py_INCREF(e->value);
+	return e->value;
+}
+
+
+int
+pymodMemoCachePut(PymodMemoCache *cache, const PymodMemoKey *key, PyObject *value) {
+	size_t hash = hashMemoKey(key);
+	struct PymodMemoEntry **pe;
+	struct PymodMemoEntry *e;
+
+	if (cache->capacity <= 0) {
+		return 0;
+	}
+	if (cache->buckets == NULL) {
+		/* Allocated on first use, at least twice the capacity (a power of 2). */
+		size_t num_buckets = 8;
+
+		while (num_buckets < 2 * (size_t) cache->capacity) {
+			num_buckets *= 2;
+		}
+		cache->buckets = (struct PymodMemoEntry **)
+				PyMem_Malloc(num_buckets * sizeof(struct PymodMemoEntry *));
+		if (cache->buckets == NULL) {
+			PyErr_NoMemory();
+			return -1;
+		}
+		memset(cache->buckets, 0, num_buckets * sizeof(struct PymodMemoEntry *));
+		cache->num_buckets = num_buckets;
+	}
+
+	pe = findMemoEntry(cache, key->data, key->len, hash);
+	if (*pe != NULL) {
+		/* Already cached (eg, by a re-entrant call). */
+		PyObject *old_value = (*pe)->value;
+
+		Py_INCREF(value);
+		(*pe)->value = value;
+		Py_DECREF(old_value);
+		return 0;
+	}
+
+	e = (struct PymodMemoEntry *) PyMem_Malloc(sizeof(struct PymodMemoEntry) + key->len);
+	if (e == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+	e->chain = NULL;
+	e->hash = hash;
+	e->key_len = key->len;
+	memcpy(e->key, key->data, key->len);
+	Py_INCREF(value);
+	e->value = value;
+	*pe = e;
+	pushMemoEntryToLruHead(cache, e);
+	++cache->size;
+
+	if (cache->size > cache->capacity) {
+		struct PymodMemoEntry *lru = cache->lru_tail;
+		struct PymodMemoEntry **plru = findMemoEntry(cache, lru->key, lru->key_len,
+				lru->hash);
+
+		*plru = lru->chain;
+		unlinkMemoEntryFromLru(cache, lru);
+		--cache->size;
+		/* Only DECREF once the entry is unlinked, since it might run Python code. */
+		Py_DECREF(lru->value);
+		PyMem_Free(lru);
+	}
+	return 0;
+}
+
+
+void
+pymodMemoCacheClear(PymodMemoCache *cache) {
+	struct PymodMemoEntry *e = cache->lru_head;
+	struct PymodMemoEntry **buckets = cache->buckets;
+
+	/* Detach the entries before any DECREF, which might re-enter the cache. */
+	cache->buckets = NULL;
+	cache->num_buckets = 0;
+	cache->lru_head = cache->lru_tail = NULL;
+	cache->size = 0;
+	cache->hits = 0;
+	cache->misses = 0;
+	while (e != NULL) {
+		struct PymodMemoEntry *next = e->next;
+
+		Py_DECREF(e->value);
+		PyMem_Free(e);
+		e = next;
+	}
+	PyMem_Free(buckets);
+}
+
+
+PyObject *
+pymodMemoCacheInfo(PymodMemoCache *cache) {
+	return Py_BuildValue("(nnnn)", cache->hits, cache->misses,
+			cache->capacity, cache->size);
+}
@@ -35,4 +35,148 @@ raisePyValueError(const char *msg);
 PyObject *
 getPyNone();
 
+PyObject *
+raisePyErrorWithNimTraceback(PyObject *exc_type, const char *msg,
+		const char *nim_stack_trace);
+
+/*
+ * Create new PyObjects directly from C values, for the return values of the
+ * exported procs (rather than interpreting a format string in `Py_BuildValue`).
+ * Each returns a new reference, or NULL (with a Python exception set).
+ */
+
+PyObject *
+newPyInt(long val);
+
+PyObject *
+newPyIntFromUnsigned(unsigned long val);
+
+PyObject *
+newPyFloat(double val);
+
+PyObject *
+newPyChar(char val);
+
+PyObject *
+newPyStr(const char *s, Py_ssize_t len);
+
+PyObject *
+newPyStrFromCString(const char *s);
+
+PyObject *
+newPyRef(PyObject *obj);
+
+PyObject *
+packNewPyTuple(Py_ssize_t n, ...);
+
+/*
+ * The element types of a Nim `seq[T]` or `openarray[T]` parameter.
+ */
+enum PymodSeqArgElemType {
+	PYMOD_SEQ_ARG_BOOL,
+	PYMOD_SEQ_ARG_INT8,
+	PYMOD_SEQ_ARG_INT16,
+	PYMOD_SEQ_ARG_INT32,
+	PYMOD_SEQ_ARG_INT64,
+	PYMOD_SEQ_ARG_UINT8,
+	PYMOD_SEQ_ARG_UINT16,
+	PYMOD_SEQ_ARG_UINT32,
+	PYMOD_SEQ_ARG_UINT64,
+	PYMOD_SEQ_ARG_FLOAT32,
+	PYMOD_SEQ_ARG_FLOAT64
+};
+
+/*
+ * The elements of a Python argument, for a Nim `seq[T]` or `openarray[T]`
+ * parameter, as a C array of `len` elements of type `T`.
+ *
+ * If the Python object supports the buffer protocol (eg, a Numpy array or a
+ * `bytes` object) & its buffer is a 1-D, C-contiguous array of `T`, then `data`
+ * points into the buffer (which is held in `view` until released).  Otherwise,
+ * `data` is a new array that the elements are converted into.
+ */
+typedef struct {
+	void *data;
+	Py_ssize_t len;
+	Py_buffer view;
+	int owns_data;
+} PymodSeqArg;
+
+#define PYMOD_SEQ_ARG_INIT { NULL, 0, { NULL }, 0 }
+
+int
+pymodSeqArgFromPyObject(PyObject *obj, int elem_type, PymodSeqArg *arg);
+
+void
+pymodSeqArgRelease(PymodSeqArg *arg);
+
+
+/*
+ * A Python iterator that resumes a Nim closure iterator (of an exported Nim
+ * iterator).  `next` returns a new reference to the next item, or NULL: with
+ * a Python exception set if an error occurred, otherwise when the Nim iterator
+ * has finished.  `release` is called (with `state`) when the Python iterator
+ * is deallocated.
+ */
+typedef PyObject *(*PymodNimIteratorNextFunc)(void *state);
+typedef void (*PymodNimIteratorReleaseFunc)(void *state);
+
+PyObject *
+newPyNimIterator(void *state, PymodNimIteratorNextFunc next,
+		PymodNimIteratorReleaseFunc release);
+
+
+/*
+ * The key of a memoized call: the bytes of the converted C argument values.
+ * Keys of up to `sizeof(small)` bytes don't require any allocation.
+ */
+typedef struct {
+	char *data;
+	size_t len;
+	size_t cap;
+	char small[64];
+} PymodMemoKey;
+
+#define PYMOD_MEMO_KEY_INIT { NULL, 0, 0, { 0 } }
+
+int
+pymodMemoKeyAdd(PymodMemoKey *key, const void *bytes, size_t n);
+
+int
+pymodMemoKeyAddStr(PymodMemoKey *key, const char *s);
+
+void
+pymodMemoKeyRelease(PymodMemoKey *key);
+
+/*
+ * A hash table of (at most) `capacity` results of memoized calls, which
+ * evicts the least-recently-used result when it's full.
+ */
+struct PymodMemoEntry;
+
+typedef struct {
+	Py_ssize_t capacity;
+	Py_ssize_t size;
+	size_t num_buckets;
+	struct PymodMemoEntry **buckets;
+	struct PymodMemoEntry *lru_head;
+	struct PymodMemoEntry *lru_tail;
+	Py_ssize_t hits;
+	Py_ssize_t misses;
+} PymodMemoCache;
+
+#define PYMOD_MEMO_CACHE_INIT(capacity) { (capacity), 0, 0, NULL, NULL, NULL, 0, 0 }
+
+PyObject *
+pymodMemoCacheGet(PymodMemoCache *cache, const PymodMemoKey *key);
+
+int
+pymodMemoCachePut(PymodMemoCache *cache, const PymodMemoKey *key, PyObject *value);
+
+void
+pymodMemoCacheClear(PymodMemoCache *cache);
+
+PyObject *
+pymodMemoCacheInfo(PymodMemoCache *cache);
+
 #endif  /* PYMODPYUTILS_C_H */
@@ -63,6 +63,40 @@ proc getKey*(potd: ref PyObjectTypeDef): string {. compileTime .} =
   result = potd.nim_type
 
 
+# A Python exception type that is raised for a Nim exception type.  (The Nim
+# exceptions that aren't mapped by the user are raised as built-in Python
+# exceptions; see `NimToPyExceptions` in "impls.nim".)
+type PyExceptionDef* = tuple[
+    # The Nim exception type, eg "ParseError".
+    # This will be used in Nim files (both original & auto-generated).
+    nim_type: string,
+    # The Nim source line on which the Python exception was defined.
+    def_line_info: string,
+    # The name of the Python exception class, eg "ParseError".  It will be
+    # an attribute of the Python module.
+    py_name: string,
+    # The name of the base class of the Python exception class:  Either the
+    # name of a built-in Python exception (eg, "ValueError"), or the
+    # `py_name` of a previously-defined Python exception.
+    py_base_name: string
+]
+
+proc new_PyExceptionDef*(
+    nim_type: string,
+    def_line_info: string,
+    py_name: string,
+    py_base_name: string): ref PyExceptionDef {. compileTime .} =
+  new(result)
+
+  result.nim_type = nim_type
+  result.def_line_info = def_line_info
+  result.py_name = py_name
+  result.py_base_name = py_base_name
+
+proc getKey*(ped: ref PyExceptionDef): string {. compileTime .} =
+  result = ped.nim_type
+
+
 type TypeFmtTuple* = tuple[
     # The Nim type of the parameter or return value being exported.
     # Note that it DOES contain any "ptr" prefix that will be used
@@ -109,7 +143,24 @@ type ProcPrototype* = tuple[
     return_type_fmt_tuple: seq[TypeFmtTuple],
     param_name_type_tuple_seq: seq[ref ParamNameTypeTuple],
     docstring_lines: seq[string],
-    do_return_dict: bool
+    do_return_dict: bool,
+    # Whether this is a Nim iterator (whose return type is the type of the
+    # yielded items), which is exported as a Python iterator.
+    is_iterator: bool,
+    # The Nim type of the Python class that this proc belongs to, if any (ie,
+    # the type of its first param, for a method); otherwise, nil.
+    class_nim_type: string,
+    # Whether this proc (which returns `class_nim_type`) constructs the class.
+    is_constructor: bool,
+    # The Nim type of the Python class that this proc returns a new Python
+    # object of, if any; otherwise, nil.
+    return_class_nim_type: string,
+    # The name of the generated batch variant of this proc (which calls it for
+    # each element of array args), if it has one (by "batched"); otherwise, nil.
+    batch_proc_name: string,
+    # The maximum number of results that are cached (by "memoize"), keyed on
+    # the args of each call; or 0, if the results aren't cached.
+    memoize_size: int
 ]
 
 proc new_ProcPrototype*(
@@ -118,7 +169,11 @@ proc new_ProcPrototype*(
     return_type_fmt_tuple: seq[TypeFmtTuple],
     param_name_type_tuple_seq: seq[ref ParamNameTypeTuple],
     docstring_lines: seq[string],
-    do_return_dict: bool = false):
+    do_return_dict: bool = false,
+    is_iterator: bool = false,
+    class_nim_type: string = nil,
+    is_constructor: bool = false,
+    return_class_nim_type: string = nil):
     ref ProcPrototype {. compileTime .} =
   new(result)
 
@@ -128,9 +183,66 @@ proc new_ProcPrototype*(
   result.param_name_type_tuple_seq = param_name_type_tuple_seq
   result.docstring_lines = docstring_lines
   result.do_return_dict = do_return_dict
+  result.is_iterator = is_iterator
+  result.class_nim_type = class_nim_type
+  result.is_constructor = is_constructor
+  result.return_class_nim_type = return_class_nim_type
+  result.batch_proc_name = nil
+  result.memoize_size = 0
+
+proc getProcPrototypeKey*(proc_name, class_nim_type: string): string
+    {. compileTime .} =
+  # The procs of a Python class are qualified by the class (so, for example,
+  # several classes can each have a `feed` method).
+  if class_nim_type == nil:
+    result = proc_name
+  else:
+    result = class_nim_type & "." & proc_name
 
 proc getKey*(ptfs: ref ProcPrototype): string {. compileTime .} =
-  result = ptfs.proc_name
+  result = getProcPrototypeKey(ptfs.proc_name, ptfs.class_nim_type)
+
+
+# A Nim `ref object` type that is exported as a Python class (a "kernel"):
+# The Python object refers to a Nim object, whose state persists between the
+# calls of its methods.  Or a Nim `object` type that is exported as a Python
+# extension type (by `exportpytype`):  The Nim object is stored inline in the
+# Python object.
+type PyClassDef* = tuple[
+    # The Nim type, eg "MeanKernel".  This is also the name of the Python class.
+    nim_type: string,
+    # The Nim source line on which the Python class was defined.
+    def_line_info: string,
+    # Whether the Nim object is stored inline in the Python object (rather
+    # than referred to by it).
+    is_inline_object: bool,
+    # The exported (`*`) fields of an inline Nim object, which are the
+    # attributes of the Python object.
+    fields: seq[ref ParamNameTypeTuple],
+    # The key (in the `ProcPrototypeTable`) of the exported proc (marked by the
+    # "pyConstructor" pragma) that returns a new Nim object of this type, which is
+    # the Python constructor; or nil.
+    constructor_key: string,
+    # The keys (in the `ProcPrototypeTable`) of the exported procs that take a
+    # Nim object of this type as their first param, which are Python methods.
+    method_keys: seq[string]
+]
+
+proc new_PyClassDef*(
+    nim_type: string,
+    def_line_info: string,
+    is_inline_object: bool = false): ref PyClassDef {. compileTime .} =
+  new(result)
+
+  result.nim_type = nim_type
+  result.def_line_info = def_line_info
+  result.is_inline_object = is_inline_object
+  result.fields = @[]
+  result.constructor_key = nil
+  result.method_keys = @[]
+
+proc getKey*(pcd: ref PyClassDef): string {. compileTime .} =
+  result = pcd.nim_type
 
 
 # Implementation detail:
@@ -176,5 +288,7 @@ proc `<<`*[T](tab: var seq[HashedElem[T]], val: ref T) {. compileTime .} =
 
 type PyObjectTypeDefTable* = seq[HashedElem[PyObjectTypeDef]]
 type ProcPrototypeTable* = seq[HashedElem[ProcPrototype]]
+type PyExceptionDefTable* = seq[HashedElem[PyExceptionDef]]
+type PyClassDefTable* = seq[HashedElem[PyClassDef]]
 type NimModulesToImportTable* = seq[string]
 
@@ -769,6 +769,29 @@ template createSimpleNew*(dims: openarray[int], nptype: NpType):
       WhereItCameFrom.AllocInNim, "createSimpleNew", ii)
 
 
+proc createSimpleNewFromValuesImpl[T: NumpyCompatibleNimType](values: openarray[T],
+    created_at: InstantiationInfoTuple): ptr PyArrayObject =
+  # Create a new 1-D array of the same length & element type as `values`, and
+  # copy all the elements into it at once.  (A new Numpy array is C-contiguous,
+  # so its elements are laid out exactly like the elements of `values`.)
+  result = createSimpleNewOpenArrayImpl([values.len], toNpType(T), created_at,
+      "createSimpleNewFromValues")
+  if result != nil and values.len > 0:
+    copyMem(result.data, unsafeAddr(values[0]), values.len * sizeof(T))
+
+template createSimpleNewFromValues*(values: expr): ptr PyArrayObject =
+  ## Create a new 1-D Numpy array that contains a copy of `values` (a Nim
+  ## `seq[T]`, `array[N, T]` or `openarray[T]` of a `NumpyCompatibleNimType`).
+  ##
+  ## This is also used to return a `seq[T]` or `array[N, T]` from an exported
+  ## proc to Python.
+  # http://nim-lang.org/system.html#instantiationInfo,
+  let ii = instantiationInfo()
+  registerNewPyObject(
+      createSimpleNewFromValuesImpl(values, ii),
+      WhereItCameFrom.AllocInNim, "createSimpleNewFromValues", ii)
+
+
 proc createNewCopyNewDataImpl(old: ptr PyArrayObject, order: cint): ptr PyArrayObject
     {. importc: "createNewCopyNewDataImpl", header: "pymodpkg/private/pyarrayobject_c.h", cdecl .}
   ## Equivalent to `ndarray.copy(self, fortran)`.  Make a copy of the `old` array.
@@ -43,3 +43,70 @@ proc raisePyValueError*(msg: cstring): ptr PyObject {.
 proc getPyNone*(): ptr PyObject {.
   importc: "getPyNone", header: "pymodpkg/private/pyobject_c.h" .}
 
+
+# Create new PyObjects directly from Nim values, for the return values of the
+# exported procs.  Each returns a new reference, or nil (with a Python
+# exception set).
+proc newPyInt*(val: clong): ptr PyObject {.
+  importc: "newPyInt", header: "pymodpkg/private/pyobject_c.h" .}
+
+proc newPyIntFromUnsigned*(val: culong): ptr PyObject {.
+  importc: "newPyIntFromUnsigned", header: "pymodpkg/private/pyobject_c.h" .}
+
+proc newPyFloat*(val: cdouble): ptr PyObject {.
+  importc: "newPyFloat", header: "pymodpkg/private/pyobject_c.h" .}
+
+proc newPyChar*(val: cchar): ptr PyObject {.
+  importc: "newPyChar", header: "pymodpkg/private/pyobject_c.h" .}
+
+proc newPyStr*(s: cstring, len: int): ptr PyObject {.
+  importc: "newPyStr", header: "pymodpkg/private/pyobject_c.h" .}
+
+# A nil Nim string is converted to None (since converting it to a `cstring`
+# might instead produce an empty string).
+proc newPyStr*(s: string): ptr PyObject =
+  if s.isNil:
+    result = newPyStr(nil, 0)
+  else:
+    result = newPyStr(s, s.len)
+
+proc newPyStrFromCString*(s: cstring): ptr PyObject {.
+  importc: "newPyStrFromCString", header: "pymodpkg/private/pyobject_c.h" .}
+
+proc newPyRef*(obj: ptr PyObject): ptr PyObject {.
+  importc: "newPyRef", header: "pymodpkg/private/pyobject_c.h" .}
+
+# The tuple steals the `n` new references supplied as the variadic arguments.
+proc packNewPyTuple*(n: int): ptr PyObject {.
+  importc: "packNewPyTuple", header: "pymodpkg/private/pyobject_c.h", varargs .}
+
+proc seqArgToSeq*[T](data: pointer, len: int): seq[T] =
+  ## Copy the C array of `len` elements of type `T` at `data` (the elements of
+  ## a Python argument for a `seq[T]` or `openarray[T]` param) into a new seq.
+  newSeq(result, len)
+  if len > 0:
+    copyMem(addr(result[0]), data, len * sizeof(T))
+
+proc newPyNimIterator*(state: pointer,
+    next: proc (state: pointer): ptr PyObject {. cdecl .},
+    release: proc (state: pointer) {. cdecl .}): ptr PyObject {.
+  importc: "newPyNimIterator", header: "pymodpkg/private/pyobject_c.h" .}
+  ## Create a new Python iterator, which calls `next(state)` for each item (a
+  ## new reference, or nil when the iteration has finished or failed), and
+  ## `release(state)` when it no longer needs `state`.  If the Python iterator
+  ## can't be created, `release(state)` is called immediately.
+
+# The Python exception types raised for Nim exceptions.
+var PyExc_AssertionError* {. importc: "PyExc_AssertionError", header: "<Python.h>" .}: ptr PyObject
+var PyExc_IndexError* {. importc: "PyExc_IndexError", header: "<Python.h>" .}: ptr PyObject
+var PyExc_KeyError* {. importc: "PyExc_KeyError", header: "<Python.h>" .}: ptr PyObject
+var PyExc_RuntimeError* {. importc: "PyExc_RuntimeError", header: "<Python.h>" .}: ptr PyObject
+var PyExc_TypeError* {. importc: "PyExc_TypeError", header: "<Python.h>" .}: ptr PyObject
+var PyExc_ValueError* {. importc: "PyExc_ValueError", header: "<Python.h>" .}: ptr PyObject
+
+proc raisePyErrorWithNimTraceback*(exc_type: ptr PyObject, msg, nim_stack_trace: cstring):
+    ptr PyObject {.
+  importc: "raisePyErrorWithNimTraceback", header: "pymodpkg/private/pyobject_c.h" .}
+  ## Raise a Python exception of type `exc_type` with message `msg`, and attach
+  ## the Nim stack trace as attribute `nim_traceback`, which is formatted
+  ## (like a Python traceback) only when it's converted to a string.
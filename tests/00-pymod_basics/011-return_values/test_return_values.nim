@@ -0,0 +1,35 @@
+import pymod
+
+
+proc returnHighInt*(): int {.exportpy.} = high(int)
+proc returnLowInt*(): int {.exportpy.} = low(int)
+proc returnHighInt16*(): int16 {.exportpy.} = high(int16)
+proc returnHighUint32*(): uint32 {.exportpy.} = high(uint32)
+proc returnHighUint64*(): uint64 {.exportpy.} = not 0'u64
+
+proc returnFloat64*(): float64 {.exportpy.} = -1.5e300
+proc returnFloat32*(): float32 {.exportpy.} = 0.25
+
+proc returnChar*(): char {.exportpy.} = 'z'
+
+proc returnString*(): string {.exportpy.} = "Hello, World!"
+proc returnEmptyString*(): string {.exportpy.} = ""
+proc returnNilString*(): string {.exportpy.} = nil
+proc returnStringWithNul*(): string {.exportpy.} = "a\0b"
+proc returnUtf8String*(): string {.exportpy.} = "caf\xC3\xA9"
+
+proc returnMixedTuple*(): tuple[i: int, f: float64, c: char, s: string] {.exportpy.} =
+  (i: -7, f: 2.5, c: 'x', s: "seven")
+proc returnTupleWithNilString*(): tuple[i: int, s: string] {.exportpy.} = (i: 1, s: nil)
+
+proc returnMixedDict*(): tuple[i: int, f: float64, c: char, s: string] {.exportpy returnDict.} =
+  (i: -7, f: 2.5, c: 'x', s: "seven")
+
+
+initPyModule("",
+    returnHighInt, returnLowInt, returnHighInt16, returnHighUint32, returnHighUint64,
+    returnFloat64, returnFloat32,
+    returnChar,
+    returnString, returnEmptyString, returnNilString, returnStringWithNul, returnUtf8String,
+    returnMixedTuple, returnTupleWithNilString,
+    returnMixedDict)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import sys
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+def test_returnInts(pymod_test_mod):
+    assert pymod_test_mod.returnHighInt() == 2**63 - 1
+    assert pymod_test_mod.returnLowInt() == -2**63
+    assert pymod_test_mod.returnHighInt16() == 2**15 - 1
+    assert pymod_test_mod.returnHighUint32() == 2**32 - 1
+    assert pymod_test_mod.returnHighUint64() == 2**64 - 1
+
+
+def test_returnFloats(pymod_test_mod):
+    res = pymod_test_mod.returnFloat64()
+    assert type(res) == float
+    assert res == -1.5e300
+    assert pymod_test_mod.returnFloat32() == 0.25
+
+
+def test_returnChar(pymod_test_mod):
+    assert pymod_test_mod.returnChar() == "z"
+
+
+def test_returnStrings(pymod_test_mod):
+    assert pymod_test_mod.returnString() == "Hello, World!"
+    assert pymod_test_mod.returnEmptyString() == ""
+    assert pymod_test_mod.returnStringWithNul() == "a\0b"
+
+
+def test_returnNilString(pymod_test_mod):
+    assert pymod_test_mod.returnNilString() is None
+
+
+def test_returnUtf8String(pymod_test_mod):
+    res = pymod_test_mod.returnUtf8String()
+    if sys.version_info.major >= 3:
+        assert res == u"café"
+    else:
+        assert res == "caf\xc3\xa9"
+
+
+def test_returnMixedTuple(pymod_test_mod):
+    res = pymod_test_mod.returnMixedTuple()
+    assert type(res) == tuple
+    assert res == (-7, 2.5, "x", "seven")
+    assert pymod_test_mod.returnTupleWithNilString() == (1, None)
+
+
+def test_returnMixedDict(pymod_test_mod):
+    res = pymod_test_mod.returnMixedDict()
+    assert type(res) == dict
+    assert res == {"i": -7, "f": 2.5, "c": "x", "s": "seven"}
+    # A new dict is returned by each call.
+    res["i"] = 0
+    assert pymod_test_mod.returnMixedDict()["i"] == -7
@@ -0,0 +1,5 @@
+import pymod
+
+proc returnHello*(): string {.exportpy.} = "Hello"
+
+initPyModule("", returnHello)
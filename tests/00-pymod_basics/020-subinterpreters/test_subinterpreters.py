@@ -0,0 +1,30 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+@pytest.mark.skipif(sys.version_info.major < 3, reason="multi-phase init requires Python 3")
+def test_reimport_after_removal_from_sys_modules(pymod_test_mod):
+    mod_name = pymod_test_mod.__name__
+    del sys.modules[mod_name]
+    mod = importlib.import_module(mod_name)
+    assert mod is not pymod_test_mod
+    assert mod.returnHello() == "Hello"
+    assert pymod_test_mod.returnHello() == "Hello"
+
+
+@pytest.mark.skipif(sys.version_info.major < 3, reason="multi-phase init requires Python 3")
+def test_import_into_subinterpreter(pymod_test_mod):
+    _testcapi = pytest.importorskip("_testcapi")
+    # The sub-interpreter shares the GIL (& the Nim runtime) with the main
+    # interpreter, but gets its own module object.
+    code = ("import sys; sys.path.insert(0, %r); import %s as m; "
+            "assert m.returnHello() == 'Hello'") % (os.getcwd(), pymod_test_mod.__name__)
+    assert _testcapi.run_in_subinterp(code) == 0
+    assert pymod_test_mod.returnHello() == "Hello"
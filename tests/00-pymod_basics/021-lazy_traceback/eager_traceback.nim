@@ -0,0 +1,8 @@
+import pymod
+
+
+proc raiseValueError*(msg: string): int {.exportpy.} =
+  raise newException(ValueError, msg)
+
+
+initPyModule("", raiseValueError)
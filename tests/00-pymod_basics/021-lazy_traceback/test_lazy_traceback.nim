@@ -0,0 +1,12 @@
+import pymod
+import pymodpkg/miscutils
+
+
+proc raiseValueError*(msg: string): int {.exportpy.} =
+  raise newException(ValueError, msg)
+
+proc prettyPrint*(stack_trace: string): string {.exportpy.} =
+  result = prettyPrintStackTrace(stack_trace)
+
+
+initPyModule("", raiseValueError, prettyPrint)
@@ -0,0 +1,43 @@
+import importlib
+
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__, "--lazyTraceback")
+
+
+def test_exception_has_just_the_message(pymod_test_mod):
+    with pytest.raises(ValueError) as excinfo:
+        pymod_test_mod.raiseValueError("bad input")
+    assert str(excinfo.value) == "bad input"
+
+
+def test_nim_traceback_is_formatted_like_prettyPrintStackTrace(pymod_test_mod):
+    with pytest.raises(ValueError) as excinfo:
+        pymod_test_mod.raiseValueError("bad input")
+    nim_traceback = excinfo.value.nim_traceback
+
+    raw = nim_traceback.raw
+    assert raw.startswith("Traceback")
+    assert "raiseValueError" in raw
+    formatted = str(nim_traceback)
+    assert formatted.startswith("Nim traceback (most recent call last):\n")
+    assert '  File "' in formatted
+    assert formatted != raw
+    assert formatted == pymod_test_mod.prettyPrint(raw)
+    assert repr(nim_traceback) == formatted
+    # The raw stack trace is unchanged by formatting it.
+    assert nim_traceback.raw == raw
+
+
+def test_nim_traceback_only_with_lazyTraceback(pmgen_py_compile, tmpdir, monkeypatch):
+    pmgen_py_compile("eager_traceback",
+            "--buildDir", str(tmpdir.join("pmgen")), "--outputDir", str(tmpdir))
+    monkeypatch.syspath_prepend(str(tmpdir))
+    eager_mod = importlib.import_module("_eager_traceback")
+
+    with pytest.raises(ValueError) as excinfo:
+        eager_mod.raiseValueError("bad input")
+    assert str(excinfo.value).startswith("bad input\nNim traceback (most recent call last):\n")
+    assert not hasattr(excinfo.value, "nim_traceback")
@@ -0,0 +1,27 @@
+import pymod
+
+type ParseError* = object of ValueError
+type BadHeaderError* = object of ParseError
+type OtherError* = object of Exception
+
+definePyException(ParseError, "ParseError", "ValueError")
+definePyException(BadHeaderError, "BadHeaderError", "ParseError")
+
+proc raiseParseError*(msg: string): int {.exportpy.} =
+  raise newException(ParseError, msg)
+
+proc raiseBadHeaderError*(msg: string): int {.exportpy.} =
+  raise newException(BadHeaderError, msg)
+
+proc raiseNimException*(which: string): int {.exportpy.} =
+  case which
+  of "KeyError": raise newException(KeyError, which)
+  of "IndexError": raise newException(IndexError, which)
+  of "RangeError": raise newException(RangeError, which)
+  of "ObjectConversionError": raise newException(ObjectConversionError, which)
+  of "AssertionError": raise newException(AssertionError, which)
+  of "ValueError": raise newException(ValueError, which)
+  else: raise newException(OtherError, which)
+
+initPyModule("",
+    raiseParseError, raiseBadHeaderError, raiseNimException)
@@ -0,0 +1,58 @@
+import importlib
+import sys
+
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+def test_exception_classes_are_module_attributes(pymod_test_mod):
+    assert issubclass(pymod_test_mod.ParseError, ValueError)
+    assert issubclass(pymod_test_mod.BadHeaderError, pymod_test_mod.ParseError)
+    assert pymod_test_mod.ParseError.__module__ == pymod_test_mod.__name__
+    assert pymod_test_mod.BadHeaderError.__name__ == "BadHeaderError"
+
+
+def test_raise_defined_exception(pymod_test_mod):
+    with pytest.raises(pymod_test_mod.ParseError) as excinfo:
+        pymod_test_mod.raiseParseError("bad input")
+    assert type(excinfo.value) is pymod_test_mod.ParseError
+    assert "bad input" in str(excinfo.value)
+
+
+def test_raise_defined_subtype_exception(pymod_test_mod):
+    with pytest.raises(pymod_test_mod.BadHeaderError) as excinfo:
+        pymod_test_mod.raiseBadHeaderError("bad header")
+    assert type(excinfo.value) is pymod_test_mod.BadHeaderError
+    assert isinstance(excinfo.value, pymod_test_mod.ParseError)
+    assert "bad header" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("nim_exc_name, py_exc_type", [
+        ("KeyError", KeyError),
+        ("IndexError", IndexError),
+        ("RangeError", IndexError),
+        ("ObjectConversionError", TypeError),
+        ("AssertionError", AssertionError),
+        ("ValueError", ValueError),
+        ("OtherError", RuntimeError),
+])
+def test_raise_builtin_exception(pymod_test_mod, nim_exc_name, py_exc_type):
+    with pytest.raises(py_exc_type) as excinfo:
+        pymod_test_mod.raiseNimException(nim_exc_name)
+    assert type(excinfo.value) is py_exc_type
+    assert nim_exc_name in str(excinfo.value)
+
+
+@pytest.mark.skipif(sys.version_info.major < 3, reason="multi-phase init requires Python 3")
+def test_reimported_module_has_its_own_exception_classes(pymod_test_mod):
+    mod_name = pymod_test_mod.__name__
+    del sys.modules[mod_name]
+    mod = importlib.import_module(mod_name)
+    assert mod is not pymod_test_mod
+    assert mod.ParseError is not pymod_test_mod.ParseError
+    assert issubclass(mod.BadHeaderError, mod.ParseError)
+    with pytest.raises(mod.BadHeaderError):
+        mod.raiseBadHeaderError("bad header")
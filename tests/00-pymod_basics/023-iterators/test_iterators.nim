@@ -0,0 +1,29 @@
+import strutils
+
+import pymod
+import pymodpkg/pyobject
+
+iterator countTo*(n: int): int {.exportpy.} =
+  for i in 0 .. <n:
+    yield i
+
+iterator countPairs*(n: int): tuple[i: int, sq: int] {.exportpy.} =
+  for i in 0 .. <n:
+    yield (i, i * i)
+
+iterator splitWords*(s: string): string {.exportpy.} =
+  for word in s.split(' '):
+    yield word
+
+iterator countUntilFail*(n, fail_at: int): int {.exportpy.} =
+  for i in 0 .. <n:
+    if i == fail_at:
+      raise newException(ValueError, "failed at " & $i)
+    yield i
+
+iterator countWithObj*(obj: ptr PyObject, n: int): int {.exportpy.} =
+  for i in 0 .. <n:
+    yield i
+
+initPyModule("",
+    countTo, countPairs, splitWords, countUntilFail, countWithObj)
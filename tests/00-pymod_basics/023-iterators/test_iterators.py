@@ -0,0 +1,84 @@
+import gc
+import sys
+
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+def test_iterate(pymod_test_mod):
+    it = pymod_test_mod.countTo(5)
+    assert iter(it) is it
+    assert list(it) == [0, 1, 2, 3, 4]
+    # An exhausted iterator stays exhausted.
+    assert list(it) == []
+    assert list(pymod_test_mod.countTo(0)) == []
+
+
+def test_iterate_tuples(pymod_test_mod):
+    assert list(pymod_test_mod.countPairs(4)) == [(0, 0), (1, 1), (2, 4), (3, 9)]
+
+
+def test_iterate_lazily(pymod_test_mod):
+    it = pymod_test_mod.countTo(sys.maxsize)
+    assert next(it) == 0
+    assert next(it) == 1
+    assert next(it) == 2
+
+
+def test_string_arg_outlives_call(pymod_test_mod):
+    s = " ".join(["word%d" % i for i in range(3)])
+    it = pymod_test_mod.splitWords(s)
+    del s
+    gc.collect()
+    assert list(it) == ["word0", "word1", "word2"]
+
+
+def test_break_early(pymod_test_mod):
+    # The Nim closure iterator is released when the Python iterator is
+    # deallocated before it's exhausted.
+    for _ in range(1000):
+        for i in pymod_test_mod.countTo(100):
+            if i == 3:
+                break
+    it = pymod_test_mod.countTo(100)
+    assert next(it) == 0
+    del it
+    gc.collect()
+    assert list(pymod_test_mod.countTo(3)) == [0, 1, 2]
+
+
+def test_raise_mid_iteration(pymod_test_mod):
+    it = pymod_test_mod.countUntilFail(10, 3)
+    assert next(it) == 0
+    assert next(it) == 1
+    assert next(it) == 2
+    with pytest.raises(ValueError) as excinfo:
+        next(it)
+    assert "failed at 3" in str(excinfo.value)
+    # The Nim iterator is released once it has failed.
+    with pytest.raises(StopIteration):
+        next(it)
+
+
+def test_py_object_arg_is_referenced(pymod_test_mod):
+    obj = object()
+    refcount = sys.getrefcount(obj)
+
+    it = pymod_test_mod.countWithObj(obj, 3)
+    assert sys.getrefcount(obj) == refcount + 1
+    assert list(it) == [0, 1, 2]
+    # Released when the iterator is exhausted.
+    assert sys.getrefcount(obj) == refcount
+
+    it = pymod_test_mod.countWithObj(obj, 3)
+    assert next(it) == 0
+    assert sys.getrefcount(obj) == refcount + 1
+    # Released when the iterator is deallocated before it's exhausted.
+    del it
+    assert sys.getrefcount(obj) == refcount
+
+    it = pymod_test_mod.countWithObj(None, 2)
+    assert list(it) == [0, 1]
@@ -0,0 +1,47 @@
+import strutils
+
+import pymod
+
+# A kernel that splits a stream of text into lines, carrying the partial line
+# at the end of each chunk over to the next chunk.
+type LineSplitter* = ref object
+  partial: string
+  count: int
+
+exportpyKernel(LineSplitter)
+
+var liveSplitters = 0
+
+proc finalizeSplitter(self: LineSplitter) =
+  dec(liveSplitters)
+
+proc newSplitter(partial: string, count: int): LineSplitter =
+  new(result, finalizeSplitter)
+  inc(liveSplitters)
+  result.partial = partial
+  result.count = count
+
+proc init*(): LineSplitter {.exportpy, pyConstructor.} =
+  result = newSplitter("", 0)
+
+proc feed*(self: LineSplitter, chunk: string): int {.exportpy.} =
+  let lines = (self.partial & chunk).split('\n')
+  self.partial = lines[lines.len-1]
+  result = lines.len - 1
+  inc(self.count, result)
+
+proc numLines*(self: LineSplitter): int {.exportpy.} = self.count
+
+proc remainder*(self: LineSplitter): string {.exportpy.} = self.partial
+
+proc clone*(self: LineSplitter): LineSplitter {.exportpy.} =
+  result = newSplitter(self.partial, self.count)
+
+proc splitterFrom*(partial: string): LineSplitter {.exportpy.} =
+  result = newSplitter(partial, 0)
+
+proc numLiveSplitters*(): int {.exportpy.} =
+  GC_fullCollect()
+  result = liveSplitters
+
+initPyModule("", LineSplitter, splitterFrom, numLiveSplitters)
@@ -0,0 +1,60 @@
+import gc
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+def test_feed_chunks(pymod_test_mod):
+    splitter = pymod_test_mod.LineSplitter()
+    assert type(splitter) is pymod_test_mod.LineSplitter
+    assert splitter.feed("ab") == 0
+    assert splitter.remainder() == "ab"
+    assert splitter.feed("c\nde") == 1
+    assert splitter.feed("f\n\ng") == 2
+    assert splitter.numLines() == 3
+    assert splitter.remainder() == "g"
+
+
+def test_instances_have_their_own_state(pymod_test_mod):
+    splitter1 = pymod_test_mod.LineSplitter()
+    splitter2 = pymod_test_mod.LineSplitter()
+    assert splitter1.feed("a\nb\n") == 2
+    assert splitter2.feed("c") == 0
+    assert splitter1.numLines() == 2
+    assert splitter2.numLines() == 0
+    assert splitter2.remainder() == "c"
+
+
+def test_method_returns_new_instance(pymod_test_mod):
+    splitter = pymod_test_mod.LineSplitter()
+    splitter.feed("a\nb")
+    copy = splitter.clone()
+    assert type(copy) is pymod_test_mod.LineSplitter
+    assert copy is not splitter
+    assert copy.feed("\n") == 1
+    assert copy.numLines() == 2
+    assert splitter.numLines() == 1
+    assert splitter.remainder() == "b"
+
+
+def test_function_returns_new_instance(pymod_test_mod):
+    splitter = pymod_test_mod.splitterFrom("xy")
+    assert type(splitter) is pymod_test_mod.LineSplitter
+    assert splitter.feed("z\n") == 1
+    assert splitter.remainder() == ""
+
+
+def test_dealloc_releases_nim_object(pymod_test_mod):
+    num_live = pymod_test_mod.numLiveSplitters()
+    splitter = pymod_test_mod.LineSplitter()
+    copy = splitter.clone()
+    assert pymod_test_mod.numLiveSplitters() == num_live + 2
+    del splitter
+    gc.collect()
+    assert pymod_test_mod.numLiveSplitters() == num_live + 1
+    # The clone outlives the Python object that it was cloned from.
+    assert copy.feed("a\n") == 1
+    del copy
+    gc.collect()
+    assert pymod_test_mod.numLiveSplitters() == num_live
@@ -0,0 +1,11 @@
+import pymod
+
+type Node = ref object
+  value: int
+
+exportpytype:
+  type Holder* = object
+    count*: int
+    node: Node
+
+initPyModule("", Holder)
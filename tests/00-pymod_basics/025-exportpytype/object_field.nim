@@ -0,0 +1,11 @@
+import pymod
+
+type Label = object
+  text: string
+
+exportpytype:
+  type Labelled* = object
+    count*: int
+    label: Label
+
+initPyModule("", Labelled)
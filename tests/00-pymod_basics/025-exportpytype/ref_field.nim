@@ -0,0 +1,8 @@
+import pymod
+
+exportpytype:
+  type Linked* = object
+    count*: int
+    next: ref Linked
+
+initPyModule("", Linked)
@@ -0,0 +1,8 @@
+import pymod
+
+exportpytype:
+  type Samples* = object
+    count*: int
+    values*: seq[float64]
+
+initPyModule("", Samples)
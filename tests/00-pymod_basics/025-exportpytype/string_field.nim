@@ -0,0 +1,8 @@
+import pymod
+
+exportpytype:
+  type Named* = object
+    count*: int
+    name: string
+
+initPyModule("", Named)
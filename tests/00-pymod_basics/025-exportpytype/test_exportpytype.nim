@@ -0,0 +1,28 @@
+import pymod
+
+exportpytype:
+  type Stats* = object
+    count*: int
+    mean*: float64
+    m2: float64
+
+proc push*(self: var Stats, x: float64) {.exportpy.} =
+  inc(self.count)
+  let delta = x - self.mean
+  self.mean += delta / float64(self.count)
+  self.m2 += delta * (x - self.mean)
+
+proc variance*(self: Stats): float64 {.exportpy.} =
+  if self.count < 2:
+    result = 0.0
+  else:
+    result = self.m2 / float64(self.count - 1)
+
+exportpytype:
+  type Point* = object
+    x*, y*: int32
+
+proc manhattan*(self: Point): int {.exportpy.} =
+  result = abs(int(self.x)) + abs(int(self.y))
+
+initPyModule("", Stats, Point)
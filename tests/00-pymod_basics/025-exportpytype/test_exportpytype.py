@@ -0,0 +1,102 @@
+import subprocess
+
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+def test_construct_from_field_kwargs(pymod_test_mod):
+    s = pymod_test_mod.Stats(count=2, mean=1.5)
+    assert type(s) is pymod_test_mod.Stats
+    assert s.count == 2
+    assert s.mean == 1.5
+
+    p = pymod_test_mod.Point(3, y=-4)
+    assert (p.x, p.y) == (3, -4)
+
+
+def test_construct_with_default_fields(pymod_test_mod):
+    s = pymod_test_mod.Stats()
+    assert s.count == 0
+    assert s.mean == 0.0
+    p = pymod_test_mod.Point(y=7)
+    assert (p.x, p.y) == (0, 7)
+
+
+def test_construct_with_unknown_field(pymod_test_mod):
+    with pytest.raises(TypeError):
+        pymod_test_mod.Stats(m2=1.0)
+    with pytest.raises(TypeError):
+        pymod_test_mod.Point(1, 2, 3)
+
+
+def test_get_and_set_fields(pymod_test_mod):
+    p = pymod_test_mod.Point(1, 2)
+    p.x = -10
+    p.y = 20
+    assert (p.x, p.y) == (-10, 20)
+    assert p.manhattan() == 30
+
+    s = pymod_test_mod.Stats()
+    s.count = 5
+    s.mean = 2.5
+    assert s.count == 5
+    assert s.mean == 2.5
+
+
+def test_unexported_field_is_not_an_attribute(pymod_test_mod):
+    s = pymod_test_mod.Stats()
+    assert not hasattr(s, "m2")
+
+
+def test_set_field_type_errors(pymod_test_mod):
+    s = pymod_test_mod.Stats(count=1)
+    with pytest.raises(TypeError):
+        s.count = "one"
+    with pytest.raises(TypeError):
+        s.mean = "1.0"
+    with pytest.raises(AttributeError):
+        del s.count
+    assert s.count == 1
+
+    p = pymod_test_mod.Point()
+    with pytest.raises(OverflowError):
+        p.x = 2 ** 40
+    assert p.x == 0
+
+
+def test_var_method_mutates_state(pymod_test_mod):
+    s = pymod_test_mod.Stats()
+    for x in [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]:
+        s.push(x)
+    assert s.count == 8
+    assert s.mean == pytest.approx(5.0)
+    assert s.variance() == pytest.approx(32.0 / 7)
+
+    # The Nim object is stored in the Python object, so it isn't shared.
+    t = pymod_test_mod.Stats(count=s.count, mean=s.mean)
+    t.push(5.0)
+    assert t.count == 9
+    assert s.count == 8
+
+
+@pytest.mark.parametrize("nim_fname", [
+        "string_field.nim",
+        "seq_field.nim",
+        "ref_field.nim",
+        # The field types below are only GC-managed once they're resolved.
+        "named_ref_field.nim",
+        "object_field.nim",
+])
+def test_gc_managed_field_is_rejected(python_exe_fullpath, pmgen_py_fullpath, tmpdir,
+        nim_fname):
+    proc = subprocess.Popen([python_exe_fullpath, pmgen_py_fullpath,
+            "--buildDir", str(tmpdir.join("pmgen")), "--outputDir", str(tmpdir),
+            nim_fname],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode("UTF-8", "replace")
+    assert proc.returncode != 0
+    assert "is managed by the Nim GC" in output
+    assert not tmpdir.listdir(lambda p: p.ext in (".so", ".pyd"))
@@ -0,0 +1,21 @@
+import pymod
+
+var calls = 0
+
+proc square*(x: int): int {.exportpy, memoize: 3.} =
+  inc(calls)
+  result = x * x
+
+proc joinWords*(a, b: string): string {.exportpy, memoize: 8.} =
+  inc(calls)
+  result = a & "|" & b
+
+proc positive*(x: int): int {.exportpy, memoize: 4.} =
+  inc(calls)
+  if x < 0:
+    raise newException(ValueError, "negative: " & $x)
+  result = x
+
+proc numCalls*(): int {.exportpy.} = calls
+
+initPyModule("", square, joinWords, positive, numCalls)
@@ -0,0 +1,85 @@
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+@pytest.fixture
+def memo_mod(pymod_test_mod):
+    for proc_name in ["square", "joinWords", "positive"]:
+        getattr(pymod_test_mod, proc_name + "_cache_clear")()
+    return pymod_test_mod
+
+
+def test_hits_and_misses(memo_mod):
+    num_calls = memo_mod.numCalls()
+    assert memo_mod.square_cache_info() == (0, 0, 3, 0)
+    assert memo_mod.square(2) == 4
+    assert memo_mod.numCalls() == num_calls + 1
+    assert memo_mod.square(2) == 4
+    assert memo_mod.square(x=2) == 4
+    # The Nim proc isn't called for a cached result.
+    assert memo_mod.numCalls() == num_calls + 1
+    assert memo_mod.square(3) == 9
+    assert memo_mod.numCalls() == num_calls + 2
+    assert memo_mod.square_cache_info() == (2, 2, 3, 2)
+
+
+def test_cached_result_is_same_object(memo_mod):
+    res = memo_mod.joinWords("spam", "eggs")
+    assert res == "spam|eggs"
+    assert memo_mod.joinWords("spam", "eggs") is res
+
+
+def test_lru_eviction_at_capacity(memo_mod):
+    for x in [1, 2, 3]:
+        memo_mod.square(x)
+    assert memo_mod.square_cache_info() == (0, 3, 3, 3)
+    # Use 1 again, so 2 is the least-recently used.
+    memo_mod.square(1)
+    num_calls = memo_mod.numCalls()
+    assert memo_mod.square(4) == 16
+    assert memo_mod.square_cache_info() == (1, 4, 3, 3)
+    assert memo_mod.numCalls() == num_calls + 1
+
+    # 1, 3 & 4 are cached; 2 was evicted.
+    for x in [1, 3, 4]:
+        assert memo_mod.square(x) == x * x
+    assert memo_mod.numCalls() == num_calls + 1
+    assert memo_mod.square(2) == 4
+    assert memo_mod.numCalls() == num_calls + 2
+    assert memo_mod.square_cache_info() == (4, 5, 3, 3)
+
+
+def test_cache_clear(memo_mod):
+    memo_mod.square(5)
+    memo_mod.square(5)
+    assert memo_mod.square_cache_info() == (1, 1, 3, 1)
+    memo_mod.square_cache_clear()
+    assert memo_mod.square_cache_info() == (0, 0, 3, 0)
+    num_calls = memo_mod.numCalls()
+    assert memo_mod.square(5) == 25
+    assert memo_mod.numCalls() == num_calls + 1
+    # The caches of the procs are separate.
+    assert memo_mod.joinWords_cache_info() == (0, 0, 8, 0)
+
+
+def test_string_keys_are_delimited(memo_mod):
+    assert memo_mod.joinWords("ab", "c") == "ab|c"
+    assert memo_mod.joinWords("a", "bc") == "a|bc"
+    assert memo_mod.joinWords("", "abc") == "|abc"
+    assert memo_mod.joinWords("abc", "") == "abc|"
+    assert memo_mod.joinWords_cache_info() == (0, 4, 8, 4)
+    assert memo_mod.joinWords("ab", "c") == "ab|c"
+    assert memo_mod.joinWords_cache_info() == (1, 4, 8, 4)
+
+
+def test_exception_is_not_cached(memo_mod):
+    num_calls = memo_mod.numCalls()
+    for _ in range(2):
+        with pytest.raises(ValueError) as excinfo:
+            memo_mod.positive(-1)
+        assert "negative: -1" in str(excinfo.value)
+    assert memo_mod.numCalls() == num_calls + 2
+    assert memo_mod.positive_cache_info() == (0, 2, 4, 0)
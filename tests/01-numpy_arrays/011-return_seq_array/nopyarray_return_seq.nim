@@ -0,0 +1,5 @@
+import pymod
+
+proc returnSeqInt32*(): seq[int32] {.exportpy.} = @[1'i32, 2, 3]
+
+initPyModule("", returnSeqInt32)
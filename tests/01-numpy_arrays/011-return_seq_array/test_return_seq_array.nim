@@ -0,0 +1,22 @@
+import pymod
+import pymodpkg/pyarrayobject
+
+
+proc returnSeqInt32*(n: int): seq[int32] {.exportpy.} =
+  result = newSeq[int32](n)
+  for i in 0.. <n:
+    result[i] = int32(i * i)
+
+proc returnSeqFloat64*(): seq[float64] {.exportpy.} = @[1.5, -2.25, 1e300]
+
+proc returnEmptySeqUint8*(): seq[uint8] {.exportpy.} = @[]
+
+proc returnArrayInt16*(): array[4, int16] {.exportpy.} = [int16(-1), 0, 1, high(int16)]
+
+proc returnTupleWithSeq*(): tuple[n: int, values: seq[float32]] {.exportpy.} =
+  (n: 3, values: @[0.5'f32, 1.5, 2.5])
+
+
+initPyModule("",
+    returnSeqInt32, returnSeqFloat64, returnEmptySeqUint8, returnArrayInt16,
+    returnTupleWithSeq)
@@ -0,0 +1,60 @@
+import subprocess
+
+import numpy
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__, "--pyarrayEnabled")
+
+
+def test_returnSeqInt32(pymod_test_mod):
+    res = pymod_test_mod.returnSeqInt32(5)
+    assert type(res) == numpy.ndarray
+    assert res.dtype == numpy.int32
+    assert res.shape == (5,)
+    assert res.tolist() == [0, 1, 4, 9, 16]
+
+
+def test_returnSeqFloat64(pymod_test_mod):
+    res = pymod_test_mod.returnSeqFloat64()
+    assert res.dtype == numpy.float64
+    assert res.shape == (3,)
+    assert res.tolist() == [1.5, -2.25, 1e300]
+
+
+def test_returnEmptySeqUint8(pymod_test_mod):
+    res = pymod_test_mod.returnEmptySeqUint8()
+    assert res.dtype == numpy.uint8
+    assert res.shape == (0,)
+
+
+def test_returnArrayInt16(pymod_test_mod):
+    res = pymod_test_mod.returnArrayInt16()
+    assert res.dtype == numpy.int16
+    assert res.shape == (4,)
+    assert res.tolist() == [-1, 0, 1, 2**15 - 1]
+
+
+def test_returned_array_is_a_new_copy(pymod_test_mod):
+    res = pymod_test_mod.returnSeqInt32(3)
+    assert res.flags.owndata and res.flags.writeable and res.flags.c_contiguous
+    res[0] = 100
+    assert pymod_test_mod.returnSeqInt32(3).tolist() == [0, 1, 4]
+
+
+def test_returnTupleWithSeq(pymod_test_mod):
+    (n, values) = pymod_test_mod.returnTupleWithSeq()
+    assert n == 3
+    assert values.dtype == numpy.float32
+    assert values.tolist() == [0.5, 1.5, 2.5]
+
+
+def test_return_seq_requires_pyarrayEnabled(python_exe_fullpath, pmgen_py_fullpath, tmpdir):
+    proc = subprocess.Popen([python_exe_fullpath, pmgen_py_fullpath,
+            "--buildDir", str(tmpdir.join("pmgen")), "--outputDir", str(tmpdir),
+            "nopyarray_return_seq.nim"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode("UTF-8", "replace")
+    assert proc.returncode != 0
+    assert "unless \"pmgen.py\" is invoked with \"--pyarrayEnabled\"" in output
+    assert not tmpdir.join("_nopyarray_return_seq.so").check()
@@ -0,0 +1,36 @@
+import pymod
+
+
+proc sumInt64Seq*(xs: seq[int64]): int64 {.exportpy.} =
+  result = 0
+  for x in xs:
+    result += x
+
+proc sumInt64OpenArray*(xs: openarray[int64]): int64 {.exportpy.} =
+  result = 0
+  for x in xs:
+    result += x
+
+proc sumFloat64Seq*(xs: seq[float64]): float64 {.exportpy.} =
+  result = 0.0
+  for x in xs:
+    result += x
+
+proc sumInt8Seq*(xs: seq[int8]): int {.exportpy.} =
+  result = 0
+  for x in xs:
+    result += int(x)
+
+proc sumUint8Seq*(xs: seq[uint8]): int {.exportpy.} =
+  result = 0
+  for x in xs:
+    result += int(x)
+
+proc lastUint64Seq*(xs: seq[uint64]): uint64 {.exportpy.} = xs[xs.len - 1]
+
+proc countInt32Seq*(xs: seq[int32]): int {.exportpy.} = xs.len
+
+
+initPyModule("",
+    sumInt64Seq, sumInt64OpenArray, sumFloat64Seq, sumInt8Seq, sumUint8Seq,
+    lastUint64Seq, countInt32Seq)
@@ -0,0 +1,71 @@
+import array
+
+import numpy
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__)
+
+
+@pytest.mark.parametrize("nim_test_proc_name", ["sumInt64Seq", "sumInt64OpenArray"])
+def test_sequence_args(pymod_test_mod, nim_test_proc_name):
+    nim_test_proc = getattr(pymod_test_mod, nim_test_proc_name)
+    assert nim_test_proc([1, 2, 3]) == 6
+    assert nim_test_proc((1, 2, 3)) == 6
+    assert nim_test_proc([]) == 0
+    assert nim_test_proc(range(4)) == 6
+
+
+@pytest.mark.parametrize("nim_test_proc_name", ["sumInt64Seq", "sumInt64OpenArray"])
+def test_buffer_args_of_matching_type(pymod_test_mod, nim_test_proc_name):
+    nim_test_proc = getattr(pymod_test_mod, nim_test_proc_name)
+    assert nim_test_proc(numpy.arange(5, dtype=numpy.int64)) == 10
+    assert nim_test_proc(array.array("q", [1, 2, 3])) == 6
+
+
+def test_buffer_args_of_other_types_are_converted(pymod_test_mod):
+    # The buffer can't be used directly, so the elements are converted.
+    assert pymod_test_mod.sumInt64Seq(array.array("i", [1, 2, 3])) == 6
+    assert pymod_test_mod.sumInt64Seq(numpy.arange(5, dtype=numpy.int16)) == 10
+    assert pymod_test_mod.sumFloat64Seq(numpy.arange(4, dtype=numpy.float32)) == 6.0
+    assert pymod_test_mod.sumFloat64Seq([1, 2.5]) == 3.5
+
+
+def test_non_contiguous_array_args_are_converted(pymod_test_mod):
+    arr = numpy.arange(10, dtype=numpy.int64)[::2]
+    assert not arr.flags.c_contiguous
+    assert pymod_test_mod.sumInt64Seq(arr) == 0 + 2 + 4 + 6 + 8
+    assert pymod_test_mod.sumInt64OpenArray(arr) == 0 + 2 + 4 + 6 + 8
+
+
+def test_element_range(pymod_test_mod):
+    assert pymod_test_mod.sumInt8Seq([-128, 127]) == -1
+    assert pymod_test_mod.sumUint8Seq([0, 255]) == 255
+    assert pymod_test_mod.lastUint64Seq([0, 2**64 - 1]) == 2**64 - 1
+
+
+def test_element_overflow(pymod_test_mod):
+    with pytest.raises(OverflowError):
+        pymod_test_mod.sumInt8Seq([1, 128])
+    with pytest.raises(OverflowError):
+        pymod_test_mod.sumInt8Seq([-129])
+    with pytest.raises(OverflowError):
+        pymod_test_mod.sumUint8Seq([256])
+    with pytest.raises(OverflowError):
+        pymod_test_mod.sumUint8Seq([-1])
+    with pytest.raises(OverflowError):
+        pymod_test_mod.countInt32Seq([2**31])
+    with pytest.raises(OverflowError):
+        pymod_test_mod.sumInt64Seq([2**63])
+
+
+def test_non_sequence_args(pymod_test_mod):
+    with pytest.raises(TypeError):
+        pymod_test_mod.sumInt64Seq(5)
+    with pytest.raises(TypeError):
+        pymod_test_mod.sumInt64Seq(None)
+    with pytest.raises(TypeError):
+        pymod_test_mod.sumInt64Seq(["a", "b"])
+    with pytest.raises(TypeError):
+        pymod_test_mod.sumFloat64Seq([1.0, "b"])
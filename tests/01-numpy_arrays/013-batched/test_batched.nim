@@ -0,0 +1,9 @@
+import pymod
+
+proc score*(x: float64, weight: int32): float64 {.exportpy, batched.} =
+  result = x * float64(weight)
+
+proc clampInt*(x: int64, lo: int64, hi: int64): int64 {.exportpy, batched.} =
+  result = max(lo, min(hi, x))
+
+initPyModule("", score, clampInt)
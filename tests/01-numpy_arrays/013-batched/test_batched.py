@@ -0,0 +1,45 @@
+import numpy
+import pytest
+
+
+def test_0_compile_pymod_test_mod(pmgen_py_compile):
+    pmgen_py_compile(__name__, "--pyarrayEnabled")
+
+
+def test_batch_matches_scalar(pymod_test_mod, random_1d_array_size):
+    xs = numpy.random.uniform(-100.0, 100.0, random_1d_array_size)
+    weights = numpy.random.randint(-10, 10, random_1d_array_size).astype(numpy.int32)
+    res = pymod_test_mod.score_batch(xs, weights)
+    assert type(res) == numpy.ndarray
+    assert res.dtype == numpy.float64
+    assert res.shape == (random_1d_array_size,)
+    assert res.tolist() == [pymod_test_mod.score(x, w) for (x, w) in zip(xs, weights)]
+
+
+def test_batch_of_list_args(pymod_test_mod):
+    xs = [-5, 0, 3, 12]
+    res = pymod_test_mod.clampInt_batch(xs, [0] * 4, [10] * 4)
+    assert res.dtype == numpy.int64
+    assert res.tolist() == [0, 0, 3, 10]
+    assert res.tolist() == [pymod_test_mod.clampInt(x, 0, 10) for x in xs]
+
+
+def test_batch_of_mixed_args(pymod_test_mod):
+    # The args are converted to the param types where necessary.
+    xs = numpy.arange(4, dtype=numpy.float32)
+    res = pymod_test_mod.score_batch(xs, (1, 2, 3, 4))
+    assert res.tolist() == [0.0, 2.0, 6.0, 12.0]
+
+
+def test_batch_of_empty_args(pymod_test_mod):
+    res = pymod_test_mod.score_batch([], numpy.array([], dtype=numpy.int32))
+    assert res.dtype == numpy.float64
+    assert res.shape == (0,)
+
+
+def test_batch_of_mismatched_lengths(pymod_test_mod):
+    with pytest.raises(ValueError) as excinfo:
+        pymod_test_mod.score_batch(numpy.zeros(3), numpy.ones(4, dtype=numpy.int32))
+    assert "must all be the same length" in str(excinfo.value)
+    with pytest.raises(ValueError):
+        pymod_test_mod.clampInt_batch([1, 2], [0, 0], [10])
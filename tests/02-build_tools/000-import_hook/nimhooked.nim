@@ -0,0 +1,5 @@
+import pymod
+
+proc greeting*(): string {.exportpy.} = "Hello from the import hook!"
+
+initPyModule("", greeting)
@@ -0,0 +1,84 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+import nim_pm
+
+
+_NIM_MOD_NAME = "nimhooked"
+
+
+@pytest.fixture
+def import_hook(tmpdir, monkeypatch, request):
+    """Install the Nim import hook, using an empty temporary cache directory."""
+    monkeypatch.setenv("NIM_PM_CACHE_DIR", str(tmpdir))
+    finder = nim_pm.install_import_hook()
+    def fin():
+        nim_pm.uninstall_import_hook(finder)
+        sys.modules.pop(_NIM_MOD_NAME, None)
+    request.addfinalizer(fin)
+    return finder
+
+
+def test_import_compiles_nim_module(import_hook, tmpdir):
+    mod = importlib.import_module(_NIM_MOD_NAME)
+    assert mod.greeting() == "Hello from the import hook!"
+    assert mod.__file__.startswith(str(tmpdir))
+
+
+def test_import_reuses_cached_build(import_hook):
+    mod = importlib.import_module(_NIM_MOD_NAME)
+    compiled_fname = mod.__file__
+    compiled_mtime = os.path.getmtime(compiled_fname)
+    sys.modules.pop(_NIM_MOD_NAME)
+
+    mod = importlib.import_module(_NIM_MOD_NAME)
+    assert mod.__file__ == compiled_fname
+    assert os.path.getmtime(compiled_fname) == compiled_mtime
+
+
+def test_import_rebuilds_edited_module(import_hook, tmpdir, monkeypatch):
+    # Compile a copy of the Nim module (which can be edited) in another directory.
+    src_dir = tmpdir.mkdir("src")
+    nim_fname = src_dir.join(_NIM_MOD_NAME + ".nim")
+    with open(_NIM_MOD_NAME + ".nim") as f:
+        nim_source = f.read()
+    nim_fname.write(nim_source)
+    monkeypatch.syspath_prepend(str(src_dir))
+
+    mod = importlib.import_module(_NIM_MOD_NAME)
+    assert mod.greeting() == "Hello from the import hook!"
+    compiled_fname = mod.__file__
+    sys.modules.pop(_NIM_MOD_NAME)
+
+    nim_fname.write(nim_source.replace("Hello from the import hook!",
+            "Hello again from the import hook!"))
+    mod = importlib.import_module(_NIM_MOD_NAME)
+    assert mod.greeting() == "Hello again from the import hook!"
+    assert mod.__file__ != compiled_fname
+
+
+def test_failed_build_is_cleaned_up(import_hook, tmpdir, monkeypatch):
+    src_dir = tmpdir.mkdir("src")
+    src_dir.join("nimbroken.nim").write("import pymod\n\nthis isn't Nim\n")
+    monkeypatch.syspath_prepend(str(src_dir))
+
+    with pytest.raises(ImportError):
+        importlib.import_module("nimbroken")
+    assert "nimbroken" not in sys.modules
+    leftover_dirs = [p for p in tmpdir.visit()
+            if p.check(dir=1) and p.basename in (nim_pm.importhook.CACHE_BUILD_DIRNAME,
+                    nim_pm.importhook.CACHE_OUTPUT_DIRNAME)]
+    assert leftover_dirs == []
+
+
+def test_cache_key_includes_depends(tmpdir):
+    nim_fname = str(tmpdir.join(_NIM_MOD_NAME + ".nim"))
+    helper = tmpdir.join("helper.nim")
+    helper.write("proc helper*(): int = 1\n")
+    key = nim_pm.importhook.get_cache_key(nim_fname, _NIM_MOD_NAME, depends=[str(helper)])
+    helper.write("proc helper*(): int = 2\n")
+    assert nim_pm.importhook.get_cache_key(nim_fname, _NIM_MOD_NAME,
+            depends=[str(helper)]) != key
@@ -0,0 +1,5 @@
+import pymod
+
+proc greeting*(): string {.exportpy.} = "Hello from build_ext!"
+
+initPyModule("", greeting)
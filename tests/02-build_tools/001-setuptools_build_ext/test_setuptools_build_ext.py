@@ -0,0 +1,56 @@
+import importlib
+import os
+import sys
+
+import pytest
+from setuptools import Distribution
+
+from nim_pm.setuptools import NimExtension, build_ext, has_build_profile_arg
+
+
+_NIM_MOD_NAME = "nimext"
+_NIM_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nimext.nim")
+
+
+@pytest.fixture
+def run_build_ext(tmpdir, monkeypatch, request):
+    """Return a function that runs `build_ext`, using an empty temporary cache."""
+    monkeypatch.setenv("NIM_PM_CACHE_DIR", str(tmpdir.join("cache")))
+    build_lib = str(tmpdir.join("build"))
+    def fin():
+        sys.modules.pop(_NIM_MOD_NAME, None)
+        if build_lib in sys.path:
+            sys.path.remove(build_lib)
+    request.addfinalizer(fin)
+
+    def run():
+        dist = Distribution(dict(name="nimext",
+                ext_modules=[NimExtension(_NIM_MOD_NAME, _NIM_FNAME)]))
+        cmd = build_ext(dist)
+        cmd.build_lib = build_lib
+        cmd.ensure_finalized()
+        cmd.run()
+        return cmd.get_ext_fullpath(_NIM_MOD_NAME)
+    return run
+
+
+def test_build_ext_compiles_nim_extension(run_build_ext):
+    ext_fullpath = run_build_ext()
+    sys.path.insert(0, os.path.dirname(ext_fullpath))
+    mod = importlib.import_module(_NIM_MOD_NAME)
+    assert mod.greeting() == "Hello from build_ext!"
+    assert mod.__file__ == ext_fullpath
+
+
+def test_build_ext_reuses_cached_build(run_build_ext, tmpdir):
+    run_build_ext()
+    cache_entries = set(tmpdir.join("cache").listdir())
+    run_build_ext()
+    assert set(tmpdir.join("cache").listdir()) == cache_entries
+
+
+def test_build_profile_in_pmgen_args_is_kept():
+    assert not has_build_profile_arg(["--pyarrayEnabled"])
+    assert has_build_profile_arg(["--release"])
+    assert has_build_profile_arg(["--profile", "danger"])
+    assert has_build_profile_arg(["--profile=lto"])
@@ -0,0 +1,115 @@
+import argparse
+
+import pytest
+
+from nim_pm import pmgen
+from nim_pm.usefulconfigparser import UsefulConfigParser
+
+
+_EXTENSIONS_CFG = """
+[all]
+cCompilerAddFlag: -Wall
+cCompilerAddFlag: -O3   ; an inline comment
+cLinkerAddFlag: -O3
+nimCompilerAddOption: parallelBuild:"1"
+
+[Python]
+cCompilerAddFlag: -DPYTHON_ONLY
+"""
+
+_PYMOD_CFG = """
+[all]
+cCompilerRemoveFlag: -O3
+cCompilerAddFlag: -O2
+cCompilerAddFlag: "-march=native"
+cCompilerAddFlag: -Wall
+nimCompilerRemoveOption: parallelBuild:"1"
+nimCompilerAddOption: gc:"markAndSweep"
+"""
+
+
+@pytest.fixture
+def config(tmpdir, monkeypatch):
+    """Read the config files, as `pmgen.readPymodConfig` does."""
+    extensions_cfg = tmpdir.join("pymod-extensions.cfg")
+    extensions_cfg.write(_EXTENSIONS_CFG)
+    pymod_cfg = tmpdir.join("pymod.cfg")
+    pymod_cfg.write(_PYMOD_CFG)
+
+    c = UsefulConfigParser()
+    assert c.read([str(extensions_cfg), str(pymod_cfg)]) == \
+            [str(extensions_cfg), str(pymod_cfg)]
+    monkeypatch.setattr(pmgen, "CONFIG", c)
+    return c
+
+
+def test_repeated_options_keep_every_value_in_order(config):
+    assert config.get("all", "cCompilerAddFlag") == \
+            ["-Wall", "-O3", "-O2", "\"-march=native\"", "-Wall"]
+    assert config.get("all", "cCompilerRemoveFlag") == ["-O3"]
+
+
+def test_option_names_are_case_insensitive(config):
+    assert config.get("all", "ccompileraddflag") == config.get("all", "cCompilerAddFlag")
+    assert "ccompileraddflag" in config.options("all")
+
+
+def test_missing_section_or_option_is_empty(config):
+    assert config.get("Numpy", "cCompilerAddFlag") == []
+    assert config.get("all", "cApiAddInclude") == []
+    assert config.options("Numpy") == []
+
+
+def test_sections_are_separate(config):
+    assert config.get("Python", "cCompilerAddFlag") == ["-DPYTHON_ONLY"]
+    assert config.get(["all", "Python"], "cLinkerAddFlag") == ["-O3"]
+
+
+def test_add_remove_directives(config):
+    assert pmgen.getAddRemoveOptvals("all", "cCompilerAddFlag", "cCompilerRemoveFlag") == \
+            ["-Wall", "-O2", "-march=native"]
+
+
+def test_nim_cfg_options(config):
+    assert pmgen.getNimCfgOptions("all", ["-lpython3"]) == [
+            'passC:"-Wall -O2 -march=native"',
+            'passL:"-O3 -lpython3"',
+            'gc:"markAndSweep"',
+    ]
+    assert pmgen.getNimCfgOptions("Python") == ['passC:"-DPYTHON_ONLY"']
+
+
+def _read_more_config(config, tmpdir, cfg_content):
+    more_cfg = tmpdir.join("more.cfg")
+    more_cfg.write(cfg_content)
+    config.read([str(more_cfg)])
+
+
+def _get_nimcache_dir(tmpdir, monkeypatch, profile=None):
+    monkeypatch.setenv("NIM_PM_CACHE_DIR", str(tmpdir.join("cache")))
+    args = argparse.Namespace(pymodName=None, pyarrayEnabled=False,
+            profile=profile, release=False)
+    monkeypatch.setattr(pmgen, "NIM_COMPILER_COMMAND", "nim %s")
+    return pmgen.get_nimcache_dir(args, ["nimmod.nim"], str(tmpdir.join("pmgen")))
+
+
+def test_nimcache_dir_depends_on_profile(config, tmpdir, monkeypatch):
+    assert _get_nimcache_dir(tmpdir, monkeypatch, "release") != \
+            _get_nimcache_dir(tmpdir, monkeypatch, "danger")
+
+
+def test_nimcache_dir_depends_on_c_compiler_flags(config, tmpdir, monkeypatch):
+    nimcache_dir = _get_nimcache_dir(tmpdir, monkeypatch)
+    assert _get_nimcache_dir(tmpdir, monkeypatch) == nimcache_dir
+
+    for section_name in ["all", "Python"]:
+        _read_more_config(config, tmpdir, "[%s]\ncCompilerAddFlag: -DNIMCACHE_KEY\n" % section_name)
+        new_nimcache_dir = _get_nimcache_dir(tmpdir, monkeypatch)
+        assert new_nimcache_dir != nimcache_dir
+        nimcache_dir = new_nimcache_dir
+
+
+def test_nimcache_dir_depends_on_c_compiler_launcher(config, tmpdir, monkeypatch):
+    nimcache_dir = _get_nimcache_dir(tmpdir, monkeypatch)
+    _read_more_config(config, tmpdir, "[all]\ncCompilerLauncher: ccache\n")
+    assert _get_nimcache_dir(tmpdir, monkeypatch) != nimcache_dir
@@ -0,0 +1,8 @@
+import pymod
+
+# This top-level code is run by `NimMain`, when the Python module is initialised.
+echo "NimMain has run"
+
+proc lazyGreeting*(): string {.exportpy.} = "Hello from a lazy module!"
+
+initPyModule("", lazyGreeting)
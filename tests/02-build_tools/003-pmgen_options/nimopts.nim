@@ -0,0 +1,7 @@
+import pymod
+
+proc greeting*(): string {.exportpy.} = "Hello from pmgen!"
+
+proc addInts*(a, b: int): int {.exportpy.} = a + b
+
+initPyModule("", greeting, addInts)
@@ -0,0 +1,5 @@
+# The training script for the profile-guided optimisation build ("--pgo").
+import _nimopts
+
+for i in range(1000):
+    _nimopts.addInts(i, i)
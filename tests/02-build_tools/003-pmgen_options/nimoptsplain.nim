@@ -0,0 +1,6 @@
+import pymod
+
+proc greeting*(): string {.exportpy.} = "Hello without an underscore!"
+
+# The same name as the Python module of "nimopts.nim", without the underscore.
+initPyModule("nimopts", greeting)
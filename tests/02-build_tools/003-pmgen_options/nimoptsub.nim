@@ -0,0 +1,5 @@
+import pymod
+
+proc subGreeting*(): string {.exportpy.} = "Hello from a submodule!"
+
+initPyModule("", subGreeting)
@@ -0,0 +1,264 @@
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+
+_NIM_MOD_NAME = "nimopts"
+# `initPyModule("", ...)` names the Python module after the Nim module.
+_PY_MOD_NAME = "_" + _NIM_MOD_NAME
+_TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def src_dir(tmpdir, monkeypatch, request):
+    """Return a directory that contains a copy of the Nim modules, and into
+    which "pmgen" moves the compiled Python modules.  It's prepended to
+    `sys.path`, so the Python modules can be imported.
+    """
+    monkeypatch.setenv("NIM_PM_CACHE_DIR", str(tmpdir.join("cache")))
+    src_dir = tmpdir.mkdir("src")
+    for fname in os.listdir(_TEST_DIR):
+        if fname.endswith(".nim") or fname.endswith("_train.py"):
+            shutil.copy(os.path.join(_TEST_DIR, fname), str(src_dir))
+    monkeypatch.syspath_prepend(str(src_dir))
+
+    modules_before = set(sys.modules)
+    def fin():
+        for mod_name in set(sys.modules) - modules_before:
+            del sys.modules[mod_name]
+    request.addfinalizer(fin)
+    return src_dir
+
+
+@pytest.fixture
+def run_pmgen(src_dir):
+    """Return a function that runs "pmgen" in `src_dir`, with the options
+    `pmgen_args`, to compile the Nim modules `nim_mod_names`.  It returns the
+    output of "pmgen".
+    """
+    def run(pmgen_args=[], nim_mod_names=[_NIM_MOD_NAME], **communicate_kwargs):
+        pmgen_command = [sys.executable, "-m", "nim_pm.pmgen"] + list(pmgen_args) + \
+                [mod_name + ".nim" for mod_name in nim_mod_names]
+        proc = subprocess.Popen(pmgen_command, cwd=str(src_dir),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            output = proc.communicate(**communicate_kwargs)[0].decode("UTF-8", "replace")
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        assert proc.returncode == 0, output
+        return output
+    return run
+
+
+@pytest.mark.skipif(sys.version_info.major < 3, reason="the timeout requires Python 3")
+def test_rebuild_after_editing_module_body(run_pmgen, src_dir):
+    run_pmgen()
+    # Only the body of a proc changes, so the pminc file's content doesn't.
+    nim_modfile = src_dir.join(_NIM_MOD_NAME + ".nim")
+    nim_modfile.write(nim_modfile.read().replace("Hello from pmgen!", "Hello again!"))
+    mtime = nim_modfile.mtime() + 2
+    nim_modfile.setmtime(mtime)
+
+    # This would re-run "pmgen.py" from its own Makefile forever.
+    run_pmgen(timeout=600)
+    pminc_fnames = [p for p in src_dir.join("pmgen").listdir()
+            if p.basename.endswith("_incl.nim")]
+    assert pminc_fnames and all(p.mtime() >= mtime for p in pminc_fnames)
+
+    # The module was compiled again, so import it in a new process.
+    script = "import %s; print(%s.greeting())" % (_PY_MOD_NAME, _PY_MOD_NAME)
+    output = subprocess.check_output([sys.executable, "-c", script],
+            cwd=str(src_dir)).decode("UTF-8")
+    assert output.strip() == "Hello again!"
+
+
+def test_pgo(run_pmgen, src_dir):
+    run_pmgen(["--pgo", _NIM_MOD_NAME + "_train.py"])
+    profile_dir = src_dir.join("pmgen", "pgo-profile")
+    assert [p for p in profile_dir.visit()
+            if p.ext in (".gcda", ".profraw", ".profdata")]
+
+    # Each phase has its own nimcache directory, so a later plain build can't
+    # re-use the instrumented C objects.
+    nimcache_root = src_dir.dirpath("cache", "nimcache")
+    for phase_dirname in ["pgo-generate", "pgo-use"]:
+        assert [p for p in nimcache_root.listdir() if p.join(phase_dirname).check(dir=1)]
+
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.greeting() == "Hello from pmgen!"
+    assert mod.addInts(3, 4) == 7
+
+
+def test_clean_cache(run_pmgen, src_dir):
+    nimcache_root = src_dir.dirpath("cache", "nimcache")
+    run_pmgen(["--profile", "danger"])
+    old_nimcache_dirs = nimcache_root.listdir()
+    assert old_nimcache_dirs
+
+    output = run_pmgen(["--cleanCache"])
+    assert "rm -rf %s" % nimcache_root in output
+    for p in old_nimcache_dirs:
+        assert not p.check()
+    assert len(nimcache_root.listdir()) == 1
+
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.addInts(3, 4) == 7
+
+
+@pytest.mark.parametrize("profile, nim_flag", [
+        ("debug", None),
+        ("release", "-d:release"),
+        ("danger", "-d:danger"),
+        ("lto", "--passC:-flto"),
+])
+def test_profile(run_pmgen, src_dir, profile, nim_flag):
+    output = run_pmgen(["--profile", profile])
+    assert "Build profile: %s" % profile in output
+    if nim_flag:
+        assert nim_flag in output
+
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.addInts(3, 4) == 7
+
+
+def test_profile_overrides_release(run_pmgen):
+    output = run_pmgen(["--release", "--profile", "danger"])
+    assert "Build profile: danger" in output
+
+
+@pytest.mark.skipif(platform.machine().lower() not in ["x86_64", "amd64", "i386", "i686"],
+        reason="--cpuDispatch is only supported on x86")
+def test_cpu_dispatch(run_pmgen, src_dir, monkeypatch):
+    run_pmgen(["--cpuDispatch"])
+    for variant_tag in ["avx512", "avx2", "sse2"]:
+        assert src_dir.join("%s.%s.so" % (_PY_MOD_NAME, variant_tag)).check(file=1)
+    nimcache_root = src_dir.dirpath("cache", "nimcache")
+    for variant_tag in ["avx512", "avx2", "sse2"]:
+        assert [p for p in nimcache_root.listdir()
+                if p.join("cpu-" + variant_tag).check(dir=1)]
+
+    # An unknown variant can't be loaded.
+    proc = subprocess.Popen([sys.executable, "-c", "import " + _PY_MOD_NAME],
+            cwd=str(src_dir), env=dict(os.environ, PYMOD_CPU_VARIANT="nosuchvariant"),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode("UTF-8", "replace")
+    assert proc.returncode != 0
+    assert "unable to load CPU variant" in output
+
+    # The baseline variant runs on every x86-64 CPU.
+    monkeypatch.setenv("PYMOD_CPU_VARIANT", "sse2")
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.greeting() == "Hello from pmgen!"
+    assert mod.addInts(3, 4) == 7
+
+
+def test_build_dir_and_output_dir(run_pmgen, src_dir, tmpdir, monkeypatch):
+    src_fnames = set(p.basename for p in src_dir.listdir())
+    # Two builds of the same Nim module, in different build directories, can
+    # run concurrently.
+    build_procs = []
+    for build_name in ["a", "b"]:
+        pmgen_command = [sys.executable, "-m", "nim_pm.pmgen",
+                "--buildDir", str(tmpdir.join("build-" + build_name)),
+                "--outputDir", str(tmpdir.join("out-" + build_name)),
+                _NIM_MOD_NAME + ".nim"]
+        build_procs.append(subprocess.Popen(pmgen_command, cwd=str(src_dir),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+    for proc in build_procs:
+        output = proc.communicate()[0].decode("UTF-8", "replace")
+        assert proc.returncode == 0, output
+
+    # Nothing is written into the source directory.
+    assert set(p.basename for p in src_dir.listdir()) == src_fnames
+    for build_name in ["a", "b"]:
+        assert tmpdir.join("build-" + build_name, "nim.cfg").check(file=1)
+        assert tmpdir.join("out-" + build_name, _PY_MOD_NAME + ".so").check(file=1)
+
+    monkeypatch.syspath_prepend(str(tmpdir.join("out-a")))
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.greeting() == "Hello from pmgen!"
+    assert mod.__file__ == str(tmpdir.join("out-a", _PY_MOD_NAME + ".so"))
+
+
+def test_timing_report(run_pmgen, src_dir):
+    output = run_pmgen(["--timingReport", "report.json"])
+    assert "Wrote timing report:" in output
+
+    with open(str(src_dir.join("report.json"))) as f:
+        report = json.load(f)
+    assert report["total"]["wall"] > 0.0
+    phase_names = set(record["phase"] for record in report["phases"])
+    assert set(["probe", "configure", "build", "pmgen", "wrapper"]) <= phase_names
+    wrapper_records = [record for record in report["phases"] if record["phase"] == "wrapper"]
+    assert [record["module"] for record in wrapper_records] == [_PY_MOD_NAME]
+
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.greeting() == "Hello from pmgen!"
+
+
+def test_single_pass(run_pmgen, src_dir):
+    output = run_pmgen(["--singlePass"])
+    # The Nim module isn't compiled (without linking) to run the Pymod macros
+    # before the generated wrappers are compiled.
+    assert "--noLinking" not in output
+    assert not [p for p in src_dir.join("pmgen").listdir() if p.basename.endswith("_wrap.nim")]
+
+    mod = importlib.import_module(_PY_MOD_NAME)
+    assert mod.greeting() == "Hello from pmgen!"
+    assert mod.addInts(3, 4) == 7
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="--bundle requires Python 3.7")
+def test_bundle(run_pmgen, src_dir):
+    run_pmgen(["--bundle", "nimbundle"], nim_mod_names=[_NIM_MOD_NAME, "nimoptsub"])
+    assert src_dir.join("nimbundle.so").check(file=1)
+    assert not src_dir.join(_PY_MOD_NAME + ".so").check()
+
+    bundle = importlib.import_module("nimbundle")
+    assert set([_PY_MOD_NAME, "_nimoptsub"]) <= set(dir(bundle))
+    # Each submodule is only initialised when it's first accessed.
+    assert "nimbundle." + _PY_MOD_NAME not in sys.modules
+    assert bundle._nimopts.greeting() == "Hello from pmgen!"
+    assert "nimbundle." + _PY_MOD_NAME in sys.modules
+
+    from nimbundle import _nimoptsub
+    assert _nimoptsub.subGreeting() == "Hello from a submodule!"
+    assert importlib.import_module("nimbundle._nimoptsub") is _nimoptsub
+
+    with pytest.raises(AttributeError):
+        bundle.nosuchmodule
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="--bundle requires Python 3.7")
+def test_bundle_module_names_differing_by_underscore(run_pmgen, src_dir):
+    # The Nim wrapper procs of "_nimopts" & "nimopts" must have distinct names.
+    run_pmgen(["--bundle", "nimbundle"], nim_mod_names=[_NIM_MOD_NAME, "nimoptsplain"])
+    bundle = importlib.import_module("nimbundle")
+    assert bundle._nimopts.greeting() == "Hello from pmgen!"
+    assert bundle.nimopts.greeting() == "Hello without an underscore!"
+
+
+@pytest.mark.skipif(sys.version_info.major < 3, reason="--lazyInit requires Python 3")
+def test_lazy_init(run_pmgen, src_dir):
+    run_pmgen(["--lazyInit"], nim_mod_names=["nimlazy"])
+
+    # The output of `NimMain` is written by C stdio, so run it in a new process.
+    script = "; ".join([
+            "import sys",
+            "import _nimlazy",
+            "print('imported'); sys.stdout.flush()",
+            "greeting = _nimlazy.lazyGreeting()",
+            "greeting = _nimlazy.lazyGreeting()",
+            "print(greeting)"])
+    output = subprocess.check_output([sys.executable, "-c", script],
+            cwd=str(src_dir)).decode("UTF-8")
+    assert output.split("\n") == \
+            ["imported", "NimMain has run", "Hello from a lazy module!", ""]
@@ -45,17 +45,24 @@ def pytest_addoption(parser):
             "override the directory path to the 'pmgen.py' script " + \
             "from the default of '%(default)s'. The path can be specified " + \
             "as a relative path or absolute path."
-    parser.addoption("--pmgen_py_dirpath", type="string", metavar="DIRPATH",
+    parser.addoption("--pmgen_py_dirpath", metavar="DIRPATH",
             default=_PMGEN_PY_DIRPATH_DEFAULT, action="store", dest="pmgen_py_dirpath",
             help=pmgen_py_dirpath_help)
 
     pmgen_py_fname_help = \
             "override the filename of the 'pmgen.py' script " + \
             "from the default of '%(default)s'."
-    parser.addoption("--pmgen_py_fname", type="string", metavar="FNAME",
+    parser.addoption("--pmgen_py_fname", metavar="FNAME",
             default=_PMGEN_PY_FNAME_DEFAULT, action="store", dest="pmgen_py_fname",
             help=pmgen_py_fname_help)
 
+    # The same options can be specified in the "pytest.ini" file (which must
+    # be declared, since it's read with "--strict").
+    parser.addini("pmgen_py_dirpath", pmgen_py_dirpath_help % dict(
+            default=_PMGEN_PY_DIRPATH_DEFAULT))
+    parser.addini("pmgen_py_fname", pmgen_py_fname_help % dict(
+            default=_PMGEN_PY_FNAME_DEFAULT))
+
 
 ##
 ## Utility functions
@@ -254,10 +261,13 @@ def act_upon_test_result(request):
 
 @pytest.fixture
 def pmgen_py_compile(python_exe_fullpath, pmgen_py_fullpath, request):
-    """Return a closure that can be invoked to compile a Pymod Nim module."""
-    def compile_py_mod(py_mod_name):
+    """Return a closure that can be invoked to compile a Pymod Nim module.
+    Any extra arguments (eg, "--pyarrayEnabled") are passed to "pmgen.py".
+    """
+    def compile_py_mod(py_mod_name, *pmgen_args):
         nim_mod_fname = py_mod_name + _NIM_MOD_FNAME_SUFFIX
-        subprocess.check_call([python_exe_fullpath, pmgen_py_fullpath, nim_mod_fname])
+        subprocess.check_call([python_exe_fullpath, pmgen_py_fullpath] +
+                list(pmgen_args) + [nim_mod_fname])
     return compile_py_mod
 
 
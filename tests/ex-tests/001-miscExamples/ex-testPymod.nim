@@ -179,7 +179,7 @@ proc myNumpyAdd*(arr: ptr PyArrayObject, x: int): ptr PyArrayObject {. exportpy
     #   IndexError: PyArrayForwardIter[int32] dereferenced at pos 0x2324470,
     #   out of bounds [0x2324420, 0x232446c], with sizeof(int32) == 4
     #   Nim traceback (most recent call last):
-    #     File "pmgentestpymod3_wrap.nim", line 116, in exportpy_myNumpyAdd
+    #     File "pmgentestpymod3_wrap.nim", line 116, in exportpy_testpymod3_myNumpyAdd
     #     File "testPymod.nim", line 171, in myNumpyAdd
     #     File "pyarrayiters.nim", line 112, in []
     #     File "pyarrayiters.nim", line 102, in assertValid